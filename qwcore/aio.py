@@ -0,0 +1,142 @@
+"""The managed event loops of async subcommands
+
+Subcommand plugins with a coroutine `run` are run on one event loop per thread (a
+uvloop loop, if uvloop is installed), so they can share connection pools and
+executors through the `AsyncContext` in `ctx.meta['qwcore.async_context']`, and
+threads (e.g. of a batch run) can run async subcommands concurrently.  The
+contexts' resources are closed, and the loops are closed, at exit.
+
+This module is only imported when an async subcommand runs, so sync clis don't pay
+for importing asyncio.
+"""
+
+import asyncio
+import atexit
+import os
+import threading
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
+CONTEXT_KEY = 'qwcore.async_context'
+
+# the context and pid of the calling thread
+_local = threading.local()
+# (pid, context) of every thread, closed at exit
+_contexts = []
+_lock = threading.Lock()
+_atexit_registered = False
+
+
+class AsyncContext(object):
+    """Resources shared by the async subcommands run by a thread
+
+    :param loop: the managed event loop of the thread
+    """
+
+    def __init__(self, loop):
+        self.loop = loop
+        self._resources = {}
+        self._closers = []
+        self._executor = None
+
+    def get(self, key, factory, close=None):
+        """Return the resource `key`, created by calling `factory` the first time.
+        `close` is called with the resource when the context is closed, and can be
+        a coroutine function.
+        """
+        if key not in self._resources:
+            resource = self._resources[key] = factory()
+            if close is not None:
+                self.on_close(lambda: close(resource))
+        return self._resources[key]
+
+    def on_close(self, callback):
+        """Call `callback`, which can return an awaitable, when the context is closed"""
+        self._closers.append(callback)
+
+    @property
+    def executor(self):
+        """A shared thread pool executor for blocking calls"""
+        if self._executor is None:
+            from concurrent.futures import ThreadPoolExecutor
+            self._executor = ThreadPoolExecutor()
+            self.on_close(self._executor.shutdown)
+        return self._executor
+
+    def run_in_executor(self, fn, *args):
+        return self.loop.run_in_executor(self.executor, fn, *args)
+
+    async def aclose(self):
+        """Close the resources, in the reverse order of their creation"""
+        while self._closers:
+            result = self._closers.pop()()
+            if asyncio.iscoroutine(result) or isinstance(result, asyncio.Future):
+                await result
+        self._resources.clear()
+
+
+def _new_loop():
+    if uvloop is not None:
+        return uvloop.new_event_loop()
+    return asyncio.new_event_loop()
+
+
+def get_context():
+    """Return the context of the calling thread's managed loop, creating them if
+    needed.  Each thread gets its own loop, since a loop can only run in one thread
+    at a time, and so does a forked child, since loops can't be shared across
+    processes."""
+    global _atexit_registered
+    context = getattr(_local, 'context', None)
+    if context is None or context.loop.is_closed() or _local.pid != os.getpid():
+        context = AsyncContext(_new_loop())
+        with _lock:
+            if not _atexit_registered:
+                atexit.register(close_all)
+                _atexit_registered = True
+            _contexts.append((os.getpid(), context))
+        _local.context, _local.pid = context, os.getpid()
+    return context
+
+
+def run(coro):
+    """Run `coro` to completion on the calling thread's managed loop, and return its
+    result"""
+    return get_context().loop.run_until_complete(coro)
+
+
+def _close(context):
+    loop = context.loop
+    if loop.is_closed() or loop.is_running():
+        return
+    try:
+        loop.run_until_complete(context.aclose())
+        loop.run_until_complete(loop.shutdown_asyncgens())
+    finally:
+        loop.close()
+
+
+def close():
+    """Close the context's resources and the managed loop of the calling thread"""
+    context = getattr(_local, 'context', None)
+    if context is None or _local.pid != os.getpid():
+        return
+    _local.context = None
+    with _lock:
+        if (os.getpid(), context) in _contexts:
+            _contexts.remove((os.getpid(), context))
+    _close(context)
+
+
+def close_all():
+    """Close the contexts and managed loops of every thread of the process"""
+    close()
+    pid = os.getpid()
+    with _lock:
+        contexts = [context for context_pid, context in _contexts if context_pid == pid]
+        _contexts[:] = [entry for entry in _contexts if entry[0] != pid]
+    for context in contexts:
+        _close(context)
@@ -0,0 +1,200 @@
+"""Batch runs of many invocations of a click group in one process
+
+Each invocation is an argv list, from a line of json (a list of strings), or a line
+split like a shell would.  A line that can't be parsed fails on its own, with exit
+code 2, without stopping the batch.  The invocations run through the already built group, so
+plugin discovery and config loading are paid once for the whole batch, with their
+stdout, stderr and exit code captured into one result each.
+
+Thread workers share the process, so their output is routed to per-thread buffers.
+Process workers are forked from the batch process, and so start with its loaded
+plugins.  Where forking isn't available, or isn't safe (macOS), thread workers are
+used instead.
+"""
+
+import collections
+import io
+import json
+import logging
+import multiprocessing
+import os
+import shlex
+import sys
+import threading
+import traceback
+from multiprocessing.pool import ThreadPool
+
+LOG = logging.getLogger(__name__)
+
+# (command, prog_name) of the batch, inherited by forked process workers
+_PROCESS_STATE = None
+
+
+# a line of the batch that can't be parsed into an argv list
+InvalidInvocation = collections.namedtuple('InvalidInvocation', ['line', 'error'])
+
+
+def _parse_line(line):
+    """Return the argv list of a stripped `line`
+
+    :raise ValueError: if the line isn't valid json or shell syntax
+    """
+    if line.startswith('['):
+        argv = json.loads(line)
+        if not isinstance(argv, list):
+            raise ValueError("not an argv list")
+        return [str(arg) for arg in argv]
+    return shlex.split(line)
+
+
+def parse_invocations(lines):
+    """Yield the argv lists of `lines`, skipping blank lines and comments, or an
+    `InvalidInvocation` for a line that can't be parsed
+
+    :param lines: json lists of strings, or shell style command lines
+    """
+    for line in lines:
+        line = line.strip()
+        if not line or line.startswith('#'):
+            continue
+        try:
+            argv = _parse_line(line)
+        except ValueError as e:
+            argv = InvalidInvocation(line, str(e))
+        yield argv
+
+
+class _RoutingStream(io.TextIOBase):
+    """A text stream that writes to the buffer of the current thread, if it has one,
+    or else to `stream`"""
+
+    encoding = 'utf-8'
+
+    def __init__(self, stream, local):
+        self._stream = stream
+        self._local = local
+
+    def _target(self):
+        return getattr(self._local, 'buffers', {}).get(self) or self._stream
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        target = self._target()
+        return target is self._stream and self._stream.isatty()
+
+    def write(self, text):
+        # click probes for binary streams by writing b''
+        if isinstance(text, bytes):
+            raise TypeError("write() argument must be text, not bytes")
+        return self._target().write(text)
+
+    def flush(self):
+        self._target().flush()
+
+
+def _run(command, prog_name, argv):
+    """Run the command with `argv` and return the exit code"""
+    if isinstance(argv, InvalidInvocation):
+        sys.stderr.write("Error: invalid invocation: %s\n" % argv.error)
+        return 2
+    if argv and argv[0] == 'batch':
+        sys.stderr.write("Error: batches can't be nested\n")
+        return 2
+    try:
+        command.main(args=argv, prog_name=prog_name, standalone_mode=True)
+    except SystemExit as e:
+        if e.code is None:
+            return 0
+        if isinstance(e.code, int):
+            return e.code
+        sys.stderr.write('%s\n' % e.code)
+        return 1
+    except Exception:
+        traceback.print_exc()
+        return 1
+    return 0
+
+
+def _result(index, argv, exit_code, stdout, stderr):
+    if isinstance(argv, InvalidInvocation):
+        argv = argv.line
+    return {'index': index, 'argv': argv, 'exit_code': exit_code, 'stdout': stdout, 'stderr': stderr}
+
+
+def _process_invocation(item):
+    index, argv = item
+    command, prog_name = _PROCESS_STATE
+    saved = sys.stdout, sys.stderr
+    sys.stdout, sys.stderr = io.StringIO(), io.StringIO()
+    try:
+        code = _run(command, prog_name, argv)
+        return _result(index, argv, code, sys.stdout.getvalue(), sys.stderr.getvalue())
+    finally:
+        sys.stdout, sys.stderr = saved
+
+
+def _fork_context():
+    """Return the multiprocessing context that forks workers, or None if forking
+    isn't available, or isn't safe: on macOS, system frameworks can crash in forked
+    children"""
+    if not hasattr(os, 'fork') or sys.platform == 'darwin':
+        return None
+    if not hasattr(multiprocessing, 'get_context'):
+        # python 2 always forks
+        return multiprocessing
+    return multiprocessing.get_context('fork')
+
+
+def run_batch(command, invocations, prog_name=None, workers=1, processes=False, ordered=True):
+    """Run `invocations` through `command`, and yield a result dict for each, with
+    its 'index', 'argv' (the line, for an `InvalidInvocation`), 'exit_code', and captured
+    'stdout' and 'stderr'
+
+    :param command: the built click group
+    :param invocations: argv lists, or `InvalidInvocation`s, from `parse_invocations`
+    :param prog_name: program name used in usage and errors
+    :param workers: number of workers
+    :param processes: use forked worker processes instead of threads, where forking
+                      is available and safe
+    :param ordered: yield the results in the order of the invocations, instead of as
+                    they complete
+    """
+    global _PROCESS_STATE
+    prog_name = prog_name or command.name
+    items = enumerate(invocations)
+    context = _fork_context() if processes else None
+    if processes and context is None:
+        LOG.warning("Forked workers aren't available on this platform, using threads")
+        processes = False
+    if processes:
+        _PROCESS_STATE = (command, prog_name)
+        pool = context.Pool(workers)
+        run = _process_invocation
+    else:
+        local = threading.local()
+        saved = sys.stdout, sys.stderr
+        routed_stdout, routed_stderr = _RoutingStream(saved[0], local), _RoutingStream(saved[1], local)
+        sys.stdout, sys.stderr = routed_stdout, routed_stderr
+        pool = ThreadPool(workers)
+
+        def run(item):
+            index, argv = item
+            stdout, stderr = io.StringIO(), io.StringIO()
+            local.buffers = {routed_stdout: stdout, routed_stderr: stderr}
+            try:
+                code = _run(command, prog_name, argv)
+            finally:
+                local.buffers = {}
+            return _result(index, argv, code, stdout.getvalue(), stderr.getvalue())
+    try:
+        for result in (pool.imap if ordered else pool.imap_unordered)(run, items):
+            yield result
+    finally:
+        pool.close()
+        pool.join()
+        if processes:
+            _PROCESS_STATE = None
+        else:
+            sys.stdout, sys.stderr = saved
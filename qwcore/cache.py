@@ -0,0 +1,94 @@
+"""On-disk cache helpers"""
+
+import hashlib
+import json
+import logging
+import os
+import sys
+
+from appdirs import AppDirs
+
+LOG = logging.getLogger(__name__)
+
+CACHE_APPNAME = 'qwcore'
+
+DIST_METADATA_SUFFIXES = ('.dist-info', '.egg-info', '.egg-link', '.egg', '.pth')
+
+
+def cache_dir():
+    """Return the qwcore user cache dir"""
+    return AppDirs(CACHE_APPNAME).user_cache_dir
+
+
+def load(name):
+    """Return the json data cached as `name`, or None if it's missing or unreadable
+
+    :param name: cache file name
+    """
+    path = os.path.join(cache_dir(), name)
+    try:
+        with open(path) as fh:
+            return json.load(fh)
+    except (IOError, OSError, ValueError):
+        return None
+
+
+def save(name, data):
+    """Atomically write `data` as json to the cache file `name`. Failures are logged
+    and ignored, since the cache is only an optimization.
+
+    :param name: cache file name
+    :param data: json serializable data
+    """
+    directory = cache_dir()
+    path = os.path.join(directory, name)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+        with open(tmp_path, 'w') as fh:
+            json.dump(data, fh)
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+    except (IOError, OSError) as e:
+        LOG.debug("Unable to write cache file %s: %s" % (path, e))
+
+
+def environment_key(paths=None):
+    """Return a short hash of `sys.prefix` and the `paths` directories, to keep the
+    cache files of different environments (e.g. virtualenvs) apart
+
+    :param paths: import path, defaults to `sys.path`
+    """
+    if paths is None:
+        paths = sys.path
+    digest = hashlib.sha1(('%s\0' % sys.prefix).encode('utf-8'))
+    for path in paths:
+        digest.update(('%s\0' % path).encode('utf-8'))
+    return digest.hexdigest()[:16]
+
+
+def dists_fingerprint(paths=None):
+    """Return a hash of the distribution metadata entries (names, inodes and mtimes)
+    found in the `paths` directories. It changes whenever a distribution is
+    installed, upgraded or removed.
+
+    :param paths: directories to fingerprint, defaults to `sys.path`
+    """
+    if paths is None:
+        paths = sys.path
+    digest = hashlib.sha1()
+    for path in paths:
+        digest.update(('%s\0' % path).encode('utf-8'))
+        try:
+            names = sorted(os.listdir(path or os.curdir))
+        except OSError:
+            continue
+        for entry in names:
+            if not entry.endswith(DIST_METADATA_SUFFIXES):
+                continue
+            try:
+                st = os.stat(os.path.join(path or os.curdir, entry))
+            except OSError:
+                continue
+            digest.update(('%s:%d:%r\0' % (entry, st.st_ino, st.st_mtime)).encode('utf-8'))
+    return digest.hexdigest()
@@ -1,14 +1,97 @@
+import inspect
+import json
 import logging
+import os
+import sys
 import textwrap
 
 import click
 import six
 
-from qwcore.plugin import get_plugins
+from qwcore import complete, metrics, startup
+from qwcore.exception import PluginNameNotFoundError
+from qwcore.manifest import build_manifest_command, get_manifest
+from qwcore.plugin import get_plugin, get_plugin_names, get_plugins
+
+
+def _iscoroutinefunction(fn):
+    return getattr(inspect, 'iscoroutinefunction', lambda fn: False)(fn)
+
+
+def _run_async(coro):
+    """Run `coro` on the managed loop, with its context in `ctx.meta`"""
+    from qwcore import aio
+    click.get_current_context().meta[aio.CONTEXT_KEY] = aio.get_context()
+    return aio.run(coro)
+
+
+def _timed_callback(name, run):
+    """Return `run` wrapped to time it as the 'cli.run.<name>' metric, and to run it on
+    the managed event loop if it's a coroutine function"""
+    metric = 'cli.run.%s' % name
+    is_async = _iscoroutinefunction(run)
+
+    def callback(*args, **kwargs):
+        with metrics.timer(metric):
+            if is_async:
+                return _run_async(run(*args, **kwargs))
+            return run(*args, **kwargs)
+    return callback
+
+
+def _build_subcommand(cls):
+    """Return the click command for a subcommand plugin class"""
+    command = click.Command(
+        cls.name,
+        short_help=cls.help,
+        help=textwrap.dedent(' '*4 + cls.__doc__),
+        params=cls.params,
+        callback=_timed_callback(cls.name, cls().run)
+    )
+    # tells plugin subcommands from the ones added with `add_command`
+    command.qwcore_plugin = True
+    return command
+
+
+def _run_batch(source, workers, processes, unordered):
+    from qwcore import batch
+    ctx = click.get_current_context()
+    failed = False
+    results = batch.run_batch(ctx.parent.command, batch.parse_invocations(source), prog_name=ctx.parent.info_name,
+                              workers=workers, processes=processes, ordered=not unordered)
+    for result in results:
+        failed = failed or result['exit_code'] != 0
+        click.echo(json.dumps(result))
+    ctx.exit(1 if failed else 0)
+
+
+def _build_batch_command():
+    """Return the 'batch' command, that runs many invocations of its group"""
+    return click.Command(
+        'batch',
+        short_help='Run many invocations in one process.',
+        help=textwrap.dedent("""\
+            Run many invocations in one process.
+
+            Reads one invocation per line of SOURCE (defaults to stdin), either a
+            json list of arguments, or a shell style command line.  Writes one json
+            result per invocation, with its index, argv, exit_code, stdout and stderr.
+            """),
+        params=[
+            click.Argument(['source'], type=click.File('r'), default='-', required=False),
+            click.Option(['--workers'], type=click.IntRange(1), default=1, show_default=True,
+                         help='Number of workers.'),
+            click.Option(['--processes'], is_flag=True,
+                         help='Use forked worker processes instead of threads, where forking is safe.'),
+            click.Option(['--unordered'], is_flag=True, help='Write the results as they complete.'),
+        ],
+        callback=_run_batch
+    )
 
 
 def build_command(name, description, version, command_group, project_name=None,
-                  app_name=None):
+                  app_name=None, lazy=False, use_index=False, use_manifest=False, serve_daemon=False,
+                  max_children=None, load_workers=None, fast_completion=False, batch_mode=False):
     """Build a click command with subcommands
 
     :param name: command name
@@ -17,29 +100,141 @@ def build_command(name, description, version, command_group, project_name=None,
     :command_group: the entry point group for the subcommand extensions
     :project_name: project that contains the primary command
     :app_name: the app name used for config files
+    :lazy: only load and instantiate the subcommand plugin that is invoked
+    :use_index: use the on-disk entry point index for plugin discovery
+    :use_manifest: serve help and completion from the cached help manifest, without
+                   importing plugins.  Implies `lazy`.
+    :serve_daemon: add a `--serve-daemon` flag that keeps the command warm in a daemon
+                   listening on `daemon.socket_path(app_name)`, for `daemon.client_main`.
+                   'fork' makes it a fork server, that imports every plugin up front,
+                   and runs each invocation in a forked child.
+    :max_children: most forked children of a fork server running at once
+    :load_workers: load the subcommand plugins concurrently with this many threads
+    :fast_completion: answer shell completion requests from a cached completion table,
+                      that's rebuilt when the installed distributions change.  The
+                      plugins aren't imported, but click and this module already are
+                      by then; `qwcore.launcher.launch` answers from the table before
+                      importing them.
+    :batch_mode: add a 'batch' subcommand, that runs many invocations read from stdin
+                 or a file through the built command
     """
 
+    # the arguments to rebuild the command with, for `qwcore.launcher`
+    build_args = dict(name=name, description=description, version=version, command_group=command_group,
+                      project_name=project_name, app_name=app_name, lazy=lazy, use_index=use_index,
+                      use_manifest=use_manifest, serve_daemon=serve_daemon, max_children=max_children,
+                      load_workers=load_workers, fast_completion=fast_completion, batch_mode=batch_mode)
+
+    startup.start_from_environ()
+
+    if fast_completion and complete.complete():
+        sys.exit(0)
+
     if not project_name:
         project_name = name
 
     if not app_name:
         app_name = name
 
-    subcommands = get_plugins(command_group)
+    lazy = lazy or use_manifest
 
     class MyGroup(click.Group):
 
+        # lazily discovered subcommand names, and help manifest
+        _plugin_names = None
+        _manifest = None
+
+        def _get_manifest(self):
+            if self._manifest is None:
+                self._manifest = get_manifest(command_group, use_index=use_index)
+            return self._manifest
+
+        def _load_command(self, cmd_name):
+            try:
+                cls = get_plugin(command_group, cmd_name, use_index=use_index)
+            except PluginNameNotFoundError:
+                return False
+            self.add_command(_build_subcommand(cls))
+            return True
+
+        def list_commands(self, ctx):
+            if not lazy:
+                return super(MyGroup, self).list_commands(ctx)
+            if self._plugin_names is None:
+                if use_manifest:
+                    self._plugin_names = sorted(self._get_manifest()['commands'])
+                else:
+                    self._plugin_names = get_plugin_names(command_group, use_index=use_index)
+            return sorted(set(self._plugin_names) | set(self.commands))
+
+        # override to only load the real plugin when a subcommand is invoked, manifest
+        # commands are enough for help and completion
+        def resolve_command(self, ctx, args):
+            help_requested = bool(set(ctx.help_option_names) & set(args[1:]))
+            if use_manifest and args and args[0] not in self.commands and not ctx.resilient_parsing \
+                    and not help_requested:
+                self._load_command(args[0])
+            return super(MyGroup, self).resolve_command(ctx, args)
+
+        # override to rebuild a stale completion table before click answers a completion request
+        def main(self, args=None, prog_name=None, complete_var=None, **extra):
+            if fast_completion:
+                prog_name = prog_name or os.path.basename(sys.argv[0])
+                if os.environ.get(complete_var or complete.complete_var(prog_name)) \
+                        and complete.load_table(prog_name) is None:
+                    ctx = click.Context(self, info_name=prog_name, resilient_parsing=True)
+                    complete.save_table(prog_name, complete.build_table(self, ctx))
+            return super(MyGroup, self).main(args=args, prog_name=prog_name, complete_var=complete_var, **extra)
+
         # override to set the project and app name
         def get_command(self, ctx, cmd_name):
             ctx.meta['qwcore.project_name'] = project_name
             ctx.meta['qwcore.app_name'] = app_name
-            return super(MyGroup, self).get_command(ctx, cmd_name)
+            with metrics.timer('cli.get_command'):
+                if lazy and cmd_name not in self.commands:
+                    if use_manifest:
+                        entry = self._get_manifest()['commands'].get(cmd_name)
+                        return build_manifest_command(cmd_name, entry) if entry else None
+                    if not self._load_command(cmd_name):
+                        return None
+                return super(MyGroup, self).get_command(ctx, cmd_name)
+
+        # override so lazy help listings don't load every plugin
+        def format_commands(self, ctx, formatter):
+            if not lazy:
+                return super(MyGroup, self).format_commands(ctx, formatter)
+            rows = []
+            for cmd_name in self.list_commands(ctx):
+                cmd = self.commands.get(cmd_name)
+                if cmd is None and use_manifest:
+                    cmd = self.get_command(ctx, cmd_name)
+                rows.append((cmd_name, cmd.get_short_help_str() if cmd else ''))
+            if rows:
+                with formatter.section('Commands'):
+                    formatter.write_dl(rows)
 
     def show_version(ctx, param, value):
         if value:
             click.echo(version)
             ctx.exit()
 
+    # profiling is usually started before the args are parsed, from sys.argv
+    def profile_startup(ctx, param, value):
+        if value:
+            startup.start()
+
+    def start_daemon(ctx, param, value):
+        if value and not ctx.resilient_parsing:
+            fork = serve_daemon == 'fork'
+            if fork and lazy:
+                for cls in get_plugins(command_group, use_index=use_index, workers=load_workers).values():
+                    if cls.name not in ctx.command.commands:
+                        ctx.command.add_command(_build_subcommand(cls))
+            from qwcore import daemon
+            daemon.serve(ctx.command, daemon.socket_path(app_name), prog_name=ctx.info_name, fork=fork,
+                         max_children=max_children)
+            ctx.exit()
+
     def set_debug(ctx, param, value):
         if value:
             log = logging.getLogger(name)
@@ -49,17 +244,26 @@ def build_command(name, description, version, command_group, project_name=None,
                                 callback=show_version, is_eager=True, help='Show the version and exit.')
     debug_flag = click.Option(['--debug'], is_flag=True, callback=set_debug,
                               expose_value=False, help='Turn on debug logging.')
+    profile_flag = click.Option([startup.FLAG], is_flag=True, callback=profile_startup,
+                                expose_value=False, is_eager=True,
+                                help='Report startup timings and imports to stderr at exit.')
+
+    params = [version_flag, debug_flag, profile_flag]
+    if serve_daemon:
+        params.append(click.Option(['--serve-daemon'], is_flag=True, callback=start_daemon,
+                                   expose_value=False, is_eager=True,
+                                   help='Serve invocations from a warm daemon process.'))
 
     description = "{description}".format(description=description)
-    command = MyGroup(command_group, help=description, params=[version_flag, debug_flag])
-    for plugin_name, cls in six.iteritems(subcommands):
-        subcommand = click.Command(
-            cls.name,
-            short_help=cls.help,
-            help=textwrap.dedent(' '*4 + cls.__doc__),
-            params=cls.params,
-            callback=cls().run
-        )
-        command.add_command(subcommand)
+    command = MyGroup(command_group, help=description, params=params)
+    command.qwcore_build_args = build_args
+    if batch_mode:
+        command.add_command(_build_batch_command())
+    if lazy:
+        return command
+    with startup.phase('build %s' % name):
+        subcommands = get_plugins(command_group, use_index=use_index, workers=load_workers)
+        for plugin_name, cls in six.iteritems(subcommands):
+            command.add_command(_build_subcommand(cls))
 
     return command
@@ -0,0 +1,220 @@
+"""Fast shell completion from a precomputed completion table
+
+Click answers completion requests by building the whole command, which for
+qwcore clis means discovering, and usually importing, every subcommand plugin.  A
+completion table captures the group options, the subcommands and their options, so
+completion requests can be answered by `complete` from one json file, without
+importing click or the plugins, and in the same formats as click's bash, zsh and
+fish completion.
+
+The table is tied to `cache.dists_fingerprint`, so it's rebuilt (by the regular
+click path, see `build_command(..., fast_completion=True)`) after plugins are
+installed, upgraded or removed.
+
+`build_command` only skips building the command and importing the plugins, since
+the cli module that calls it has imported click already.  To skip importing click
+too, call `complete` first thing in the console script, like
+`qwcore.launcher.launch` does.
+"""
+
+import os
+import shlex
+import sys
+
+from qwcore import cache
+
+TABLE_FORMAT = 1
+
+SHELLS = ('bash', 'zsh', 'fish')
+
+
+def table_name(prog_name):
+    """Return the cache file name of the completion table of `prog_name` in this
+    environment"""
+    return 'completion-%s-%s.json' % (prog_name, cache.environment_key())
+
+
+def complete_var(prog_name):
+    """Return click's completion instruction environment variable for `prog_name`"""
+    return '_%s_COMPLETE' % prog_name.replace('-', '_').replace('.', '_').upper()
+
+
+def _complete_type(param_type):
+    """Return the completion item type of a click param type: a shell completion
+    type ('file' or 'dir'), or None"""
+    if hasattr(param_type, 'dir_okay') and hasattr(param_type, 'file_okay'):
+        return 'dir' if param_type.dir_okay and not param_type.file_okay else 'file'
+    if getattr(param_type, 'name', None) == 'filename':
+        return 'file'
+    return None
+
+
+def _param_entry(param):
+    return {
+        'opts': list(param.opts) + list(param.secondary_opts),
+        'help': getattr(param, 'help', None),
+        'takes_value': not getattr(param, 'is_flag', False) and not getattr(param, 'count', False),
+        'multiple': param.multiple or getattr(param, 'count', False),
+        'nargs': param.nargs,
+        'choices': [str(c) for c in getattr(param.type, 'choices', None) or []],
+        'type': _complete_type(param.type),
+    }
+
+
+def _command_entry(command, ctx):
+    options, arguments = [], []
+    for param in command.get_params(ctx):
+        if getattr(param, 'hidden', False):
+            continue
+        if param.param_type_name == 'option':
+            options.append(_param_entry(param))
+        elif param.param_type_name == 'argument':
+            arguments.append(_param_entry(param))
+    return {'help': command.get_short_help_str(), 'options': options, 'arguments': arguments}
+
+
+def build_table(command, ctx):
+    """Return the completion table of a click group.  Its subcommands are only
+    listed and looked up, so a manifest backed group doesn't import plugins.
+
+    :param command: click group
+    :param ctx: click context of the group
+    """
+    table = _command_entry(command, ctx)
+    table['format'] = TABLE_FORMAT
+    table['fingerprint'] = cache.dists_fingerprint()
+    table['commands'] = {}
+    for name in command.list_commands(ctx):
+        subcommand = command.get_command(ctx, name)
+        if subcommand is not None and not getattr(subcommand, 'hidden', False):
+            table['commands'][name] = _command_entry(subcommand, ctx)
+    return table
+
+
+def save_table(prog_name, table):
+    cache.save(table_name(prog_name), table)
+
+
+def load_table(prog_name):
+    """Return the completion table of `prog_name`, or None if it's missing or stale"""
+    table = cache.load(table_name(prog_name))
+    if not table or table.get('format') != TABLE_FORMAT or table.get('fingerprint') != cache.dists_fingerprint():
+        return None
+    return table
+
+
+def completion_args(shell, environ):
+    """Return the (args, incomplete) of a completion request, like click does"""
+    cwords = shlex.split(environ['COMP_WORDS'])
+    if shell == 'fish':
+        incomplete = environ['COMP_CWORD']
+        if incomplete:
+            incomplete = shlex.split(incomplete)[0]
+        args = cwords[1:]
+        if incomplete and args and args[-1] == incomplete:
+            args.pop()
+        return args, incomplete
+    cword = int(environ['COMP_CWORD'])
+    args = cwords[1:cword]
+    incomplete = cwords[cword] if cword < len(cwords) else ''
+    return args, incomplete
+
+
+def _find_option(options, arg):
+    for option in options:
+        if arg in option['opts']:
+            return option
+    return None
+
+
+def _parse(table, args):
+    """Return the (command entry, option waiting for a value, positional count)
+    after `args`"""
+    entry, pending, positionals = table, None, 0
+    for arg in args:
+        if pending is not None:
+            pending = None
+            continue
+        if arg.startswith('-') and arg != '-':
+            option = _find_option(entry['options'], arg.partition('=')[0])
+            if option and option['takes_value'] and '=' not in arg:
+                pending = option
+        elif entry is table and arg in table['commands']:
+            entry = table['commands'][arg]
+        else:
+            positionals += 1
+    return entry, pending, positionals
+
+
+def _value_items(param, incomplete):
+    if param['choices']:
+        return [('plain', c, None) for c in param['choices'] if c.startswith(incomplete)]
+    if param['type']:
+        return [(param['type'], incomplete, None)]
+    return []
+
+
+def get_completions(table, args, incomplete):
+    """Return the (type, value, help) completion items for `args` and `incomplete`"""
+    entry, pending, positionals = _parse(table, args)
+    if pending is None and incomplete.startswith('-') and '=' in incomplete:
+        name, _, incomplete = incomplete.partition('=')
+        pending = _find_option(entry['options'], name)
+    if pending is not None:
+        return _value_items(pending, incomplete)
+    if incomplete.startswith('-'):
+        items = []
+        for option in entry['options']:
+            if not option['multiple'] and any(opt in args for opt in option['opts']):
+                continue
+            items.extend(('plain', opt, option['help']) for opt in option['opts'] if opt.startswith(incomplete))
+        return items
+    if entry is table:
+        return [('plain', name, command['help']) for name, command in sorted(table['commands'].items())
+                if name.startswith(incomplete)]
+    arguments = entry['arguments']
+    if arguments:
+        index = min(positionals, len(arguments) - 1)
+        if index == positionals or arguments[index]['nargs'] == -1:
+            return _value_items(arguments[index], incomplete)
+    return []
+
+
+def format_completion(shell, item):
+    """Format a completion item like click's completion classes"""
+    item_type, value, help_ = item
+    if shell == 'zsh':
+        if help_:
+            return '%s\n%s\n%s' % (item_type, value.replace(':', r'\:'), help_)
+        return '%s\n%s\n_' % (item_type, value)
+    if shell == 'fish' and help_:
+        return '%s,%s\t%s' % (item_type, value, help_.replace('\n', '\\n').replace('\t', ' '))
+    return '%s,%s' % (item_type, value)
+
+
+def complete(prog_name=None, environ=None, stdout=None):
+    """Answer a click completion request for `prog_name` from its completion table.
+    Returns False if there's no request, or it can't be answered from the table, so
+    the regular click path should handle it.
+
+    :param prog_name: program name, defaults to the basename of `sys.argv[0]`
+    :param environ: environment, defaults to `os.environ`
+    :param stdout: output stream, defaults to stdout
+    """
+    prog_name = prog_name or os.path.basename(sys.argv[0])
+    environ = os.environ if environ is None else environ
+    shell, _, instruction = environ.get(complete_var(prog_name), '').partition('_')
+    if shell not in SHELLS or instruction != 'complete' or 'COMP_WORDS' not in environ:
+        return False
+    table = load_table(prog_name)
+    if table is None:
+        return False
+    try:
+        args, incomplete = completion_args(shell, environ)
+    except ValueError:
+        return False
+    items = get_completions(table, args, incomplete)
+    stdout = sys.stdout if stdout is None else stdout
+    stdout.write('\n'.join(format_completion(shell, item) for item in items) + '\n')
+    stdout.flush()
+    return True
@@ -1,56 +1,290 @@
+import json
 import logging
+import mmap
 import os
+import re
+import stat
+import threading
 
 from appdirs import AppDirs
 import configobj
 
-from qwcore import exception
+from qwcore import exception, metrics, startup
 
 LOG = logging.getLogger(__name__)
 
 
-def get_config(appname):
+# appname -> (config file, stat signature, ConfigObj)
+_CACHE = {}
+
+# appname -> (ConfigObj, schema, ConfigSnapshot)
+_SNAPSHOTS = {}
+
+# appname -> LayeredConfig
+_LAYERED = {}
+
+# appname -> (config file, stat signature, LazyConfig)
+_LAZY = {}
+
+
+def _stat_signature(st):
+    """Return the (mtime ns, size, inode) signature used to revalidate cached configs"""
+    return (getattr(st, 'st_mtime_ns', st.st_mtime), st.st_size, st.st_ino)
+
+
+def _config_file(appname):
+    """Return the path of the config file for `appname`"""
+    return os.path.join(AppDirs(appname).user_config_dir, 'config')
+
+
+def _parse(config_file):
+    """Parse `config_file` with `configobj`
+
+    :raise ConfigFileParserError: if the config file is invalid
+    """
+    try:
+        with startup.phase('config %s' % config_file), metrics.timer('config.parse'):
+            return configobj.ConfigObj(config_file)
+    except configobj.ConfigObjError as e:
+        raise exception.ConfigFileParserError(str(e))
+
+
+def get_config(appname, cached=False):
     """Return the `configobj` object for an app, assuming it's config file is in the
     XDG compliant path for an app named `appname`, and where the actual config
     file is named 'config'
 
+    With `cached`, the parsed config comes from a per process cache, and is only
+    re-parsed when the file's mtime, size or inode changes.  Cached objects are
+    shared, so don't modify them.  `get_value` and `get_values` use the cache.
+
     :param appname: app name
+    :param cached: use the process-wide cache of parsed configs
     :raise ConfigFileNotFoundError: if the config file is not found
     :raise ConfigFileParserError: if the config file is invalid
 
     """
-    config_dir = AppDirs(appname).user_config_dir
-    config_file = os.path.join(config_dir, 'config')
-    if not os.path.isfile(config_file):
+    config_file = _config_file(appname)
+    try:
+        st = os.stat(config_file)
+    except OSError:
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
+        _CACHE.pop(appname, None)
         msg = "Config file not found: {f}".format(f=config_file)
         raise exception.ConfigFileNotFoundError(msg)
-    try:
-        config = configobj.ConfigObj(config_file)
-    except configobj.ConfigObjError as e:
-        raise exception.ConfigFileParserError(str(e))
+    if not cached:
+        return _parse(config_file)
+    signature = _stat_signature(st)
+    entry = _CACHE.get(appname)
+    if entry and entry[0] == config_file and entry[1] == signature:
+        metrics.incr('config.cache_hit')
+        return entry[2]
+    metrics.incr('config.cache_miss')
+    config = _parse(config_file)
+    _CACHE[appname] = (config_file, signature, config)
     return config
 
 
-def get_value(appname, key, section=None, default=None):
-    """Return a config value
+def invalidate(appname=None):
+    """Drop the cached config for `appname`, or for all apps if it's None
 
     :param appname: app name
-    :param key: config key
-    :param section: config section
-    :param default: default value if config file not present or key/section not present
     """
-    try:
-        config = get_config(appname)
-    except exception.ConfigFileNotFoundError as e:
-        if default:
-            LOG.info("Config file not found, using default value: {d}".format(d=default))
+    if appname is None:
+        _CACHE.clear()
+        _SNAPSHOTS.clear()
+        _LAYERED.clear()
+        _LAZY.clear()
+    else:
+        _CACHE.pop(appname, None)
+        _SNAPSHOTS.pop(appname, None)
+        _LAYERED.pop(appname, None)
+        _LAZY.pop(appname, None)
+
+
+# a top level section header, `[name]` but not `[[name]]`, or the triple quotes that
+# open and close a multiline value
+SECTION_HEADER_RE = re.compile(br'^[ \t]*\[(?!\[)([^\]\r\n]*)\][ \t]*(?:#[^\r\n]*)?\r?$|(\'\'\'|""")', re.M)
+
+INDEX_FORMAT = 2
+
+
+def _index_path(config_file):
+    return config_file + '.index'
+
+
+def _scan_sections(config_file, size):
+    """Return the (start, end) byte offsets of the top level sections of
+    `config_file`, from one scan of the memory mapped file, and where the root
+    section ends
+
+    :raise ConfigFileParserError: if a section is duplicated
+    """
+    sections = {}
+    if not size:
+        return sections, 0
+    with open(config_file, 'rb') as fh:
+        mapped = mmap.mmap(fh.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            previous = None
+            root_end = size
+            quote = None
+            for match in SECTION_HEADER_RE.finditer(mapped):
+                if match.group(2):
+                    if quote is None:
+                        quote = match.group(2)
+                    elif quote == match.group(2):
+                        quote = None
+                    continue
+                if quote is not None:
+                    # a header-like line of a multiline value
+                    continue
+                name = match.group(1).decode('utf-8').strip().strip('"\'')
+                if name in sections:
+                    raise exception.ConfigFileParserError("Duplicate section name: %s" % name)
+                if previous is None:
+                    root_end = match.start()
+                else:
+                    sections[previous][1] = match.start()
+                sections[name] = [match.start(), size]
+                previous = name
+        finally:
+            mapped.close()
+    return sections, root_end
+
+
+class LazyConfig(object):
+    """A config file that's parsed one top level section at a time, when the section
+    is first accessed.  The byte offsets of the sections come from one scan of the
+    file, and are persisted next to it, in '<file>.index'.
+
+    Keys of the root section are looked up like sections.  The scan skips the lines
+    of triple quoted multiline values, but not triple quotes in comments, so those
+    can hide the sections that follow.
+
+    :param config_file: config file path
+    :param signature: the file's stat signature, to validate the persisted index
+    """
+
+    def __init__(self, config_file, signature=None):
+        self.config_file = config_file
+        if signature is None:
+            signature = _stat_signature(os.stat(config_file))
+        self._offsets, self._root_end = self._load_index(list(signature))
+        self._sections = {}
+        self._root = None
+        self._lock = threading.Lock()
+
+    def _load_index(self, signature):
+        index_path = _index_path(self.config_file)
+        try:
+            with open(index_path) as fh:
+                data = json.load(fh)
+            if data.get('format') == INDEX_FORMAT and data.get('signature') == signature:
+                return data['sections'], data['root_end']
+        except (IOError, OSError, ValueError):
+            pass
+        with startup.phase('config index %s' % self.config_file), metrics.timer('config.index'):
+            sections, root_end = _scan_sections(self.config_file, signature[1])
+        data = {'format': INDEX_FORMAT, 'signature': signature, 'sections': sections, 'root_end': root_end}
+        tmp_path = '%s.%d.tmp' % (index_path, os.getpid())
+        try:
+            with open(tmp_path, 'w') as fh:
+                json.dump(data, fh)
+            getattr(os, 'replace', os.rename)(tmp_path, index_path)
+        except (IOError, OSError) as e:
+            LOG.debug("Couldn't save the config index %s: %s" % (index_path, e))
+        return sections, root_end
+
+    def _read(self, start, end):
+        with open(self.config_file, 'rb') as fh:
+            fh.seek(start)
+            return fh.read(end - start).decode('utf-8')
+
+    def _parse(self, start, end):
+        try:
+            with metrics.timer('config.parse_section'):
+                return configobj.ConfigObj(self._read(start, end).splitlines())
+        except configobj.ConfigObjError as e:
+            raise exception.ConfigFileParserError(str(e))
+
+    def _get_section(self, name):
+        section = self._sections.get(name)
+        if section is None:
+            with self._lock:
+                section = self._sections.get(name)
+                if section is None:
+                    start, end = self._offsets[name]
+                    parsed = self._parse(start, end)
+                    # the header is the first section of the chunk, whatever its quoting
+                    section = self._sections[name] = parsed[parsed.sections[0]]
+        return section
+
+    def _get_root(self):
+        if self._root is None:
+            self._root = self._parse(0, self._root_end)
+        return self._root
+
+    @property
+    def sections(self):
+        """The top level section names, in file order"""
+        return sorted(self._offsets, key=lambda name: self._offsets[name][0])
+
+    def __getitem__(self, name):
+        if name in self._offsets:
+            return self._get_section(name)
+        return self._get_root()[name]
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
             return default
-        else:
-            raise e
+
+    def __contains__(self, name):
+        return name in self._offsets or name in self._get_root()
+
+    def keys(self):
+        return list(self._get_root().keys()) + self.sections
+
+    def __iter__(self):
+        return iter(self.keys())
+
+
+def get_lazy_config(appname):
+    """Return the `LazyConfig` for an app, that's cached like `get_config`, and only
+    parses the sections that are accessed
+
+    :param appname: app name
+    :raise ConfigFileNotFoundError: if the config file is not found
+    :raise ConfigFileParserError: if the config file is invalid
+    """
+    config_file = _config_file(appname)
+    try:
+        st = os.stat(config_file)
+    except OSError:
+        st = None
+    if st is None or not stat.S_ISREG(st.st_mode):
+        _LAZY.pop(appname, None)
+        raise exception.ConfigFileNotFoundError("Config file not found: {f}".format(f=config_file))
+    signature = _stat_signature(st)
+    entry = _LAZY.get(appname)
+    if entry and entry[0] == config_file and entry[1] == signature:
+        metrics.incr('config.cache_hit')
+        return entry[2]
+    metrics.incr('config.cache_miss')
+    config = LazyConfig(config_file, signature)
+    _LAZY[appname] = (config_file, signature, config)
+    return config
+
+
+def _lookup(config, key, section=None, default=None):
+    """Return a value from a parsed config, or `default`"""
     if section:
         try:
             config = config[section]
-        except KeyError as e:
+        except KeyError:
             if default:
                 LOG.info("section '{s}' not found in config file, using default: {d}".format(s=section, d=default))
                 return default
@@ -59,10 +293,501 @@ def get_value(appname, key, section=None, default=None):
                     "section '{s}' not found in config file".format(s=section))
     try:
         return config[key]
-    except KeyError as e:
+    except KeyError:
         if default:
             LOG.info("'{k}' key not found in config file, using default: {d}".format(k=key, d=default))
             return default
         else:
             raise exception.ConfigFileKeyNotFoundError(
                 "key '{s}' not found in config file".format(s=section))
+
+
+def get_value(appname, key, section=None, default=None, lazy=False):
+    """Return a config value
+
+    :param appname: app name
+    :param key: config key
+    :param section: config section
+    :param default: default value if config file not present or key/section not present
+    :param lazy: only parse the section of the value, see `get_lazy_config`
+    """
+    try:
+        config = get_lazy_config(appname) if lazy else get_config(appname, cached=True)
+    except exception.ConfigFileNotFoundError as e:
+        if default:
+            LOG.info("Config file not found, using default value: {d}".format(d=default))
+            return default
+        else:
+            raise e
+    return _lookup(config, key, section=section, default=default)
+
+
+def get_values(appname, keys, section=None, default=None, lazy=False):
+    """Return a dict of config values for `keys`, from a single config lookup
+
+    :param appname: app name
+    :param keys: config keys
+    :param section: config section
+    :param default: default value if config file not present or key/section not present
+    :param lazy: only parse the section of the values, see `get_lazy_config`
+    """
+    try:
+        config = get_lazy_config(appname) if lazy else get_config(appname, cached=True)
+    except exception.ConfigFileNotFoundError as e:
+        if default:
+            LOG.info("Config file not found, using default value: {d}".format(d=default))
+            return dict((key, default) for key in keys)
+        else:
+            raise e
+    return dict((key, _lookup(config, key, section=section, default=default)) for key in keys)
+
+
+BOOL_STRINGS = {
+    'true': True, 'yes': True, 'on': True, '1': True,
+    'false': False, 'no': False, 'off': False, '0': False,
+}
+
+
+def _to_bool(value):
+    if isinstance(value, bool):
+        return value
+    try:
+        return BOOL_STRINGS[str(value).strip().lower()]
+    except KeyError:
+        raise ValueError("not a boolean: %r" % (value,))
+
+
+def _to_tuple(value):
+    if isinstance(value, (list, tuple)):
+        return tuple(value)
+    return tuple(v.strip() for v in value.split(',') if v.strip())
+
+
+CONVERTERS = {bool: _to_bool, list: _to_tuple, tuple: _to_tuple}
+
+
+class ConfigSection(object):
+    """The converted values of one config section"""
+
+    __slots__ = ('name', '_values')
+
+    def __init__(self, name, values):
+        self.name = name
+        self._values = values
+
+    def get(self, key, default=None):
+        return self._values.get(key, default)
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            raise exception.ConfigFileKeyNotFoundError(
+                "key '{k}' not found in section '{s}'".format(k=key, s=self.name))
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def items(self):
+        return self._values.items()
+
+
+class ConfigSnapshot(object):
+    """An immutable, compiled view of a config, with values keyed by dotted
+    'section.key' paths (top level keys have no section prefix).  Values are
+    converted once, when compiled, so lookups are a single dict access.
+
+    :param values: dict of dotted key -> value
+    :param sections: dict of dotted section name -> `ConfigSection`
+    """
+
+    __slots__ = ('_values', '_sections')
+
+    def __init__(self, values, sections):
+        self._values = values
+        self._sections = sections
+
+    def get(self, key, default=None):
+        """Return the value for a dotted `key`, or `default`"""
+        return self._values.get(key, default)
+
+    def __getitem__(self, key):
+        try:
+            return self._values[key]
+        except KeyError:
+            raise exception.ConfigFileKeyNotFoundError(
+                "key '{k}' not found in config file".format(k=key))
+
+    def __contains__(self, key):
+        return key in self._values
+
+    def __iter__(self):
+        return iter(self._values)
+
+    def items(self):
+        return self._values.items()
+
+    def section(self, name):
+        """Return the `ConfigSection` for a dotted section `name`, '' is the top level
+
+        :raise ConfigFileSectionNotFoundError: if the section is not present
+        """
+        try:
+            return self._sections[name]
+        except KeyError:
+            raise exception.ConfigFileSectionNotFoundError(
+                "section '{s}' not found in config file".format(s=name))
+
+
+def compile_config(config, schema=None):
+    """Return a `ConfigSnapshot` of a parsed config.  Lists become tuples, and values
+    with a type in `schema` are converted.
+
+    :param config: parsed config, e.g. from `get_config`
+    :param schema: optional dict of dotted key -> type (`bool`, `int`, `float`, `list`...)
+                   or a conversion callable
+    :raise ConfigValueError: if a value can't be converted
+    """
+    schema = schema or {}
+    values = {}
+    sections = {}
+
+    def compile_section(section, name):
+        section_values = {}
+        prefix = name + '.' if name else ''
+        for key, value in section.items():
+            if isinstance(value, dict):
+                compile_section(value, prefix + key)
+                continue
+            full_key = prefix + key
+            convert = schema.get(full_key)
+            if convert is not None:
+                convert = CONVERTERS.get(convert, convert)
+                try:
+                    value = convert(value)
+                except (TypeError, ValueError) as e:
+                    raise exception.ConfigValueError(
+                        "invalid value for '{k}': {e}".format(k=full_key, e=e))
+            elif isinstance(value, list):
+                value = tuple(value)
+            values[full_key] = section_values[key] = value
+        sections[name] = ConfigSection(name, section_values)
+
+    compile_section(config, '')
+    return ConfigSnapshot(values, sections)
+
+
+def get_snapshot(appname, schema=None):
+    """Return the compiled `ConfigSnapshot` for an app's config file.  It's only
+    recompiled when the cached config is re-parsed, or for a schema that's not equal
+    to the last one.
+
+    :param appname: app name
+    :param schema: optional dict of dotted key -> type, see `compile_config`
+    :raise ConfigFileNotFoundError: if the config file is not found
+    :raise ConfigFileParserError: if the config file is invalid
+    :raise ConfigValueError: if a value can't be converted
+    """
+    config = get_config(appname, cached=True)
+    entry = _SNAPSHOTS.get(appname)
+    if entry and entry[0] is config and entry[1] == (schema or {}):
+        return entry[2]
+    snapshot = compile_config(config, schema=schema)
+    # a copy, so a schema changed in place isn't mistaken for the cached one
+    _SNAPSHOTS[appname] = (config, dict(schema or {}), snapshot)
+    return snapshot
+
+
+# config layers, from lowest to highest precedence
+LAYERS = ('system', 'user', 'env', 'cli')
+
+
+def env_var_name(appname, key):
+    """Return the environment variable that overrides a dotted `key`, e.g.
+    'APPNAME_SECTION_KEY' for 'section.key'
+
+    :param appname: app name
+    :param key: dotted config key
+    """
+    return re.sub('[^A-Za-z0-9]+', '_', '%s_%s' % (appname, key)).upper()
+
+
+class LayeredConfig(object):
+    """A merged view of the config layers of an app, from lowest to highest precedence:
+
+    - system: the 'config' file in the site config dir
+    - user: the 'config' file in the user config dir
+    - env: 'APPNAME_SECTION_KEY' environment variables.  Variables that don't match a
+      key from the config files map to 'section.key' on their first underscore.
+    - cli: per invocation overrides, as dotted key -> value
+
+    Values are keyed by dotted 'section.key' paths, and the layer each value came from
+    is tracked.  `refresh` only reloads the layers that changed.
+
+    :param appname: app name
+    :param overrides: dict of dotted key -> value for the cli layer
+    :param environ: environment mapping, defaults to `os.environ`
+    """
+
+    def __init__(self, appname, overrides=None, environ=None):
+        self.appname = appname
+        self.overrides = dict(overrides or {})
+        self.environ = os.environ if environ is None else environ
+        dirs = AppDirs(appname)
+        self.files = {
+            'system': os.path.join(dirs.site_config_dir, 'config'),
+            'user': os.path.join(dirs.user_config_dir, 'config'),
+        }
+        self._signatures = {}
+        self._layers = dict((layer, {}) for layer in LAYERS)
+        self._merged = {}
+        # the shared instance of `get_layered_config` is refreshed by any thread
+        self._lock = threading.Lock()
+        self.refresh()
+
+    def _file_layer(self, layer):
+        """Return the (signature, values) of a file layer, reusing the loaded values if
+        the file's signature didn't change"""
+        try:
+            signature = _stat_signature(os.stat(self.files[layer]))
+        except OSError:
+            return None, {}
+        if layer in self._signatures and self._signatures[layer] == signature:
+            return signature, self._layers[layer]
+        return signature, dict(compile_config(_parse(self.files[layer])).items())
+
+    def _env_layer(self, known_keys):
+        """Return the (signature, values) of the environment layer"""
+        prefix = env_var_name(self.appname, '')
+        names = dict((env_var_name(self.appname, key), key) for key in known_keys)
+        env = sorted((name, value) for name, value in self.environ.items() if name.startswith(prefix))
+        values = {}
+        for name, value in env:
+            key = names.get(name) or name[len(prefix):].lower().replace('_', '.', 1)
+            values[key] = value
+        return (tuple(env), tuple(sorted(known_keys))), values
+
+    def refresh(self):
+        """Reload the layers that changed since the last refresh, and re-merge the view
+        if any did.  Return the names of the changed layers.
+
+        :raise ConfigFileParserError: if a config file is invalid
+        """
+        with self._lock:
+            return self._refresh()
+
+    def _refresh(self):
+        signatures = {}
+        layers = {}
+        for layer in ('system', 'user'):
+            signatures[layer], layers[layer] = self._file_layer(layer)
+        known_keys = set(layers['system']) | set(layers['user'])
+        signatures['env'], layers['env'] = self._env_layer(known_keys)
+        signatures['cli'] = tuple(sorted((key, repr(value)) for key, value in self.overrides.items()))
+        layers['cli'] = dict(self.overrides)
+        changed = [layer for layer in LAYERS
+                   if layer not in self._signatures or self._signatures[layer] != signatures[layer]]
+        if changed:
+            for layer in changed:
+                self._signatures[layer] = signatures[layer]
+                self._layers[layer] = layers[layer]
+            merged = {}
+            for layer in LAYERS:
+                for key, value in self._layers[layer].items():
+                    merged[key] = (value, layer)
+            self._merged = merged
+        return changed
+
+    def set_overrides(self, overrides):
+        """Replace the cli layer overrides, and refresh
+
+        :param overrides: dict of dotted key -> value
+        """
+        self.overrides = dict(overrides or {})
+        return self.refresh()
+
+    def get(self, key, default=None):
+        """Return the merged value for a dotted `key`, or `default`"""
+        entry = self._merged.get(key)
+        return default if entry is None else entry[0]
+
+    def __getitem__(self, key):
+        try:
+            return self._merged[key][0]
+        except KeyError:
+            raise exception.ConfigFileKeyNotFoundError(
+                "key '{k}' not found in config".format(k=key))
+
+    def __contains__(self, key):
+        return key in self._merged
+
+    def source(self, key):
+        """Return the name of the layer that provides `key`, or None"""
+        entry = self._merged.get(key)
+        return None if entry is None else entry[1]
+
+    def sources(self):
+        """Return a dict of dotted key -> layer name, for every merged value"""
+        return dict((key, entry[1]) for key, entry in self._merged.items())
+
+
+class LayeredConfigView(object):
+    """A per invocation view of a shared `LayeredConfig`, with its own cli layer on
+    top, so concurrent invocations don't see each other's overrides
+
+    :param layered: the shared `LayeredConfig`, without cli overrides
+    :param overrides: dict of dotted key -> value for the cli layer
+    """
+
+    def __init__(self, layered, overrides=None):
+        self.layered = layered
+        self.overrides = dict(overrides or {})
+
+    def get(self, key, default=None):
+        """Return the merged value for a dotted `key`, or `default`"""
+        if key in self.overrides:
+            return self.overrides[key]
+        return self.layered.get(key, default)
+
+    def __getitem__(self, key):
+        if key in self.overrides:
+            return self.overrides[key]
+        return self.layered[key]
+
+    def __contains__(self, key):
+        return key in self.overrides or key in self.layered
+
+    def source(self, key):
+        """Return the name of the layer that provides `key`, or None"""
+        return 'cli' if key in self.overrides else self.layered.source(key)
+
+    def sources(self):
+        """Return a dict of dotted key -> layer name, for every merged value"""
+        sources = self.layered.sources()
+        sources.update((key, 'cli') for key in self.overrides)
+        return sources
+
+
+def get_layered_config(appname, overrides=None):
+    """Return the shared `LayeredConfig` for `appname`, with the system, user and env
+    layers, refreshed once.  With `overrides`, return a `LayeredConfigView` of it
+    with that cli layer, that's private to the caller.
+
+    :param appname: app name
+    :param overrides: dict of dotted key -> value for the cli layer, if given
+    """
+    layered = _LAYERED.get(appname)
+    if layered is None:
+        layered = _LAYERED.setdefault(appname, LayeredConfig(appname))
+    else:
+        layered.refresh()
+    if overrides is None:
+        return layered
+    return LayeredConfigView(layered, overrides)
+
+
+class ConfigWatcher(object):
+    """Keep a parsed snapshot of an app's config file, that's swapped for a new one
+    when the file changes.  The config dir is watched from a background thread with
+    inotify when available, or else by polling the file's stat signature.
+
+    Readers never wait on a parse, and an invalid edit keeps the last good snapshot.
+
+    :param appname: app name
+    :param interval: polling interval in seconds, and the max delay when stopping
+    """
+
+    def __init__(self, appname, interval=1.0):
+        self.appname = appname
+        self.interval = interval
+        self.config_file = _config_file(appname)
+        self._callbacks = []
+        self._signature = None
+        self._snapshot = None
+        self._stopped = threading.Event()
+        self._thread = None
+        self.reload()
+
+    @property
+    def config(self):
+        """The current `configobj` snapshot.  Don't modify it.
+
+        :raise ConfigFileNotFoundError: if the config file was never loaded
+        """
+        snapshot = self._snapshot
+        if snapshot is None:
+            raise exception.ConfigFileNotFoundError(
+                "Config file not found: {f}".format(f=self.config_file))
+        return snapshot
+
+    def get_value(self, key, section=None, default=None):
+        """Return a value from the current snapshot, like `get_value`"""
+        try:
+            config = self.config
+        except exception.ConfigFileNotFoundError as e:
+            if default:
+                return default
+            raise e
+        return _lookup(config, key, section=section, default=default)
+
+    def add_callback(self, callback):
+        """Register `callback(config)` to be called after a new snapshot is swapped in"""
+        self._callbacks.append(callback)
+
+    def reload(self):
+        """Re-parse the config file if its stat signature changed, swap in the new
+        snapshot and notify the callbacks.  Return True if the snapshot was swapped."""
+        try:
+            st = os.stat(self.config_file)
+        except OSError:
+            return False
+        signature = _stat_signature(st)
+        if signature == self._signature:
+            return False
+        self._signature = signature
+        try:
+            config = _parse(self.config_file)
+        except exception.ConfigFileParserError as e:
+            LOG.warning("Invalid config file {f}, keeping the last good config: {e}".format(
+                f=self.config_file, e=e))
+            return False
+        self._snapshot = config
+        for callback in list(self._callbacks):
+            try:
+                callback(config)
+            except Exception:
+                LOG.exception("Config watcher callback failed")
+        return True
+
+    def start(self):
+        """Start watching in a daemon thread"""
+        if self._thread is not None:
+            return
+        # imports ctypes, so it's only paid for by watchers
+        from qwcore.watch import DirectoryWatcher
+        self._stopped.clear()
+        watcher = DirectoryWatcher(os.path.dirname(self.config_file))
+        # catch changes made before the watch was set up
+        self.reload()
+        self._thread = threading.Thread(target=self._run, args=(watcher,), name='qwcore-config-watcher')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop watching, waiting at most `interval` seconds for the thread"""
+        if self._thread is None:
+            return
+        self._stopped.set()
+        self._thread.join(timeout=self.interval)
+        self._thread = None
+
+    def _run(self, watcher):
+        try:
+            while not self._stopped.is_set():
+                if watcher.wait(self.interval) and not self._stopped.is_set():
+                    self.reload()
+        finally:
+            watcher.close()
@@ -0,0 +1,401 @@
+"""Warm process server for qwcore clis
+
+A daemon keeps a built click group, with its loaded plugins and parsed config, in a
+long lived process.  Clients forward their argv, environment and cwd over a unix
+domain socket, and get the stdout, stderr and exit code of the invocation streamed
+back.  Requests are run one at a time, because the environment, cwd and standard
+streams of the daemon are swapped for each of them, unless the daemon is a fork
+server, which runs each of them in a forked child.
+
+The client side only uses the standard library, so a client script doesn't pay
+for importing click or the plugins.
+
+The default sockets are in a per user directory that only the user can access, the
+client only connects to sockets owned by the user, and only the environment
+variables matching `FORWARDED_ENV_VARS` (or the client's `env_vars`) are forwarded.
+
+Messages are frames of a 1 byte kind, a 4 byte big endian length, and a payload.
+"""
+
+import contextlib
+import errno
+import fnmatch
+import io
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import stat
+import struct
+import sys
+import tempfile
+import traceback
+
+from qwcore import log, metrics
+from qwcore.exception import DaemonAlreadyRunningError, DaemonSocketError
+
+LOG = logging.getLogger(__name__)
+
+REQUEST = b'r'
+STDOUT = b'o'
+STDERR = b'e'
+EXIT = b'x'
+
+_HEADER = struct.Struct('>cI')
+
+# fnmatch patterns of the environment variables forwarded by default
+FORWARDED_ENV_VARS = ('HOME', 'USER', 'LOGNAME', 'PATH', 'TERM', 'COLUMNS', 'LINES', 'TZ', 'LANG', 'LANGUAGE',
+                      'LC_*', 'XDG_*', 'QWCORE_*')
+
+
+def _check_private(path, st, kind):
+    """Raise `DaemonSocketError` unless `st` is owned by the user, and isn't
+    accessible by others"""
+    if st.st_uid != os.getuid():
+        raise DaemonSocketError("The daemon %s %s is not owned by the current user" % (kind, path))
+    if st.st_mode & 0o077:
+        raise DaemonSocketError("The daemon %s %s is accessible by other users" % (kind, path))
+
+
+def socket_dir():
+    """Return the private daemon socket directory of the user, in $XDG_RUNTIME_DIR,
+    or the temp dir, creating it with mode 0700 if needed
+
+    :raise DaemonSocketError: if it's not a directory owned by the user, that only
+                              the user can access
+    """
+    runtime_dir = os.environ.get('XDG_RUNTIME_DIR') or tempfile.gettempdir()
+    path = os.path.join(runtime_dir, 'qwcore-%d' % os.getuid())
+    try:
+        os.mkdir(path, 0o700)
+    except OSError as e:
+        if e.errno != errno.EEXIST:
+            raise
+    st = os.lstat(path)
+    if not stat.S_ISDIR(st.st_mode):
+        raise DaemonSocketError("The daemon directory %s is not a directory" % path)
+    _check_private(path, st, 'directory')
+    return path
+
+
+def socket_path(app_name):
+    """Return the default daemon socket path of `app_name`, in `socket_dir`"""
+    return os.path.join(socket_dir(), '%s.sock' % app_name)
+
+
+def forwarded_environ(environ=None, env_vars=None):
+    """Return the variables of `environ` (defaults to `os.environ`) matching the
+    `env_vars` patterns (defaults to `FORWARDED_ENV_VARS`)"""
+    environ = os.environ if environ is None else environ
+    env_vars = FORWARDED_ENV_VARS if env_vars is None else env_vars
+    return dict((name, value) for name, value in environ.items()
+                if any(fnmatch.fnmatchcase(name, pattern) for pattern in env_vars))
+
+
+def _send_frame(sock, kind, payload):
+    sock.sendall(_HEADER.pack(kind, len(payload)) + payload)
+
+
+def _recv_exact(sock, size):
+    chunks = []
+    while size:
+        chunk = sock.recv(min(size, 65536))
+        if not chunk:
+            return None
+        chunks.append(chunk)
+        size -= len(chunk)
+    return b''.join(chunks)
+
+
+def _recv_frame(sock):
+    """Return the next (kind, payload), or (None, None) at eof"""
+    header = _recv_exact(sock, _HEADER.size)
+    if header is None:
+        return None, None
+    kind, size = _HEADER.unpack(header)
+    payload = _recv_exact(sock, size) if size else b''
+    if payload is None:
+        return None, None
+    return kind, payload
+
+
+class _FrameStream(io.TextIOBase):
+    """A text stream that sends what's written to it as frames of `kind`"""
+
+    encoding = 'utf-8'
+
+    def __init__(self, sock, kind, tty=False):
+        self._sock = sock
+        self._kind = kind
+        self._tty = tty
+
+    def writable(self):
+        return True
+
+    def isatty(self):
+        return self._tty
+
+    def write(self, text):
+        # click probes for binary streams by writing b''
+        if isinstance(text, bytes):
+            raise TypeError("write() argument must be text, not bytes")
+        if text:
+            _send_frame(self._sock, self._kind, text.encode('utf-8', 'replace'))
+        return len(text)
+
+
+@contextlib.contextmanager
+def _process_state(argv, environ, cwd, stdout, stderr):
+    """Swap the argv, environment, cwd and standard streams for the block"""
+    saved_environ = dict(os.environ)
+    saved_cwd = os.getcwd()
+    saved_streams = sys.argv, sys.stdin, sys.stdout, sys.stderr
+    os.environ.clear()
+    os.environ.update(environ)
+    os.chdir(cwd)
+    sys.argv, sys.stdin, sys.stdout, sys.stderr = argv, io.StringIO(), stdout, stderr
+    try:
+        yield
+    finally:
+        sys.argv, sys.stdin, sys.stdout, sys.stderr = saved_streams
+        os.chdir(saved_cwd)
+        os.environ.clear()
+        os.environ.update(saved_environ)
+
+
+def _exit_code(code):
+    if code is None:
+        return 0
+    if isinstance(code, int):
+        return code
+    sys.stderr.write('%s\n' % code)
+    return 1
+
+
+class DaemonServer(object):
+    """Serve invocations of a click command over a unix socket
+
+    :param command: the built click command
+    :param path: socket path
+    :param prog_name: program name used in usage and help
+    """
+
+    def __init__(self, command, path, prog_name=None):
+        self.command = command
+        self.path = path
+        self.prog_name = prog_name or command.name
+        self._stopped = False
+        self._sock = None
+
+    def bind(self):
+        if os.path.exists(self.path):
+            probe = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+            try:
+                probe.connect(self.path)
+            except (IOError, OSError):
+                # a stale socket of a daemon that's gone
+                os.unlink(self.path)
+            else:
+                raise DaemonAlreadyRunningError("A daemon is already listening on %s" % self.path)
+            finally:
+                probe.close()
+        self._sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        # no window where the socket is accessible by others
+        umask = os.umask(0o077)
+        try:
+            self._sock.bind(self.path)
+        finally:
+            os.umask(umask)
+        os.chmod(self.path, 0o600)
+        self._sock.listen(16)
+        # wake up regularly to notice `stop`
+        self._sock.settimeout(0.5)
+
+    def serve_forever(self):
+        if self._sock is None:
+            self.bind()
+        try:
+            while not self._stopped:
+                try:
+                    conn, _ = self._sock.accept()
+                except socket.timeout:
+                    continue
+                conn.settimeout(None)
+                try:
+                    self.dispatch(conn)
+                finally:
+                    conn.close()
+        finally:
+            self._sock.close()
+            if os.path.exists(self.path):
+                os.unlink(self.path)
+
+    def dispatch(self, conn):
+        self.handle(conn)
+
+    def stop(self):
+        self._stopped = True
+
+    def handle(self, conn):
+        """Run the request of the client `conn`"""
+        kind, payload = _recv_frame(conn)
+        if kind != REQUEST:
+            return
+        request = json.loads(payload.decode('utf-8'))
+        stdout = _FrameStream(conn, STDOUT, request.get('stdout_tty', False))
+        stderr = _FrameStream(conn, STDERR, request.get('stderr_tty', False))
+        argv = request['argv']
+        metrics.incr('daemon.request')
+        try:
+            with metrics.timer('daemon.request'), \
+                    _process_state([self.prog_name] + argv, request['env'], request['cwd'], stdout, stderr):
+                code = self.run(argv)
+            _send_frame(conn, EXIT, struct.pack('>i', code))
+        except (IOError, OSError) as e:
+            # usually the client went away
+            LOG.debug("Daemon request %r failed: %s" % (argv, e))
+
+    def run(self, argv):
+        """Run the command with `argv`, and return the exit code"""
+        try:
+            self.command.main(args=argv, prog_name=self.prog_name, standalone_mode=True)
+        except SystemExit as e:
+            return _exit_code(e.code)
+        except Exception:
+            traceback.print_exc()
+            return 1
+        return 0
+
+
+class ForkServer(DaemonServer):
+    """Serve each invocation in a child forked from the daemon, so plugins that mutate
+    global state are isolated, while the modules imported by the daemon are shared
+    copy on write.  Children set up their own logging listeners and metrics, and
+    flush them before they exit.
+
+    :param max_children: most children running at once, defaults to the cpu count
+    """
+
+    def __init__(self, command, path, prog_name=None, max_children=None):
+        super(ForkServer, self).__init__(command, path, prog_name=prog_name)
+        self.max_children = max_children or multiprocessing.cpu_count()
+        self.children = set()
+
+    def reap(self, block=False):
+        """Collect the finished children, waiting for one if `block`"""
+        while self.children:
+            pid, _ = os.waitpid(-1, 0 if block else os.WNOHANG)
+            if not pid:
+                return
+            self.children.discard(pid)
+            block = False
+
+    def dispatch(self, conn):
+        self.reap()
+        while len(self.children) >= self.max_children:
+            self.reap(block=True)
+        pid = os.fork()
+        if pid:
+            self.children.add(pid)
+            return
+        code = 1
+        try:
+            self._sock.close()
+            log.after_fork()
+            metrics.after_fork()
+            self.handle(conn)
+            code = 0
+        finally:
+            # os._exit skips the atexit handlers that flush these
+            try:
+                metrics.flush()
+                log.stop_listeners()
+            finally:
+                os._exit(code)
+
+    def serve_forever(self):
+        try:
+            super(ForkServer, self).serve_forever()
+        finally:
+            while self.children:
+                self.reap(block=True)
+
+
+def serve(command, path, prog_name=None, fork=False, max_children=None):
+    """Serve invocations of `command` on the unix socket `path`, until interrupted
+
+    :param fork: run each invocation in a forked child
+    :param max_children: most forked children running at once
+    """
+    if fork:
+        server = ForkServer(command, path, prog_name=prog_name, max_children=max_children)
+    else:
+        server = DaemonServer(command, path, prog_name=prog_name)
+    server.bind()
+    LOG.info("Serving %s on %s" % (server.prog_name, path))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+def run_client(path, argv=None, environ=None, cwd=None, stdout=None, stderr=None, env_vars=None):
+    """Run an invocation in the daemon listening on `path`, and return its exit code.
+    Raises socket errors when no daemon is listening.
+
+    :param argv: arguments, defaults to `sys.argv[1:]`
+    :param environ: environment, defaults to `os.environ`.  Only its variables
+                    matching `env_vars` are forwarded.
+    :param cwd: working dir, defaults to the current one
+    :param stdout: output stream, defaults to stdout
+    :param stderr: error stream, defaults to stderr
+    :param env_vars: fnmatch patterns of the forwarded environment variables,
+                     defaults to `FORWARDED_ENV_VARS`
+    :raise DaemonSocketError: if the socket isn't owned by the user
+    """
+    st = os.stat(path)
+    if not stat.S_ISSOCK(st.st_mode) or st.st_uid != os.getuid():
+        raise DaemonSocketError("%s is not a daemon socket of the current user" % path)
+    stdout = sys.stdout if stdout is None else stdout
+    stderr = sys.stderr if stderr is None else stderr
+    request = {
+        'argv': sys.argv[1:] if argv is None else list(argv),
+        'env': forwarded_environ(environ, env_vars),
+        'cwd': os.getcwd() if cwd is None else cwd,
+        'stdout_tty': bool(getattr(stdout, 'isatty', None) and stdout.isatty()),
+        'stderr_tty': bool(getattr(stderr, 'isatty', None) and stderr.isatty()),
+    }
+    outputs = {STDOUT: getattr(stdout, 'buffer', stdout), STDERR: getattr(stderr, 'buffer', stderr)}
+    sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        sock.connect(path)
+        _send_frame(sock, REQUEST, json.dumps(request).encode('utf-8'))
+        while True:
+            kind, payload = _recv_frame(sock)
+            if kind is None:
+                stderr.write('The daemon on %s closed the connection\n' % path)
+                return 1
+            if kind == EXIT:
+                return struct.unpack('>i', payload)[0]
+            outputs[kind].write(payload)
+            outputs[kind].flush()
+    finally:
+        sock.close()
+
+
+def client_main(path, fallback=None, env_vars=None):
+    """Console script entry point body: run `sys.argv` in the daemon on `path`, and
+    exit with its exit code.  If no daemon is listening, call `fallback` (e.g. the
+    regular command) if given.
+
+    :param env_vars: fnmatch patterns of the forwarded environment variables, see
+                     `run_client`
+    """
+    try:
+        code = run_client(path, env_vars=env_vars)
+    except (IOError, OSError) as e:
+        if fallback is None or e.errno not in (errno.ENOENT, errno.ECONNREFUSED):
+            raise
+        return fallback()
+    sys.exit(code)
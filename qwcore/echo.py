@@ -1,19 +1,104 @@
 """Colored Echos"""
 
+import contextlib
+import sys
+import threading
+
 from click import echo, style
+import six
+
+# fg -> (ansi prefix, ansi suffix)
+_AFFIXES = {}
+
+_local = threading.local()
+
+
+def _affixes(fg):
+    """Return the ansi (prefix, suffix) for the color `fg`, computed once per color"""
+    try:
+        return _AFFIXES[fg]
+    except KeyError:
+        prefix, suffix = style('\0', fg=fg).split('\0')
+        _AFFIXES[fg] = (prefix, suffix)
+        return prefix, suffix
+
+
+class _Buffer(object):
+    """Styled lines waiting to be written to `stream` in one chunk"""
+
+    def __init__(self, stream, color, chunk_size):
+        self.stream = stream
+        self.color = color
+        self.chunk_size = chunk_size
+        self.lines = []
+        self.size = 0
+
+    def add(self, msg, fg=None):
+        line = msg if isinstance(msg, six.string_types) else six.text_type(msg)
+        if fg and self.color:
+            prefix, suffix = _affixes(fg)
+            line = prefix + line + suffix
+        self.lines.append(line)
+        self.size += len(line) + 1
+        if self.size >= self.chunk_size:
+            self.flush()
+
+    def flush(self):
+        if self.lines:
+            self.stream.write('\n'.join(self.lines) + '\n')
+            self.stream.flush()
+            self.lines = []
+            self.size = 0
+
+
+@contextlib.contextmanager
+def buffered(stream=None, color=None, chunk_size=65536):
+    """Buffer the echos of the current thread, and write them in chunks of about
+    `chunk_size` characters, and when the block exits.  Nested blocks share the
+    outermost buffer.
+
+    :param stream: output stream, defaults to stdout
+    :param color: keep the colors, defaults to whether the stream is a tty
+    :param chunk_size: buffered characters that trigger a write
+    """
+    if getattr(_local, 'buffer', None) is not None:
+        yield _local.buffer
+        return
+    if stream is None:
+        stream = sys.stdout
+    if color is None:
+        color = bool(getattr(stream, 'isatty', None) and stream.isatty())
+    _local.buffer = _Buffer(stream, color, chunk_size)
+    try:
+        yield _local.buffer
+    finally:
+        try:
+            _local.buffer.flush()
+        finally:
+            _local.buffer = None
+
+
+def _echo(msg, fg=None):
+    buffer = getattr(_local, 'buffer', None)
+    if buffer is not None:
+        buffer.add(msg, fg)
+    elif fg:
+        echo(style(msg, fg=fg))
+    else:
+        echo(msg)
 
 
 def info(msg):
-    echo(msg)
+    _echo(msg)
 
 
 def success(msg):
-    echo(style(msg, fg='green'))
+    _echo(msg, fg='green')
 
 
 def warning(msg):
-    echo(style(msg, fg='yellow'))
+    _echo(msg, fg='yellow')
 
 
 def error(msg):
-    echo(style(msg, fg='red'))
+    _echo(msg, fg='red')
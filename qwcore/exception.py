@@ -23,6 +23,10 @@ class PluginNoNameAttributeError(QwcoreError):
     """Raised when a plugin has no 'name' attribute"""
 
 
+class UnknownPluginBackendError(QwcoreError):
+    """Raised when an unknown plugin discovery backend is requested"""
+
+
 class ConfigFileNotFoundError(QwcoreError):
     """Raised when the config file for an app is not found"""
 
@@ -37,3 +41,15 @@ class ConfigFileSectionNotFoundError(QwcoreError):
 
 class ConfigFileKeyNotFoundError(QwcoreError):
     """Raised when a section is not precent in the config file"""
+
+
+class ConfigValueError(QwcoreError):
+    """Raised when a config value can't be converted to its declared type"""
+
+
+class DaemonAlreadyRunningError(QwcoreError):
+    """Raised when a daemon is already listening on a socket"""
+
+
+class DaemonSocketError(QwcoreError):
+    """Raised when a daemon socket, or its directory, isn't private to the user"""
@@ -0,0 +1,183 @@
+"""A console script launcher for `build_command` clis, with fast paths
+
+`launch` answers `--version`, the bare command listing and `--help` from a cached
+launch table, with only standard library imports (and `qwcore.cache`, to find the
+cache file).  A known plugin subcommand is dispatched through a lazy `build_command` group
+that only loads the invoked plugin, from the on-disk entry point index.  Anything else,
+and any run without a current table, imports the real click group, which refreshes
+the table.
+
+The table is tied to the mtimes of the `sys.path` directories, which change when
+distributions are installed, upgraded or removed.  Use it from a console script
+module like::
+
+    from qwcore.launcher import launch
+
+    def main():
+        launch('mytool', 'mytool.cli:cli')
+"""
+
+import json
+import os
+import sys
+
+TABLE_FORMAT = 2
+
+# click caps the help width at 80 columns by default
+MAX_HELP_WIDTH = 80
+
+PROFILE_ENV_VAR = 'QWCORE_PROFILE_STARTUP'
+PROFILE_FLAG = '--profile-startup'
+
+
+def table_path(prog_name):
+    """Return the path of the launch table of `prog_name` in this environment, in the
+    qwcore cache dir"""
+    from qwcore import cache
+    return os.path.join(cache.cache_dir(), 'launch-%s-%s.json' % (prog_name, cache.environment_key()))
+
+
+def paths_signature(paths=None):
+    """Return the mtimes of the `paths` directories, defaults to `sys.path`"""
+    signature = []
+    for path in sys.path if paths is None else paths:
+        try:
+            signature.append([path, os.stat(path or os.curdir).st_mtime])
+        except OSError:
+            signature.append([path, None])
+    return signature
+
+
+def help_width(environ=None):
+    """Return the help width click would use for the terminal"""
+    environ = os.environ if environ is None else environ
+    try:
+        columns = int(environ['COLUMNS'])
+    except (KeyError, ValueError):
+        try:
+            columns = os.get_terminal_size(sys.__stdout__.fileno()).columns
+        except (AttributeError, ValueError, OSError):
+            columns = MAX_HELP_WIDTH
+    return min(columns, MAX_HELP_WIDTH)
+
+
+def load_table(prog_name):
+    """Return the launch table of `prog_name`, or None if it's missing or stale"""
+    try:
+        with open(table_path(prog_name)) as fh:
+            table = json.load(fh)
+    except (IOError, OSError, ValueError):
+        return None
+    if table.get('format') != TABLE_FORMAT or table.get('signature') != paths_signature():
+        return None
+    return table
+
+
+def save_table(prog_name, table):
+    path = table_path(prog_name)
+    tmp_path = '%s.%d.tmp' % (path, os.getpid())
+    try:
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+        with open(tmp_path, 'w') as fh:
+            json.dump(table, fh)
+        getattr(os, 'replace', os.rename)(tmp_path, path)
+    except (IOError, OSError):
+        pass
+
+
+def _plugin_commands(command, names):
+    """Return the `names` of the plugin subcommands of a `build_command` group.  The
+    names it hasn't built a command for yet are lazily discovered plugins."""
+    return [name for name in names
+            if name not in command.commands or getattr(command.commands[name], 'qwcore_plugin', False)]
+
+
+def build_table(command, prog_name, width=None):
+    """Return the launch table of a `build_command` group, with its rendered command
+    listing and help
+
+    :param command: click group built by `build_command`
+    :param prog_name: program name
+    :param width: help width, defaults to the terminal's
+    """
+    import click
+    from click.testing import CliRunner
+    width = help_width() if width is None else width
+    try:
+        # click < 8.2 mixes stderr into stdout by default
+        runner = CliRunner(mix_stderr=False)
+    except TypeError:
+        runner = CliRunner()
+    commands = command.list_commands(click.Context(command, info_name=prog_name))
+    table = {
+        'format': TABLE_FORMAT,
+        'signature': paths_signature(),
+        'width': width,
+        'build_args': command.qwcore_build_args,
+        'commands': commands,
+        # only these can be dispatched by a group rebuilt from `build_args`
+        'plugin_commands': _plugin_commands(command, commands),
+    }
+    for key, args in (('listing', []), ('help', ['--help'])):
+        result = runner.invoke(command, args, prog_name=prog_name, terminal_width=width)
+        table[key] = [result.stdout, result.stderr, result.exit_code]
+    return table
+
+
+def _load_target(target):
+    """Return the click group `target`, a 'module:attr' string"""
+    if not isinstance(target, str):
+        return target
+    import importlib
+    module_name, _, attr = target.partition(':')
+    return getattr(importlib.import_module(module_name), attr)
+
+
+def _output(stdout, stderr, code):
+    sys.stdout.write(stdout)
+    sys.stdout.flush()
+    sys.stderr.write(stderr)
+    sys.stderr.flush()
+    return code
+
+
+def _fast_path(prog_name, argv, table):
+    """Return the exit code of `argv` if it has a fast path, else None"""
+    if argv == ['--version']:
+        return _output(table['build_args']['version'] + '\n', '', 0)
+    if argv in ([], ['--help']) and table['width'] == help_width():
+        return _output(*table['listing' if not argv else 'help'])
+    if argv and argv[0] in table['plugin_commands']:
+        from qwcore.cli import build_command
+        kwargs = dict(table['build_args'], lazy=True, use_index=True)
+        return build_command(**kwargs).main(argv, prog_name=prog_name)
+    return None
+
+
+def launch(prog_name, target, argv=None):
+    """Run a `build_command` cli from a console script, and exit
+
+    :param prog_name: program name
+    :param target: 'module:attr' of the click group built by `build_command`, only
+                   imported when there's no fast path
+    :param argv: arguments, defaults to `sys.argv[1:]`
+    """
+    argv = sys.argv[1:] if argv is None else list(argv)
+    profile = os.environ.get(PROFILE_ENV_VAR) or PROFILE_FLAG in argv
+    complete_var = '_%s_COMPLETE' % prog_name.replace('-', '_').replace('.', '_').upper()
+    if os.environ.get(complete_var):
+        from qwcore import complete
+        if complete.complete(prog_name):
+            sys.exit(0)
+        # the real group answers, and rebuilds the completion table
+        _load_target(target).main(argv, prog_name=prog_name)
+    table = load_table(prog_name)
+    if table is not None and not profile:
+        code = _fast_path(prog_name, argv, table)
+        if code is not None:
+            sys.exit(code)
+    command = _load_target(target)
+    if table is None and hasattr(command, 'qwcore_build_args'):
+        save_table(prog_name, build_table(command, prog_name))
+    command.main(argv, prog_name=prog_name)
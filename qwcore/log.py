@@ -1,12 +1,267 @@
+import atexit
+import copy
+import json
 import logging
 import sys
+import threading
 
+from six.moves import queue
 
-def configure_logging(namespace, log_format='%(message)s', log_level='INFO'):
-    """Setup logging"""
+try:
+    from logging.handlers import QueueHandler
+except ImportError:
+    # python 2
+    class QueueHandler(logging.Handler):
+        """The python 3 `logging.handlers.QueueHandler` interface"""
+
+        def __init__(self, record_queue):
+            logging.Handler.__init__(self)
+            self.queue = record_queue
+
+        def enqueue(self, record):
+            self.queue.put_nowait(record)
+
+        def prepare(self, record):
+            self.format(record)
+            record.msg = record.message
+            record.args = None
+            record.exc_info = None
+            return record
+
+        def emit(self, record):
+            try:
+                self.enqueue(self.prepare(record))
+            except Exception:
+                self.handleError(record)
+
+
+OVERFLOW_POLICIES = ('block', 'drop_oldest', 'drop')
+
+_SENTINEL = None
+
+# namespace -> (settings, handler) of the handler added by `configure_logging`
+_CONFIGURED = {}
+
+
+class BoundedQueueHandler(QueueHandler):
+    """A `QueueHandler` for a bounded queue, with a policy for when it's full:
+
+    - block: wait for room in the queue
+    - drop_oldest: discard the oldest queued record
+    - drop: discard the new record
+
+    Dropped records are counted in `dropped`.
+    """
+
+    def __init__(self, record_queue, overflow='block'):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError("unknown overflow policy '%s'" % overflow)
+        super(BoundedQueueHandler, self).__init__(record_queue)
+        self.overflow = overflow
+        self.dropped = 0
+
+    def prepare(self, record):
+        # merge the args here, so they can't change before the listener formats the
+        # record, but leave the formatting to the listener thread
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
+
+    def enqueue(self, record):
+        if self.overflow == 'block':
+            self.queue.put(record)
+            return
+        while True:
+            try:
+                self.queue.put_nowait(record)
+                return
+            except queue.Full:
+                self.dropped += 1
+                if self.overflow == 'drop':
+                    return
+            try:
+                self.queue.get_nowait()
+            except queue.Empty:
+                pass
+
+
+class BatchStreamListener(object):
+    """Write the records from a queue to a stream from a background thread, in
+    batches of up to `batch_size` records, with one write and flush per batch
+
+    :param record_queue: the queue the handler puts records in
+    :param formatter: formatter for the records
+    :param stream: output stream, defaults to `sys.stdout`
+    :param batch_size: max number of records per write
+    """
+
+    def __init__(self, record_queue, formatter, stream=None, batch_size=256):
+        self.queue = record_queue
+        self.formatter = formatter
+        self.stream = stream or sys.stdout
+        self.batch_size = batch_size
+        self._stopping = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._stopping.clear()
+        self._thread = threading.Thread(target=self._monitor, name='qwcore-log-listener')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Flush the queued records and stop the thread"""
+        if self._thread is None:
+            return
+        self._stopping.set()
+        self.queue.put(_SENTINEL)
+        self._thread.join()
+        self._thread = None
+
+    def _write(self, records):
+        lines = [self.formatter.format(record) for record in records]
+        self.stream.write('\n'.join(lines) + '\n')
+        self.stream.flush()
+
+    def _monitor(self):
+        while True:
+            if self._stopping.is_set():
+                # a full 'drop_oldest' queue can drop the sentinel, so once stopping,
+                # only drain what's queued
+                try:
+                    records = [self.queue.get_nowait()]
+                except queue.Empty:
+                    return
+            else:
+                records = [self.queue.get()]
+            while records[-1] is not _SENTINEL and len(records) < self.batch_size:
+                try:
+                    records.append(self.queue.get_nowait())
+                except queue.Empty:
+                    break
+            done = records[-1] is _SENTINEL
+            if done:
+                records.pop()
+            if records:
+                try:
+                    self._write(records)
+                except Exception:
+                    sys.stderr.write("qwcore log listener failed to write %d records\n" % len(records))
+            if done:
+                return
+
+
+class JsonFormatter(logging.Formatter):
+    """Format records as single line json objects.  The static fields are serialized
+    once, and only the record fields (time, level, logger, pid, message, exception)
+    are serialized per record.
+
+    :param static_fields: dict of fields added to every record, e.g. app name and version
+    """
+
+    def __init__(self, static_fields=None):
+        super(JsonFormatter, self).__init__()
+        self._encode = json.JSONEncoder(separators=(',', ':'), default=str).encode
+        static = self._encode(static_fields or {})
+        # the static object without its closing brace, to prepend to the record fields
+        self._prefix = static[:-1] + ',' if len(static) > 2 else '{'
+
+    def format(self, record):
+        fields = {
+            'time': record.created,
+            'level': record.levelname,
+            'logger': record.name,
+            'pid': record.process,
+            'message': record.getMessage(),
+        }
+        if record.exc_info and not record.exc_text:
+            record.exc_text = self.formatException(record.exc_info)
+        if record.exc_text:
+            fields['exception'] = record.exc_text
+        return self._prefix + self._encode(fields)[1:]
+
+
+def _remove_handler(logger, handler):
+    logger.removeHandler(handler)
+    listener = getattr(handler, 'listener', None)
+    if listener is not None:
+        listener.stop()
+
+
+def configure_logging(namespace, log_format='%(message)s', log_level='INFO', use_queue=False,
+                      queue_size=10000, overflow='block', batch_size=256, structured=False,
+                      static_fields=None):
+    """Setup logging.  It's idempotent per namespace: calling it again with the same
+    settings keeps the existing handler, and with other settings replaces it.
+
+    :param namespace: logger name
+    :param log_format: log record format
+    :param log_level: log level name
+    :param use_queue: log through a bounded queue, written to stdout in batches by a
+                      background thread that is stopped (and flushed) at exit
+    :param queue_size: max number of queued records
+    :param overflow: what to do when the queue is full, 'block', 'drop_oldest' or 'drop'
+    :param batch_size: max number of records per write
+    :param structured: write single line json records, instead of using `log_format`
+    :param static_fields: extra fields for every json record, e.g. {'version': '1.0'}.
+                          'app' (the namespace) and the record's 'pid' are always
+                          included.
+    """
     logger = logging.getLogger(namespace)
-    formatter = logging.Formatter(log_format)
-    handler = logging.StreamHandler(sys.stdout)
-    handler.setFormatter(formatter)
+    settings = (log_format, use_queue, queue_size, overflow, batch_size, structured,
+                sorted((static_fields or {}).items()))
     logger.setLevel(getattr(logging, log_level))
+    configured = _CONFIGURED.get(namespace)
+    if configured:
+        previous_settings, previous_handler = configured
+        if previous_handler in logger.handlers:
+            if previous_settings == settings:
+                return previous_handler
+            _remove_handler(logger, previous_handler)
+    if structured:
+        fields = {'app': namespace}
+        fields.update(static_fields or {})
+        formatter = JsonFormatter(fields)
+    else:
+        formatter = logging.Formatter(log_format)
+    if use_queue:
+        record_queue = queue.Queue(queue_size)
+        handler = BoundedQueueHandler(record_queue, overflow=overflow)
+        listener = BatchStreamListener(record_queue, formatter, batch_size=batch_size)
+        listener.start()
+        atexit.register(listener.stop)
+        handler.listener = listener
+    else:
+        handler = logging.StreamHandler(sys.stdout)
+        handler.setFormatter(formatter)
     logger.addHandler(handler)
+    _CONFIGURED[namespace] = (settings, handler)
+    return handler
+
+
+def _listeners():
+    for _, handler in _CONFIGURED.values():
+        listener = getattr(handler, 'listener', None)
+        if listener is not None:
+            yield handler, listener
+
+
+def stop_listeners():
+    """Stop the listener threads of the queued `configure_logging` handlers, writing
+    out their queued records, e.g. before a forked child calls `os._exit`"""
+    for _, listener in _listeners():
+        listener.stop()
+
+
+def after_fork():
+    """Give the queued `configure_logging` handlers new queues and listener threads
+    in a forked child, where the listener threads of the parent don't run"""
+    for handler, listener in _listeners():
+        handler.queue = listener.queue = queue.Queue(handler.queue.maxsize)
+        listener._stopping = threading.Event()
+        listener._thread = None
+        listener.start()
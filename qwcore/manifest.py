@@ -0,0 +1,158 @@
+"""Help manifests for subcommand plugins
+
+A manifest captures the name, help and click params of every subcommand plugin in
+an entry point group, so help listings and shell completion can be served without
+importing the plugin modules.
+"""
+
+import textwrap
+
+import click
+import six
+
+from qwcore import cache
+from qwcore.plugin import get_plugins, get_plugin_projects, get_project_version
+
+MANIFEST_FORMAT = 1
+
+PARAM_TYPES = {
+    'text': click.STRING,
+    'integer': click.INT,
+    'float': click.FLOAT,
+    'boolean': click.BOOL,
+    'uuid': click.UUID,
+}
+
+JSON_SCALARS = six.string_types + six.integer_types + (float,)
+
+
+def manifest_name(command_group):
+    """Return the cache file name of the manifest for `command_group` in this
+    environment"""
+    return 'manifest-%s-%s.json' % (command_group, cache.environment_key())
+
+
+def _json_default(default):
+    """Return `default` if it's json serializable, else None"""
+    if isinstance(default, JSON_SCALARS):
+        return default
+    if isinstance(default, (list, tuple)) and all(isinstance(d, JSON_SCALARS) for d in default):
+        return list(default)
+    return None
+
+
+def serialize_param(param):
+    """Return a json serializable dict for a click option or argument
+
+    :param param: click parameter
+    """
+    return {
+        'param_type_name': param.param_type_name,
+        'name': param.name,
+        'opts': list(param.opts),
+        'secondary_opts': list(param.secondary_opts),
+        'type': param.type.name,
+        'choices': [str(c) for c in getattr(param.type, 'choices', None) or []],
+        'nargs': param.nargs,
+        'multiple': param.multiple,
+        'required': param.required,
+        'metavar': param.metavar,
+        'default': _json_default(param.default),
+        'help': getattr(param, 'help', None),
+        'is_flag': getattr(param, 'is_flag', False),
+        'count': getattr(param, 'count', False),
+        'hidden': getattr(param, 'hidden', False),
+    }
+
+
+def deserialize_param(data):
+    """Return a click option or argument rebuilt from `serialize_param` data.  It's
+    equivalent for help and completion, but custom types are not restored.
+
+    :param data: serialized parameter
+    """
+    if data['choices']:
+        param_type = click.Choice(data['choices'])
+    else:
+        param_type = PARAM_TYPES.get(data['type'], click.STRING)
+    kwargs = {'required': data['required']}
+    if data['default'] is not None:
+        kwargs['default'] = data['default']
+    if data['param_type_name'] == 'argument':
+        return click.Argument([data['name']], type=param_type, nargs=data['nargs'],
+                              metavar=data['metavar'], **kwargs)
+    opts, secondary_opts = data['opts'], data['secondary_opts']
+    decls = [data['name']] + ['%s/%s' % pair for pair in zip(opts, secondary_opts)]
+    decls.extend(opts[len(secondary_opts):])
+    kwargs.update(help=data['help'], hidden=data['hidden'])
+    if data['is_flag']:
+        return click.Option(decls, is_flag=True, **kwargs)
+    if data['count']:
+        return click.Option(decls, count=True, **kwargs)
+    metavar = data['metavar']
+    if metavar is None and not data['choices'] and data['type'] not in PARAM_TYPES:
+        metavar = data['type'].upper()
+    return click.Option(decls, type=param_type, nargs=data['nargs'], multiple=data['multiple'],
+                        metavar=metavar, **kwargs)
+
+
+def build_manifest(command_group, use_index=False):
+    """Load every subcommand plugin of `command_group` and return its manifest
+
+    :param command_group: the entry point group for the subcommand extensions
+    :param use_index: use the on-disk entry point index
+    """
+    projects = get_plugin_projects(command_group, use_index=use_index)
+    commands = {}
+    for name, cls in six.iteritems(get_plugins(command_group, use_index=use_index)):
+        commands[name] = {
+            'short_help': cls.help,
+            'help': textwrap.dedent(' ' * 4 + cls.__doc__),
+            'params': [serialize_param(param) for param in cls.params],
+        }
+    versions = dict((project, get_project_version(project)) for project in set(projects.values()))
+    return {'format': MANIFEST_FORMAT, 'versions': versions, 'commands': commands}
+
+
+def _is_current(manifest, command_group, use_index=False):
+    """Return True if `manifest` matches the installed plugins of `command_group`
+    and the versions of the distributions that provide them"""
+    if not manifest or manifest.get('format') != MANIFEST_FORMAT:
+        return False
+    projects = get_plugin_projects(command_group, use_index=use_index)
+    if sorted(projects) != sorted(manifest['commands']):
+        return False
+    for project in set(projects.values()):
+        if manifest['versions'].get(project) != get_project_version(project):
+            return False
+    return True
+
+
+def get_manifest(command_group, use_index=False):
+    """Return the cached manifest for `command_group`, rebuilding and saving it when
+    plugins were added or removed, or their distribution versions changed
+
+    :param command_group: the entry point group for the subcommand extensions
+    :param use_index: use the on-disk entry point index
+    """
+    name = manifest_name(command_group)
+    manifest = cache.load(name)
+    if not _is_current(manifest, command_group, use_index=use_index):
+        manifest = build_manifest(command_group, use_index=use_index)
+        cache.save(name, manifest)
+    return manifest
+
+
+def build_manifest_command(name, entry):
+    """Return a click command rebuilt from a manifest `entry`, for help and completion.
+    Invoking it does nothing.
+
+    :param name: command name
+    :param entry: manifest entry for the command
+    """
+    return click.Command(
+        name,
+        short_help=entry['short_help'],
+        help=entry['help'],
+        params=[deserialize_param(param) for param in entry['params']]
+    )
@@ -0,0 +1,211 @@
+"""Counters and timers for the qwcore hot paths
+
+Metrics are off by default, and then `incr` returns right away, and `timer` returns
+a shared no-op context manager.  `enable` turns them on with a list of exporters.
+
+Exporters can implement any of:
+
+- counter(name, value): called for every counter increment
+- timing(name, seconds): called for every timer observation
+- flush(snapshot): called by `flush` and at exit, with the aggregated metrics
+"""
+
+import atexit
+import logging
+import os
+import re
+import socket
+import threading
+import time
+
+LOG = logging.getLogger(__name__)
+
+_clock = getattr(time, 'monotonic', time.time)
+
+_enabled = False
+_exporters = []
+_lock = threading.Lock()
+# name -> value
+_counters = {}
+# name -> [count, total seconds, max seconds]
+_timers = {}
+_atexit_registered = False
+
+
+class _NullTimer(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_TIMER = _NullTimer()
+
+
+class _Timer(object):
+
+    def __init__(self, name):
+        self.name = name
+
+    def __enter__(self):
+        self.start = _clock()
+        return self
+
+    def __exit__(self, *exc_info):
+        observe(self.name, _clock() - self.start)
+        return False
+
+
+def enable(*exporters):
+    """Turn metrics on, with `exporters`"""
+    global _enabled, _atexit_registered
+    _exporters[:] = exporters
+    _enabled = True
+    if not _atexit_registered:
+        atexit.register(flush)
+        _atexit_registered = True
+
+
+def disable():
+    """Turn metrics off, and drop the aggregated metrics and exporters"""
+    global _enabled
+    _enabled = False
+    del _exporters[:]
+    with _lock:
+        _counters.clear()
+        _timers.clear()
+
+
+def after_fork():
+    """Reset the metrics in a forked child, so it only reports its own.  The lock is
+    replaced too, since another thread of the parent may have held it at the fork."""
+    global _lock
+    _lock = threading.Lock()
+    _counters.clear()
+    _timers.clear()
+
+
+def enabled():
+    return _enabled
+
+
+def incr(name, value=1):
+    """Increment the counter `name`"""
+    if not _enabled:
+        return
+    with _lock:
+        _counters[name] = _counters.get(name, 0) + value
+    for exporter in _exporters:
+        if hasattr(exporter, 'counter'):
+            exporter.counter(name, value)
+
+
+def observe(name, seconds):
+    """Record a `seconds` observation for the timer `name`"""
+    if not _enabled:
+        return
+    with _lock:
+        stats = _timers.get(name)
+        if stats is None:
+            _timers[name] = [1, seconds, seconds]
+        else:
+            stats[0] += 1
+            stats[1] += seconds
+            stats[2] = max(stats[2], seconds)
+    for exporter in _exporters:
+        if hasattr(exporter, 'timing'):
+            exporter.timing(name, seconds)
+
+
+def timer(name):
+    """Return a context manager that observes its duration for the timer `name`"""
+    if not _enabled:
+        return _NULL_TIMER
+    return _Timer(name)
+
+
+def snapshot():
+    """Return the aggregated metrics, as {'counters': {name: value}, 'timers': {name:
+    {'count', 'sum', 'max'}}}"""
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'timers': dict((name, {'count': s[0], 'sum': s[1], 'max': s[2]}) for name, s in _timers.items()),
+        }
+
+
+def flush():
+    """Pass the aggregated metrics to the exporters that flush"""
+    if not _enabled:
+        return
+    data = snapshot()
+    for exporter in _exporters:
+        if hasattr(exporter, 'flush'):
+            try:
+                exporter.flush(data)
+            except Exception as e:
+                LOG.debug("Metrics exporter %r failed: %s" % (exporter, e))
+
+
+def _metric_name(prefix, name):
+    return re.sub('[^a-zA-Z0-9_]', '_', '%s_%s' % (prefix, name))
+
+
+class PrometheusTextExporter(object):
+    """Write the metrics to a file in the prometheus text format, e.g. for the node
+    exporter's textfile collector.  Counters get a '_total' suffix, and timers are
+    written as summaries in seconds.
+
+    :param path: output file, replaced atomically
+    :param prefix: metric name prefix
+    """
+
+    def __init__(self, path, prefix='qwcore'):
+        self.path = path
+        self.prefix = prefix
+
+    def format(self, data):
+        lines = []
+        for name, value in sorted(data['counters'].items()):
+            metric = _metric_name(self.prefix, name) + '_total'
+            lines.extend(['# TYPE %s counter' % metric, '%s %s' % (metric, value)])
+        for name, stats in sorted(data['timers'].items()):
+            metric = _metric_name(self.prefix, name) + '_seconds'
+            lines.extend(['# TYPE %s summary' % metric,
+                          '%s_count %s' % (metric, stats['count']),
+                          '%s_sum %r' % (metric, stats['sum'])])
+        return '\n'.join(lines) + '\n'
+
+    def flush(self, data):
+        tmp_path = '%s.%d.tmp' % (self.path, os.getpid())
+        with open(tmp_path, 'w') as fh:
+            fh.write(self.format(data))
+        getattr(os, 'replace', os.rename)(tmp_path, self.path)
+
+
+class StatsdExporter(object):
+    """Send every counter increment and timer observation to a statsd server over udp
+
+    :param host: statsd host
+    :param port: statsd port
+    :param prefix: metric name prefix
+    """
+
+    def __init__(self, host='127.0.0.1', port=8125, prefix='qwcore'):
+        self.address = (host, port)
+        self.prefix = prefix
+        self._socket = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+
+    def _send(self, payload):
+        try:
+            self._socket.sendto(payload.encode('utf-8'), self.address)
+        except (IOError, OSError):
+            pass
+
+    def counter(self, name, value):
+        self._send('%s.%s:%s|c' % (self.prefix, name, value))
+
+    def timing(self, name, seconds):
+        self._send('%s.%s:%.3f|ms' % (self.prefix, name, seconds * 1000))
@@ -1,35 +1,310 @@
-import pkg_resources
+import importlib
+import re
+import sys
+import threading
 
+import six
+
+from qwcore import cache, launcher, metrics, startup
 from qwcore.exception import (PluginNameNotFoundError, NoPluginsFoundError,
                               DuplicatePluginError, PluginNameMismatchError,
-                              PluginNoNameAttributeError)
+                              PluginNoNameAttributeError, UnknownPluginBackendError)
 
+try:
+    from importlib import metadata as importlib_metadata
+except ImportError:
+    try:
+        import importlib_metadata
+    except ImportError:
+        importlib_metadata = None
 
-def _iter_entry_points(group, name=None, project=None):
-    """Yield entry point objects from `group` matching `name`, and `project`"""
-    for dist in pkg_resources.working_set:
-        if project and dist.project_name != project:
+INDEX_CACHE_NAME = 'entry_points-%s.json'
+
+BACKENDS = ('importlib', 'pkg_resources')
+DEFAULT_BACKEND = 'importlib' if importlib_metadata else 'pkg_resources'
+
+
+class IndexedEntryPoint(object):
+    """An entry point rebuilt from a scan or the on-disk index, that can be loaded
+    without scanning the working set.  The loaded plugin is kept."""
+
+    def __init__(self, name, value, project_name):
+        self.name = name
+        self.value = value
+        self.project_name = project_name
+        self._plugin = None
+
+    def load(self):
+        if self._plugin is not None:
+            return self._plugin
+        # drop the extras of 'module:attrs [extra,...]' values
+        module_name, _, attrs = self.value.split('[')[0].partition(':')
+        plugin = importlib.import_module(module_name.strip())
+        for attr in attrs.strip().split('.') if attrs.strip() else []:
+            try:
+                plugin = getattr(plugin, attr)
+            except AttributeError as e:
+                raise ImportError(str(e))
+        self._plugin = plugin
+        return plugin
+
+    def __repr__(self):
+        return 'IndexedEntryPoint(%r, %r, %r)' % (self.name, self.value, self.project_name)
+
+
+def _entry_point_value(entry_point):
+    """Return the 'module:attrs' string for a `pkg_resources` entry point"""
+    if entry_point.attrs:
+        return '%s:%s' % (entry_point.module_name, '.'.join(entry_point.attrs))
+    return entry_point.module_name
+
+
+def _safe_name(name):
+    """Return the `pkg_resources` style project name for a distribution `name`"""
+    return re.sub('[^A-Za-z0-9.]+', '-', name or '')
+
+
+def _check_backend(backend):
+    """Return `backend`, or the default backend if it's None
+
+    :raise UnknownPluginBackendError: if the backend is not known
+    """
+    backend = backend or DEFAULT_BACKEND
+    if backend not in BACKENDS:
+        raise UnknownPluginBackendError("unknown plugin backend '%s'" % backend)
+    return backend
+
+
+def _iter_importlib_dists():
+    """Yield (project name, distribution) pairs from `importlib.metadata`, skipping
+    shadowed duplicates like the `pkg_resources` working set does"""
+    seen = set()
+    for dist in importlib_metadata.distributions():
+        project_name = _safe_name(dist.metadata['Name'])
+        if project_name.lower() in seen:
             continue
-        entries = dist.get_entry_map(group)
-        if name is None:
-            for ep in entries.values():
-                yield ep
-        elif name in entries:
-            yield entries[name]
+        seen.add(project_name.lower())
+        yield project_name, dist
+
+
+def _scan_entry_points(backend=None):
+    """Return the entry points of every group from the installed distributions, as a
+    dict of group -> [[project, name, value], ...] in distribution order
+
+    :param backend: discovery backend, 'importlib' or 'pkg_resources'
+    """
+    index = {}
+    if _check_backend(backend) == 'importlib':
+        for project_name, dist in _iter_importlib_dists():
+            for ep in dist.entry_points:
+                # without the extras of 'module:attrs [extra,...]' values
+                index.setdefault(ep.group, []).append([project_name, ep.name, ep.value.split('[')[0].strip()])
+        return index
+    import pkg_resources
+    for dist in pkg_resources.working_set:
+        for group, entries in six.iteritems(dist.get_entry_map()):
+            for entry_point in entries.values():
+                index.setdefault(group, []).append(
+                    [dist.project_name, entry_point.name, _entry_point_value(entry_point)])
+    return index
+
+
+def index_cache_name():
+    """Return the cache file name of the entry point index of this environment"""
+    return INDEX_CACHE_NAME % cache.environment_key()
+
+
+def _get_index(backend=None, fingerprint=None):
+    """Return the entry point index, rebuilding and saving it if the installed
+    distributions have changed since it was cached
+
+    :param backend: discovery backend used to rebuild the index
+    :param fingerprint: the current `cache.dists_fingerprint`, if it's known
+    """
+    if fingerprint is None:
+        fingerprint = cache.dists_fingerprint()
+    name = index_cache_name()
+    data = cache.load(name)
+    if data and data.get('fingerprint') == fingerprint:
+        return data['groups']
+    groups = _scan_entry_points(backend)
+    cache.save(name, {'fingerprint': fingerprint, 'groups': groups})
+    return groups
+
+
+class PluginRegistry(object):
+    """The entry points of every group, scanned in one pass over the installed
+    distributions and indexed by group, (group, name) and project.  It scans again
+    when `sys.path` or the mtime of one of its directories changes, i.e. when
+    distributions are installed, upgraded or removed, or on `refresh(force=True)`,
+    and the plugins loaded from unchanged entry points are kept.
+
+    :param backend: discovery backend, 'importlib' or 'pkg_resources'
+    :param use_index: load the scan from the on-disk entry point index
+    """
+
+    def __init__(self, backend=None, use_index=False):
+        self.backend = _check_backend(backend)
+        self.use_index = use_index
+        self._signature = None
+        self._lock = threading.Lock()
+        # group -> [(project, entry point)], in distribution order
+        self._groups = {}
+        # (group, name) -> [(project, entry point)]
+        self._names = {}
+        # project -> {group: [entry point]}
+        self._projects = {}
+
+    def refresh(self, force=False):
+        """Scan the distributions if `sys.path`, or its directories, changed since the
+        last scan, or if `force`.  Returns whether it scanned."""
+        # fingerprinting the distributions on every lookup would cost a stat per
+        # distribution, so only the `sys.path` directories are stat'ed
+        signature = launcher.paths_signature()
+        with self._lock:
+            if signature == self._signature and not force:
+                return False
+            with startup.phase('scan entry points'):
+                if self.use_index:
+                    scan = _get_index(self.backend)
+                else:
+                    scan = _scan_entry_points(self.backend)
+            # keep the entry points, and so their loaded plugins, that didn't change
+            previous = dict(((group, project, ep.name, ep.value), ep)
+                            for group, pairs in six.iteritems(self._groups) for project, ep in pairs)
+            groups, names, projects = {}, {}, {}
+            for group, entries in six.iteritems(scan):
+                for project, name, value in entries:
+                    ep = previous.get((group, project, name, value)) or IndexedEntryPoint(name, value, project)
+                    groups.setdefault(group, []).append((project, ep))
+                    names.setdefault((group, name), []).append((project, ep))
+                    projects.setdefault(project, {}).setdefault(group, []).append(ep)
+            self._groups, self._names, self._projects = groups, names, projects
+            self._signature = signature
+            return True
+
+    def groups(self):
+        """Return the sorted entry point groups"""
+        self.refresh()
+        return sorted(self._groups)
+
+    def projects(self):
+        """Return a dict of project -> {group: [entry point]}"""
+        self.refresh()
+        return self._projects
+
+    def iter_entry_points(self, group, name=None, project=None):
+        """Yield (project name, entry point) pairs from `group` matching `name`, and
+        `project`"""
+        self.refresh()
+        pairs = self._groups.get(group, []) if name is None else self._names.get((group, name), [])
+        for project_name, ep in pairs:
+            if not project or project_name == project:
+                yield project_name, ep
+
+    def get_plugin(self, group, name):
+        """Return a single plugin by `group` and `name`"""
+        return _get_plugins(group, name, registry=self)[name]
 
+    def get_plugins(self, group, project=None, workers=None):
+        """Return a dict of plugins by `group`, and optionally filtered by `project`"""
+        return _get_plugins(group, project=project, workers=workers, registry=self)
 
-def _get_plugins(group, name=None, project=None):
+    def get_plugin_projects(self, group, project=None):
+        """Return a dict of the project names that provide each plugin of `group`"""
+        return get_plugin_projects(group, project=project, registry=self)
+
+
+_REGISTRIES = {}
+
+
+def get_registry(backend=None, use_index=False):
+    """Return the shared registry of `backend`, used by the module functions
+
+    :param backend: discovery backend, 'importlib' or 'pkg_resources'
+    :param use_index: load the scans from the on-disk entry point index
+    """
+    key = (_check_backend(backend), use_index)
+    registry = _REGISTRIES.get(key)
+    if registry is None:
+        registry = _REGISTRIES.setdefault(key, PluginRegistry(*key))
+    return registry
+
+
+def invalidate():
+    """Drop the shared registries, and their loaded plugins"""
+    _REGISTRIES.clear()
+
+
+def _iter_project_entry_points(group, name=None, project=None, use_index=False, backend=None, registry=None):
+    """Yield (project name, entry point) pairs from `group` matching `name`, and `project`
+
+    :param backend: discovery backend, 'importlib' or 'pkg_resources'.  Defaults to
+                    `DEFAULT_BACKEND`.  `pkg_resources` is only imported for the latter.
+    :param registry: registry to use instead of the shared one
+    """
+    if registry is None:
+        registry = get_registry(backend, use_index)
+    return registry.iter_entry_points(group, name=name, project=project)
+
+
+def _iter_entry_points(group, name=None, project=None, use_index=False, backend=None, registry=None):
+    """Yield entry point objects from `group` matching `name`, and `project`"""
+    for _, ep in _iter_project_entry_points(group, name=name, project=project,
+                                            use_index=use_index, backend=backend, registry=registry):
+        yield ep
+
+
+def _load_entry_point(entry_point):
+    """Return (plugin, None), or (None, exc_info) if the load fails"""
+    try:
+        with metrics.timer('plugin.load'):
+            return entry_point.load(), None
+    except Exception:
+        return None, sys.exc_info()
+
+
+def _iter_loaded(group, entry_points, workers=None):
+    """Yield the plugins of `entry_points` in order.  Load errors are raised in order
+    too, even when the entry points are loaded by a pool of `workers` threads."""
+    if not workers or len(entry_points) < 2:
+        for entry_point in entry_points:
+            with startup.phase('load %s:%s' % (group, entry_point.name)), metrics.timer('plugin.load'):
+                yield entry_point.load()
+        return
+    # the pool import costs more than a few sequential loads, only pay it with workers
+    from multiprocessing.pool import ThreadPool
+    with startup.phase('load %s (%d workers)' % (group, workers)):
+        pool = ThreadPool(min(workers, len(entry_points)))
+        try:
+            results = pool.map(_load_entry_point, entry_points)
+        finally:
+            pool.close()
+            pool.join()
+    for plugin, exc_info in results:
+        if exc_info:
+            six.reraise(*exc_info)
+        yield plugin
+
+
+def _get_plugins(group, name=None, project=None, use_index=False, backend=None, workers=None, registry=None):
     """Return a dict of plugins by name from a certain `group`, filtered by `name`
     and/or `project` if given.
 
     :param group: plugin group
     :param name: plugin name
     :param project: project name
+    :param use_index: use the on-disk entry point index, instead of scanning the working set
+    :param backend: discovery backend, 'importlib' or 'pkg_resources'
+    :param workers: load the entry points concurrently with this many threads
+    :param registry: registry to use instead of the shared one
 
     """
     plugins = {}
-    for entry_point in _iter_entry_points(group, name=name, project=project):
-        plugin = entry_point.load()
+    with startup.phase('discover %s' % group):
+        entry_points = list(_iter_entry_points(group, name=name, project=project, use_index=use_index,
+                                               backend=backend, registry=registry))
+    for entry_point, plugin in zip(entry_points, _iter_loaded(group, entry_points, workers=workers)):
         if hasattr(plugin, 'name') and entry_point.name != plugin.name:
             raise PluginNameMismatchError(
                 "name '%s' does not match plugin name '%s'" % (entry_point.name, plugin.name))
@@ -46,19 +321,76 @@ def _get_plugins(group, name=None, project=None):
     return plugins
 
 
-def get_plugin(group, name):
+def get_plugin(group, name, use_index=False, backend=None):
     """Return a single plugin by `group` and `name`
 
     :param group: plugin group
     :param name: plugin name
+    :param use_index: use the on-disk entry point index
+    :param backend: discovery backend, 'importlib' or 'pkg_resources'
     """
-    return _get_plugins(group, name)[name]
+    return _get_plugins(group, name, use_index=use_index, backend=backend)[name]
 
 
-def get_plugins(group, project=None):
+def get_plugins(group, project=None, use_index=False, backend=None, workers=None):
     """Return a dict of plugins by `group`, and optionally filtered by `project`
 
     :param group: plugin group
     :param project: project name
+    :param use_index: use the on-disk entry point index
+    :param backend: discovery backend, 'importlib' or 'pkg_resources'
+    :param workers: load the entry points concurrently with this many threads, for
+                    plugins that are slow to import, e.g. from network filesystems
+    """
+    return _get_plugins(group, project=project, use_index=use_index, backend=backend, workers=workers)
+
+
+def get_plugin_names(group, project=None, use_index=False, backend=None):
+    """Return the sorted plugin names of `group` from the entry point metadata,
+    without loading any plugins
+
+    :param group: plugin group
+    :param project: project name
+    :param use_index: use the on-disk entry point index
+    :param backend: discovery backend, 'importlib' or 'pkg_resources'
+    :raise NoPluginsFoundError: if the group has no plugins
+    """
+    names = get_plugin_projects(group, project=project, use_index=use_index, backend=backend)
+    if not names:
+        raise NoPluginsFoundError("no '%s' plugins found" % group)
+    return sorted(names)
+
+
+def get_plugin_projects(group, project=None, use_index=False, backend=None, registry=None):
+    """Return a dict of the project names that provide each plugin of `group`, from
+    the entry point metadata, without loading any plugins
+
+    :param group: plugin group
+    :param project: project name
+    :param use_index: use the on-disk entry point index
+    :param backend: discovery backend, 'importlib' or 'pkg_resources'
+    :param registry: registry to use instead of the shared one
+    """
+    projects = {}
+    for project_name, ep in _iter_project_entry_points(group, project=project, use_index=use_index,
+                                                       backend=backend, registry=registry):
+        projects.setdefault(ep.name, project_name)
+    return projects
+
+
+def get_project_version(project, backend=None):
+    """Return the installed version of `project`, or None if it's not installed
+
+    :param project: project name
+    :param backend: discovery backend, 'importlib' or 'pkg_resources'
     """
-    return _get_plugins(group, project=project)
+    if _check_backend(backend) == 'importlib':
+        try:
+            return importlib_metadata.version(project)
+        except importlib_metadata.PackageNotFoundError:
+            return None
+    import pkg_resources
+    try:
+        return pkg_resources.get_distribution(project).version
+    except pkg_resources.DistributionNotFound:
+        return None
@@ -0,0 +1,246 @@
+"""Startup profiling for qwcore based clis
+
+A profile records the timings of the startup phases (plugin discovery, plugin loads,
+command construction, config loads), and an import time tree of the modules
+imported while it's active.  It's started by the `--profile-startup` cli flag, or by
+the QWCORE_PROFILE_STARTUP environment variable, which is either '1' to print the
+report to stderr at exit, or a path to write the report to as json.
+"""
+
+import atexit
+import json
+import os
+import sys
+import threading
+import time
+
+ENV_VAR = 'QWCORE_PROFILE_STARTUP'
+FLAG = '--profile-startup'
+
+_active = None
+
+
+class _NullPhase(object):
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        return False
+
+
+_NULL_PHASE = _NullPhase()
+
+
+class _Phase(object):
+
+    def __init__(self, profile, name):
+        self.profile = profile
+        self.name = name
+
+    def __enter__(self):
+        self.depth = len(self.profile._phase_stack)
+        self.profile._phase_stack.append(self.name)
+        self.start = time.time()
+        return self
+
+    def __exit__(self, *exc_info):
+        duration = time.time() - self.start
+        self.profile._phase_stack.pop()
+        self.profile.phases.append({'name': self.name, 'depth': self.depth, 'start': self.start,
+                                    'seconds': duration})
+        return False
+
+
+class _TimedLoader(object):
+    """A proxy of a module's loader that times its `exec_module`.  The real loader is
+    put back in the module's attributes before the module runs, so the proxy doesn't
+    outlive the import, and loaders shared by several modules are never modified."""
+
+    def __init__(self, loader, fullname, timer):
+        self.loader = loader
+        self.fullname = fullname
+        self.timer = timer
+
+    def __getattr__(self, name):
+        return getattr(self.loader, name)
+
+    def exec_module(self, module):
+        spec = getattr(module, '__spec__', None)
+        if spec is not None and spec.loader is self:
+            spec.loader = self.loader
+        if getattr(module, '__loader__', None) is self:
+            module.__loader__ = self.loader
+        return self.timer.exec_module(self.fullname, self.loader, module)
+
+
+class _ImportTimer(object):
+    """A meta path finder that times the execution of the modules found by the
+    other finders, through a proxy of their loaders"""
+
+    def __init__(self, profile):
+        self.profile = profile
+        self._local = threading.local()
+
+    def find_spec(self, fullname, path=None, target=None):
+        for finder in sys.meta_path:
+            if finder is self or not hasattr(finder, 'find_spec'):
+                continue
+            spec = finder.find_spec(fullname, path, target)
+            if spec is not None:
+                break
+        else:
+            return None
+        loader = spec.loader
+        # builtin and frozen importers are classes, that the import system checks by identity
+        if loader is None or isinstance(loader, type) or not hasattr(loader, 'exec_module'):
+            return spec
+        spec.loader = _TimedLoader(loader, fullname, self)
+        return spec
+
+    def exec_module(self, fullname, loader, module):
+        stack = self._local.__dict__.setdefault('stack', [])
+        node = {'name': fullname, 'depth': len(stack), 'children_seconds': 0.0}
+        stack.append(node)
+        start = time.time()
+        try:
+            return loader.exec_module(module)
+        finally:
+            cumulative = time.time() - start
+            stack.pop()
+            if stack:
+                stack[-1]['children_seconds'] += cumulative
+            node['seconds'] = cumulative
+            node['self_seconds'] = cumulative - node.pop('children_seconds')
+            node['start'] = start
+            self.profile.imports.append(node)
+
+
+class StartupProfile(object):
+    """Phase timings and an import time tree"""
+
+    def __init__(self):
+        self.start = time.time()
+        self.phases = []
+        self.imports = []
+        self._phase_stack = []
+        self._import_timer = _ImportTimer(self)
+
+    def phase(self, name):
+        """Return a context manager that times the phase `name`"""
+        return _Phase(self, name)
+
+    def install(self):
+        if self._import_timer not in sys.meta_path:
+            sys.meta_path.insert(0, self._import_timer)
+
+    def uninstall(self):
+        if self._import_timer in sys.meta_path:
+            sys.meta_path.remove(self._import_timer)
+
+    @property
+    def total_seconds(self):
+        return time.time() - self.start
+
+    def as_dict(self):
+        return {
+            'total_seconds': self.total_seconds,
+            'phases': sorted(self.phases, key=lambda p: p['start']),
+            'imports': sorted(self.imports, key=lambda i: i['start']),
+        }
+
+    def format_report(self, min_ms=1.0):
+        """Return the report lines.  Imports under `min_ms` are left out."""
+        return format_report(self.as_dict(), min_ms=min_ms)
+
+
+def format_report(data, min_ms=1.0):
+    """Return the report lines of a profile `as_dict` data
+
+    :param data: profile data
+    :param min_ms: leave out the imports that took less than this
+    """
+    lines = ['startup profile: %.1f ms' % (data['total_seconds'] * 1000), '', 'phases (ms):']
+    for phase in data['phases']:
+        lines.append('  %9.1f  %s%s' % (phase['seconds'] * 1000, '  ' * phase['depth'], phase['name']))
+    lines.extend(['', 'imports (cumulative ms, self ms):'])
+    for node in data['imports']:
+        if node['seconds'] * 1000 < min_ms:
+            continue
+        lines.append('  %9.1f  %9.1f  %s%s' % (node['seconds'] * 1000, node['self_seconds'] * 1000,
+                                               '  ' * node['depth'], node['name']))
+    return lines
+
+
+def parse_importtime(output):
+    """Return import nodes, like the `imports` of a profile, parsed from the stderr of
+    a python run with `-X importtime` (or PYTHONPROFILEIMPORTTIME=1)
+
+    :param output: stderr text
+    """
+    nodes = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'imported package' in line:
+            continue
+        self_us, cumulative_us, name = line[len('import time:'):].split('|', 2)
+        depth = (len(name) - len(name.lstrip()) - 1) // 2
+        nodes.append({'name': name.strip(), 'depth': depth,
+                      'self_seconds': int(self_us) / 1e6, 'seconds': int(cumulative_us) / 1e6})
+    return nodes
+
+
+def start(output=None):
+    """Start the process startup profile, if it's not started, and report it at exit
+
+    :param output: '1' or None to print the report to stderr, or a json file path
+    """
+    global _active
+    if _active is not None:
+        return _active
+    _active = StartupProfile()
+    _active.install()
+    atexit.register(_report, output)
+    return _active
+
+
+def start_from_environ(argv=None, environ=None):
+    """Start the profile if the `--profile-startup` flag is in `argv` (defaults to
+    `sys.argv`), or the QWCORE_PROFILE_STARTUP environment variable is set"""
+    argv = sys.argv[1:] if argv is None else argv
+    output = (os.environ if environ is None else environ).get(ENV_VAR)
+    if output or FLAG in argv:
+        return start(output)
+    return None
+
+
+def stop():
+    """Stop the active profile, and return it"""
+    global _active
+    profile, _active = _active, None
+    if profile is not None:
+        profile.uninstall()
+    return profile
+
+
+def active():
+    """Return the active profile, or None"""
+    return _active
+
+
+def phase(name):
+    """Return a context manager that times the phase `name` in the active profile,
+    that does nothing if profiling is off"""
+    if _active is None:
+        return _NULL_PHASE
+    return _active.phase(name)
+
+
+def _report(output):
+    profile = stop()
+    if profile is None:
+        return
+    if output and output != '1':
+        with open(output, 'w') as fh:
+            json.dump(profile.as_dict(), fh)
+    else:
+        sys.stderr.write('\n'.join(profile.format_report()) + '\n')
@@ -1,13 +1,22 @@
 """invoke tasks"""
 
+import hashlib
+import importlib
+import json
 import logging
+import multiprocessing
 import os
 import shutil
+import subprocess
+import tempfile
+import time
+from multiprocessing.pool import ThreadPool
 
+import click
 from invoke import run as irun
 from invoke import task
 
-from qwcore import echo
+from qwcore import cache, echo, startup
 
 PROJECT_ROOT = os.getcwd()
 PROJECT = os.path.basename(PROJECT_ROOT)
@@ -21,11 +30,17 @@ if os.path.exists("overview.rst"):
 else:
     OVERVIEW = PACKAGE.__about__.DESCRIPTION_RST
 
+BENCHMARK_BASELINE = os.path.join(PROJECT_ROOT, 'benchmark_baseline.json')
+BENCHMARK_OUTPUT = os.path.join(PROJECT_ROOT, 'bench_output.json')
+SETUP_FILES = ['setup.py', 'setup.cfg', 'pyproject.toml', os.path.join(PROJECT, '__about__.py')]
+# input hashes of the incremental tasks, kept per project in the qwcore cache dir
+STATE_CACHE_NAME = 'tasks-%s.json' % hashlib.sha1(PROJECT_ROOT.encode('utf-8')).hexdigest()[:12]
+
 logger = logging.getLogger(PROJECT)
 
 
-__all__ = ['docs', 'install_editable', 'merge_master', 'rst_all', 'rst_api', 'rst_cli',
-           'rst_docs_index', 'rst_readme', 'test']
+__all__ = ['benchmark', 'docs', 'install_editable', 'merge_master', 'profile_startup', 'rst_all', 'rst_api',
+           'rst_cli', 'rst_docs_index', 'rst_readme', 'test']
 
 
 def run(*args, **kwargs):
@@ -44,26 +59,157 @@ def has_docs():
     return True
 
 
+def hash_files(paths):
+    """Return a hash of the names and contents of the existing `paths`"""
+    digest = hashlib.sha1()
+    for path in sorted(paths):
+        if not os.path.isfile(path):
+            continue
+        digest.update(path.encode('utf-8'))
+        with open(path, 'rb') as fh:
+            digest.update(fh.read())
+    return digest.hexdigest()
+
+
+def package_sources():
+    """Return the paths of the package's python sources"""
+    sources = []
+    for root, dirs, files in os.walk(PACKAGE_PATH):
+        sources.extend(os.path.join(root, f) for f in files if f.endswith('.py'))
+    return sources
+
+
+def inputs_unchanged(name, digest):
+    """Return True if the inputs of task `name` hash to the `digest` recorded by
+    `record_inputs` after its last run"""
+    state = cache.load(STATE_CACHE_NAME) or {}
+    return state.get(name) == digest
+
+
+def record_inputs(name, digest):
+    state = cache.load(STATE_CACHE_NAME) or {}
+    state[name] = digest
+    cache.save(STATE_CACHE_NAME, state)
+
+
+def write_if_changed(path, content):
+    """Write `content` to `path` only if it differs from the current content, so the
+    mtime (and sphinx's incremental build) is left alone otherwise.  Return True if
+    the file was written."""
+    if os.path.isfile(path):
+        with open(path) as fh:
+            if fh.read() == content:
+                return False
+    with open(path, 'w') as fh:
+        fh.write(content)
+    return True
+
+
+def sync_dir(src, dest):
+    """Make `dest` match the files in `src`, only writing the changed files"""
+    if not os.path.isdir(dest):
+        os.makedirs(dest)
+    names = set(os.listdir(src))
+    for name in os.listdir(dest):
+        if name not in names and os.path.isfile(os.path.join(dest, name)):
+            os.remove(os.path.join(dest, name))
+    for name in names:
+        with open(os.path.join(src, name)) as fh:
+            write_if_changed(os.path.join(dest, name), fh.read())
+
+
 @task
-def install_editable(c):
+def install_editable(c, incremental=False):
+    """pip install the project in editable mode.  With --incremental, skip it if the
+    setup metadata didn't change since the last install."""
+    digest = hash_files(os.path.join(PROJECT_ROOT, f) for f in SETUP_FILES)
+    if incremental and inputs_unchanged('install_editable', digest):
+        logger.info("Setup metadata unchanged, skipping the editable install")
+        return
     cmd = 'pip install -e .'
     logger.info(cmd)
     run(cmd)
+    record_inputs('install_editable', digest)
 
 
 @task
-def rst_api(c):
+def rst_api(c, incremental=False):
+    """Build the api rst with sphinx-apidoc, only writing the changed files.  With
+    --incremental, skip it if the package sources didn't change."""
     if not has_docs():
         return
-    if os.path.isdir(MODULES_PATH):
-        shutil.rmtree(MODULES_PATH)
-    api_cmd = 'sphinx-apidoc {pkg_path} {pkg_path}/tests {pkg_path}/tasks.py -o docs/modules -e -T -f'
-    run(api_cmd.format(pkg_path=PACKAGE_PATH))
+    digest = hash_files(package_sources())
+    if incremental and os.path.isdir(MODULES_PATH) and inputs_unchanged('rst_api', digest):
+        logger.info("Package sources unchanged, skipping the api docs")
+        return
+    out_path = tempfile.mkdtemp()
+    try:
+        api_cmd = 'sphinx-apidoc {pkg_path} {pkg_path}/tests {pkg_path}/tasks.py -o {out_path} -e -T -f'
+        run(api_cmd.format(pkg_path=PACKAGE_PATH, out_path=out_path))
+        sync_dir(out_path, MODULES_PATH)
+    finally:
+        shutil.rmtree(out_path)
+    record_inputs('rst_api', digest)
+
+
+def _load_click_command(spec):
+    """Return the click command of a console script `spec` ('module:attr'), or None if
+    it can't be imported, or isn't a click command"""
+    module_name, _, attrs = spec.split('[')[0].strip().partition(':')
+    try:
+        command = importlib.import_module(module_name.strip())
+        for attr in attrs.strip().split('.'):
+            command = getattr(command, attr)
+    except (ImportError, AttributeError) as e:
+        logger.info("Can't import console script %s: %s" % (spec, e))
+        return None
+    return command if isinstance(command, click.Command) else None
+
+
+def _help_in_process(command, script, cmd_names):
+    """Return the help of `script` and its subcommands, rendered from the click command
+    tree, or None if a subcommand isn't found in it"""
+    helps = []
+    with click.Context(command, info_name=script, terminal_width=80) as ctx:
+        helps.append(command.get_help(ctx))
+        for cmd_name in cmd_names:
+            subcommand = command.get_command(ctx, cmd_name)
+            if subcommand is None:
+                logger.info("Subcommand %s not found in the %s click command" % (cmd_name, script))
+                return None
+            with click.Context(subcommand, info_name=cmd_name, parent=ctx) as sub_ctx:
+                helps.append(subcommand.get_help(sub_ctx))
+    return helps
+
+
+def _help_output(cmd):
+    proc = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, universal_newlines=True)
+    out = proc.communicate()[0]
+    if proc.returncode != 0:
+        echo.error("Command Failed: %s" % cmd)
+        raise SystemExit(1)
+    return out
+
+
+def _help_subprocesses(script, cmd_names, jobs):
+    """Return the help of `script` and its subcommands, from concurrent `--help` runs"""
+    cmds = ['%s --help' % script] + ['%s %s --help' % (script, cmd_name) for cmd_name in cmd_names]
+    pool = ThreadPool(jobs or multiprocessing.cpu_count())
+    try:
+        return pool.map(_help_output, cmds)
+    finally:
+        pool.close()
+        pool.join()
 
 
 @task(pre=[install_editable])
-def rst_cli(c):
-    """Build rst for cli docs based on console script entry points"""
+def rst_cli(c, subprocesses=False, jobs=0):
+    """Build rst for cli docs based on console script entry points
+
+    Help is rendered in-process from the click command of each script.  Scripts that
+    can't be imported or are missing a subcommand (or with --subprocesses) run their `--help` commands in
+    parallel, with up to --jobs processes (defaults to the cpu count).
+    """
     if not has_docs():
         return
     if not hasattr(PACKAGE, 'cli'):
@@ -75,25 +221,23 @@ def rst_cli(c):
     rst.extend(['.. contents:: Contents', '   :local:', ''])
 
     for ep in PACKAGE.__about__.ENTRY_POINTS['console_scripts']:
-        script, _ = ep.split('=')
+        script, spec = [part.strip() for part in ep.split('=')]
         script_ep_name = '%s.commands' % script.replace('-', '.')
         cmd_eps = PACKAGE.__about__.ENTRY_POINTS[script_ep_name]
         if not cmd_eps:
             continue
-        rst.extend([script, '-'*50, ''])
-        r = run('%s --help' % script)
-        out = ['  ' + l for l in r.stdout.splitlines()]
-        rst.extend(['::', ''] + out + [''])
-        for ep in cmd_eps:
-            cmd, _ = ep.split('=')
-            full_cmd = "%s %s" % (script, cmd)
-            rst.extend([full_cmd, '-'*50, ''])
-            r = run('%s --help' % full_cmd)
-            out = ['  ' + l for l in r.stdout.splitlines()]
+        cmd_names = [cmd_ep.split('=')[0].strip() for cmd_ep in cmd_eps]
+        command = None if subprocesses else _load_click_command(spec)
+        helps = None if command is None else _help_in_process(command, script, cmd_names)
+        if helps is None:
+            helps = _help_subprocesses(script, cmd_names, jobs)
+        titles = [script] + ["%s %s" % (script, cmd_name) for cmd_name in cmd_names]
+        for title, help_text in zip(titles, helps):
+            rst.extend([title, '-'*50, ''])
+            out = ['  ' + line for line in help_text.splitlines()]
             rst.extend(['::', ''] + out + [''])
 
-    with open(os.path.join(DOCS_PATH, 'cli.rst'), 'w') as fh:
-        fh.write("\n".join(rst))
+    write_if_changed(os.path.join(DOCS_PATH, 'cli.rst'), "\n".join(rst))
 
 
 def readme(is_docs=False):
@@ -123,14 +267,12 @@ def rst_docs_index(c):
     rst = readme(is_docs=True)
     rst.extend(['Contents', '-'*8, ''])
     rst.extend(['.. toctree::', '  :maxdepth: 2', '', '  guide', '  reference'])
-    with open(os.path.join(DOCS_PATH, 'index.rst'), 'w') as fh:
-        fh.write("\n".join(rst))
+    write_if_changed(os.path.join(DOCS_PATH, 'index.rst'), "\n".join(rst))
 
 
 @task
 def rst_readme(c):
-    with open(os.path.join(PROJECT_ROOT, 'readme.rst'), 'w') as fh:
-        fh.write("\n".join(readme()))
+    write_if_changed(os.path.join(PROJECT_ROOT, 'readme.rst'), "\n".join(readme()))
 
 
 @task
@@ -143,22 +285,98 @@ def merge_master(c):
 
 
 @task
-def rst_all(c):
-    rst_api(c)
+def rst_all(c, incremental=False):
+    rst_api(c, incremental=incremental)
     rst_cli(c)
     rst_docs_index(c)
     rst_readme(c)
 
 
-@task(pre=[install_editable, rst_all])
-def docs(c):
+@task
+def docs(c, incremental=False):
+    """Build the html docs.  With --incremental, the editable install and api docs
+    are skipped when their inputs didn't change, and unchanged rst files are not
+    rewritten, so sphinx only rebuilds what changed."""
+    install_editable(c, incremental=incremental)
+    rst_all(c, incremental=incremental)
     if not has_docs():
         return
     run('sphinx-build -W -b html -d docs/_build/doctree docs docs/_build/html')
 
 
+def _profile_script(script, args):
+    """Run `script args` with startup profiling, and return the wall time in ms, and the
+    profile data (phases from qwcore, and the imports from python's importtime)"""
+    fd, path = tempfile.mkstemp(suffix='.json')
+    os.close(fd)
+    try:
+        env = dict(os.environ, PYTHONPROFILEIMPORTTIME='1')
+        env[startup.ENV_VAR] = path
+        start = time.time()
+        proc = subprocess.Popen('%s %s' % (script, args), shell=True, env=env, stdout=subprocess.PIPE,
+                                stderr=subprocess.PIPE, universal_newlines=True)
+        stderr = proc.communicate()[1]
+        elapsed_ms = (time.time() - start) * 1000
+        with open(path) as fh:
+            content = fh.read()
+    finally:
+        os.remove(path)
+    data = json.loads(content) if content else {'total_seconds': elapsed_ms / 1000, 'phases': []}
+    data['imports'] = startup.parse_importtime(stderr)
+    return elapsed_ms, data
+
+
+@task
+def profile_startup(c, script=None, args='--help', budget=0, min_ms=1.0):
+    """Report the startup phases and import times of the console scripts (or just
+    --script), running them with --args.  Fails if a script takes longer than --budget
+    ms, which defaults to STARTUP_BUDGET in the project's __about__, if set."""
+    budget = budget or getattr(PACKAGE.__about__, 'STARTUP_BUDGET', 0)
+    if script:
+        scripts = [script]
+    else:
+        scripts = [ep.split('=')[0].strip() for ep in PACKAGE.__about__.ENTRY_POINTS.get('console_scripts', [])]
+    over_budget = []
+    for script in scripts:
+        elapsed_ms, data = _profile_script(script, args)
+        echo.info('\n'.join(startup.format_report(data, min_ms=min_ms)))
+        msg = '%s %s: %.1f ms' % (script, args, elapsed_ms)
+        if budget and elapsed_ms > budget:
+            echo.error('%s, over the %s ms budget' % (msg, budget))
+            over_budget.append(script)
+        else:
+            echo.success(msg)
+    if over_budget:
+        raise SystemExit(1)
+
+
+@task
+def benchmark(c, save_baseline=False, tolerance=0.25):
+    """Run tests/benchmark.py and fail if a result is slower than benchmark_baseline.json
+    by more than --tolerance.  With --save-baseline, store the results as the baseline."""
+    if not os.path.exists(os.path.join(PROJECT_ROOT, 'tests', 'benchmark.py')):
+        echo.warning("No benchmarks found")
+        return
+    output = BENCHMARK_BASELINE if save_baseline else BENCHMARK_OUTPUT
+    cmd = 'python -m tests.benchmark --output %s --tolerance %s' % (output, tolerance)
+    if not save_baseline:
+        if os.path.exists(BENCHMARK_BASELINE):
+            cmd += ' --baseline %s' % BENCHMARK_BASELINE
+        else:
+            echo.warning("No benchmark baseline, run with --save-baseline to store one")
+    logger.info(cmd)
+    run(cmd)
+
+
 @task(default=True)
-def test(c):
+def test(c, startup_budget=0, benchmarks=False):
+    """Run the tests.  With a --startup-budget (or STARTUP_BUDGET in the project's
+    __about__), check the console scripts start within it, and with --benchmarks,
+    compare the benchmarks with the stored baseline."""
     cmd = 'tox -e py27,flake8,py3flake8'
     logger.info(cmd)
     run(cmd)
+    if startup_budget or getattr(PACKAGE.__about__, 'STARTUP_BUDGET', 0):
+        profile_startup(c, budget=startup_budget)
+    if benchmarks:
+        benchmark(c)
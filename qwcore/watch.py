@@ -0,0 +1,134 @@
+"""Directory change watching, with inotify on linux, or by polling"""
+
+import ctypes
+import ctypes.util
+import errno
+import logging
+import os
+import select
+import struct
+import sys
+import time
+
+LOG = logging.getLogger(__name__)
+
+IN_ATTRIB = 0x00000004
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+IN_CLOEXEC = 0o2000000
+IN_NONBLOCK = 0o4000
+
+# IN_MODIFY is left out, to not wake up on partial writes
+WATCH_MASK = IN_ATTRIB | IN_CLOSE_WRITE | IN_MOVED_FROM | IN_MOVED_TO | IN_CREATE | IN_DELETE | IN_DELETE_SELF
+
+# struct inotify_event, followed by `len` bytes of name
+_EVENT = struct.Struct('iIII')
+
+
+def _load_libc():
+    """Return libc with the inotify functions, or None if they're not available"""
+    if not sys.platform.startswith('linux'):
+        return None
+    try:
+        libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+        libc.inotify_init1
+        libc.inotify_add_watch
+    except (OSError, AttributeError):
+        return None
+    return libc
+
+
+def _inotify_init():
+    """Return (libc, inotify fd), or (None, None) if inotify can't be used"""
+    libc = _load_libc()
+    if libc is None:
+        return None, None
+    fd = libc.inotify_init1(IN_CLOEXEC | IN_NONBLOCK)
+    if fd < 0:
+        return None, None
+    return libc, fd
+
+
+def _iter_events(data):
+    """Yield the (wd, mask) of the inotify events in `data`"""
+    offset = 0
+    while offset + _EVENT.size <= len(data):
+        wd, mask, _, length = _EVENT.unpack_from(data, offset)
+        offset += _EVENT.size + length
+        yield wd, mask
+
+
+class DirectoryWatcher(object):
+    """Wait for changes in a directory.  Uses inotify when available, and otherwise
+    falls back to polling, where every wait reports a possible change.  If the
+    directory is removed, it's polled for until it's recreated, and then watched
+    again.
+
+    :param path: directory to watch
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._libc, self._fd = _inotify_init()
+        self._wd = None
+        if self._fd is not None and not self._watch():
+            os.close(self._fd)
+            self._fd = None
+
+    @property
+    def uses_inotify(self):
+        return self._fd is not None
+
+    def _watch(self):
+        """Add the inotify watch of the directory, and return whether it worked"""
+        wd = self._libc.inotify_add_watch(self._fd, self.path.encode(sys.getfilesystemencoding()), WATCH_MASK)
+        if wd < 0:
+            LOG.debug("inotify watch failed for %s: %s" % (self.path, os.strerror(ctypes.get_errno())))
+            return False
+        self._wd = wd
+        return True
+
+    def _read_events(self):
+        chunks = []
+        while True:
+            try:
+                chunk = os.read(self._fd, 65536)
+            except OSError as e:
+                if e.errno in (errno.EAGAIN, errno.EWOULDBLOCK):
+                    break
+                raise
+            if not chunk:
+                break
+            chunks.append(chunk)
+        return b''.join(chunks)
+
+    def wait(self, timeout):
+        """Wait up to `timeout` seconds, and return True if the directory may have changed
+
+        :param timeout: seconds to wait
+        """
+        if self._fd is None:
+            time.sleep(timeout)
+            return True
+        if self._wd is None:
+            # the directory was removed, poll until it can be watched again
+            if not self._watch():
+                time.sleep(timeout)
+            return True
+        if not select.select([self._fd], [], [], timeout)[0]:
+            return False
+        # the events are only used as a wake up, except for the loss of the watch
+        for wd, mask in _iter_events(self._read_events()):
+            if wd == self._wd and mask & (IN_DELETE_SELF | IN_IGNORED):
+                self._wd = None
+        return True
+
+    def close(self):
+        if self._fd is not None:
+            os.close(self._fd)
+            self._fd = None
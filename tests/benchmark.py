@@ -0,0 +1,228 @@
+"""Benchmarks for plugin discovery, cli construction and config lookup
+
+Builds a synthetic set of distributions (dist-info dirs with entry points, and a
+plugin module) and config files in a temp dir, so nothing is installed and no
+network is used.  Discovery is restricted to the synthetic distributions, by
+replacing `sys.path` with the temp dir and the `sys.path` dirs without
+distributions (the standard library), and by patching the `pkg_resources` working
+set, like the plugin tests.
+
+Run with::
+
+    python -m tests.benchmark --output bench.json --baseline baseline.json
+
+It exits with 1 if a result is slower than the baseline by more than --tolerance.
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import sys
+import tempfile
+import time
+
+import click
+import pkg_resources
+
+from qwcore import cache, cli, config, plugin
+
+GROUP = 'qwcore.bench.commands'
+PLUGIN_MODULE = 'qwcore_bench_plugins'
+
+
+class Patches(object):
+    """Attributes set for the benchmarks, restored by `undo`"""
+
+    def __init__(self):
+        self._saved = []
+
+    def setattr(self, obj, name, value):
+        self._saved.append((obj, name, getattr(obj, name)))
+        setattr(obj, name, value)
+
+    def undo(self):
+        while self._saved:
+            obj, name, value = self._saved.pop()
+            setattr(obj, name, value)
+
+
+def stdlib_paths():
+    """Return the `sys.path` dirs without distribution metadata"""
+    paths = []
+    for path in sys.path:
+        try:
+            names = os.listdir(path or os.curdir)
+        except OSError:
+            names = []
+        if path and not any(name.endswith(cache.DIST_METADATA_SUFFIXES) for name in names):
+            paths.append(path)
+    return paths
+
+
+def make_working_set(root, dists, entry_points):
+    """Write `dists` dist-info dirs to `root`, with `entry_points` command plugins each,
+    all provided by one plugin module"""
+    classes = []
+    for i in range(dists):
+        dist_info = os.path.join(root, 'bench_dist_%d-1.0.dist-info' % i)
+        os.makedirs(dist_info)
+        with open(os.path.join(dist_info, 'METADATA'), 'w') as fh:
+            fh.write('Metadata-Version: 2.1\nName: bench-dist-%d\nVersion: 1.0\n' % i)
+        lines = ['[%s]' % GROUP]
+        for j in range(entry_points):
+            name = 'cmd_%d_%d' % (i, j)
+            lines.append('%s = %s:%s' % (name, PLUGIN_MODULE, name.title()))
+            classes.append(name)
+        with open(os.path.join(dist_info, 'entry_points.txt'), 'w') as fh:
+            fh.write('\n'.join(lines) + '\n')
+    source = ['import click', '']
+    for name in classes:
+        source.extend([
+            'class %s(object):' % name.title(),
+            '    """%s doc"""' % name,
+            '    name = %r' % name,
+            '    help = %r' % ('%s help' % name),
+            "    params = [click.Option(['--flag'], is_flag=True, help='Flag')]",
+            '    def run(self, flag):',
+            '        pass',
+            '',
+        ])
+    with open(os.path.join(root, PLUGIN_MODULE + '.py'), 'w') as fh:
+        fh.write('\n'.join(source))
+
+
+def make_config(path, sections, keys):
+    """Write a config file with `sections` sections of `keys` keys each"""
+    lines = []
+    for i in range(sections):
+        lines.append('[section%d]' % i)
+        lines.extend('key%d = value%d' % (j, j) for j in range(keys))
+    with open(path, 'w') as fh:
+        fh.write('\n'.join(lines) + '\n')
+
+
+def timed(fn, repeat, setup=None):
+    """Return the best time in seconds of `repeat` calls of `fn`"""
+    best = None
+    for _ in range(repeat):
+        if setup:
+            setup()
+        start = time.time()
+        fn()
+        elapsed = time.time() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+def unload_plugins():
+    sys.modules.pop(PLUGIN_MODULE, None)
+    plugin.invalidate()
+
+
+def run_benchmarks(dists=50, entry_points=4, config_sections=(10, 1000), lookups=10000, repeat=5):
+    """Run the benchmarks, and return a dict of benchmark name -> seconds"""
+    results = {}
+    root = tempfile.mkdtemp(prefix='qwcore-bench-')
+    try:
+        make_working_set(root, dists, entry_points)
+        mp = Patches()
+        try:
+            mp.setattr(sys, 'path', [root] + stdlib_paths())
+            working_set = pkg_resources.WorkingSet([root])
+            mp.setattr(pkg_resources.WorkingSet, '__iter__', lambda self, dists=list(working_set): iter(dists))
+            mp.setattr(cache, 'cache_dir', lambda: os.path.join(root, 'cache'))
+            mp.setattr(cache, 'dists_fingerprint', lambda paths=None: 'bench')
+
+            for backend in plugin.BACKENDS:
+                results['discovery.cold.%s' % backend] = timed(
+                    lambda: plugin.get_plugins(GROUP, backend=backend), repeat, setup=unload_plugins)
+                results['discovery.warm.%s' % backend] = timed(
+                    lambda: plugin.get_plugins(GROUP, backend=backend), repeat)
+            plugin.get_plugins(GROUP, use_index=True)
+            results['discovery.warm.index'] = timed(lambda: plugin.get_plugins(GROUP, use_index=True), repeat)
+
+            results['cli.build'] = timed(lambda: cli.build_command('bench', 'bench', '1.0', GROUP), repeat)
+            results['cli.build.lazy'] = timed(
+                lambda: cli.build_command('bench', 'bench', '1.0', GROUP, lazy=True), repeat)
+
+            def group_help(**kwargs):
+                command = cli.build_command('bench', 'bench', '1.0', GROUP, **kwargs)
+                with click.Context(command, info_name='bench') as ctx:
+                    command.get_help(ctx)
+            results['cli.help'] = timed(group_help, repeat)
+            group_help(use_manifest=True)
+            results['cli.help.manifest'] = timed(lambda: group_help(use_manifest=True), repeat,
+                                                 setup=unload_plugins)
+            results['cli.help.manifest.index'] = timed(lambda: group_help(use_manifest=True, use_index=True),
+                                                       repeat, setup=unload_plugins)
+
+            for sections in config_sections:
+                config_dir = os.path.join(root, 'config%d' % sections)
+                os.makedirs(config_dir)
+                make_config(os.path.join(config_dir, 'config'), sections, 10)
+                mp.setattr(config, '_config_file', lambda appname, d=config_dir: os.path.join(d, 'config'))
+                results['config.parse.%d' % sections] = timed(
+                    lambda: config.get_config('bench', cached=False), repeat)
+                config.invalidate()
+                results['config.get_value.%d.x%d' % (sections, lookups)] = timed(
+                    lambda: [config.get_value('bench', 'key1', section='section0') for _ in range(lookups)],
+                    repeat)
+                results['config.get_value.lazy.%d.x%d' % (sections, lookups)] = timed(
+                    lambda: [config.get_value('bench', 'key1', section='section0', lazy=True)
+                             for _ in range(lookups)], repeat)
+                config.invalidate()
+                snapshot = config.get_snapshot('bench')
+                results['config.snapshot.%d.x%d' % (sections, lookups)] = timed(
+                    lambda: [snapshot.get('section0.key1') for _ in range(lookups)], repeat)
+                config.invalidate()
+        finally:
+            mp.undo()
+    finally:
+        unload_plugins()
+        shutil.rmtree(root)
+    return results
+
+
+def compare(results, baseline, tolerance=0.25):
+    """Return the (name, seconds, baseline seconds) of the results slower than the
+    baseline by more than `tolerance`"""
+    regressions = []
+    for name, seconds in sorted(results.items()):
+        base = baseline.get(name)
+        if base and seconds > base * (1 + tolerance):
+            regressions.append((name, seconds, base))
+    return regressions
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='qwcore benchmarks')
+    parser.add_argument('--dists', type=int, default=50)
+    parser.add_argument('--entry-points', type=int, default=4, help='entry points per distribution')
+    parser.add_argument('--lookups', type=int, default=10000)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help='json file for the results')
+    parser.add_argument('--baseline', help='json results file to compare with')
+    parser.add_argument('--tolerance', type=float, default=0.25)
+    args = parser.parse_args(argv)
+
+    results = run_benchmarks(dists=args.dists, entry_points=args.entry_points, lookups=args.lookups,
+                             repeat=args.repeat)
+    for name, seconds in sorted(results.items()):
+        print('%-40s %10.3f ms' % (name, seconds * 1000))
+    if args.output:
+        with open(args.output, 'w') as fh:
+            json.dump({'python': platform.python_version(), 'dists': args.dists,
+                       'entry_points': args.entry_points, 'results': results}, fh, indent=2, sort_keys=True)
+    if args.baseline and os.path.exists(args.baseline):
+        with open(args.baseline) as fh:
+            regressions = compare(results, json.load(fh)['results'], tolerance=args.tolerance)
+        for name, seconds, base in regressions:
+            print('REGRESSION %s: %.3f ms, baseline %.3f ms' % (name, seconds * 1000, base * 1000))
+        return 1 if regressions else 0
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,4 @@
+import sys
+
+# coroutine functions don't compile on python 2
+collect_ignore = [] if sys.version_info >= (3, 5) else ['test_aio.py']
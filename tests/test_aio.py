@@ -0,0 +1,103 @@
+import asyncio
+import threading
+
+import click
+
+from qwcore import aio, batch
+from qwcore.cli import build_command
+
+
+def test_context_resources():
+    closed = []
+
+    async def close(resource):
+        closed.append(resource)
+
+    context = aio.get_context()
+    assert aio.get_context() is context
+    pool = context.get('pool', list, close=close)
+    assert context.get('pool', dict) is pool
+    assert aio.run(context.run_in_executor(sum, [1, 2])) == 3
+    aio.close()
+    assert context.loop.is_closed()
+    assert closed == [pool]
+    assert aio.get_context() is not context
+    aio.close()
+
+
+def test_forked_child_gets_new_loop(monkeypatch):
+    context = aio.get_context()
+    monkeypatch.setattr(aio._local, 'pid', -1)
+    assert aio.get_context() is not context
+    assert isinstance(aio.get_context().loop, asyncio.AbstractEventLoop)
+    context.loop.close()
+    aio.close()
+
+
+def test_thread_loops():
+    barrier = threading.Barrier(2)
+    loops = []
+
+    async def running_loop():
+        # both loops are running at once
+        await aio.get_context().loop.run_in_executor(None, barrier.wait, 5)
+        return asyncio.get_event_loop()
+
+    def target():
+        loops.append(aio.run(running_loop()))
+
+    threads = [threading.Thread(target=target) for _ in range(2)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(loops) == 2 and loops[0] is not loops[1]
+    aio.close_all()
+    assert all(loop.is_closed() for loop in loops)
+
+
+def test_build_command_async(monkeypatch):
+    closed = []
+
+    class Cmd1:
+        """Cmd1 doc"""
+        name = 'Cmd1'
+        help = 'help'
+        params = []
+        pools = []
+
+        async def run(self):
+            await asyncio.sleep(0)
+            context = click.get_current_context().meta[aio.CONTEXT_KEY]
+            Cmd1.pools.append(context.get('pool', object, close=closed.append))
+            return asyncio.get_event_loop()
+
+    monkeypatch.setattr('qwcore.cli.get_plugins', lambda group, **kwargs: {'Cmd1': Cmd1})
+    cmd = build_command('testname', 'description', '1.0', 'group')
+    loops = [cmd.main(['Cmd1'], standalone_mode=False) for _ in range(2)]
+    assert loops[0] is loops[1]
+    assert Cmd1.pools[0] is Cmd1.pools[1]
+    aio.close()
+    assert loops[0].is_closed()
+    assert closed == [Cmd1.pools[0]]
+
+
+def test_run_batch_async_threads(monkeypatch):
+    barrier = threading.Barrier(2)
+
+    class Cmd1:
+        """Cmd1 doc"""
+        name = 'Cmd1'
+        help = 'help'
+        params = [click.Argument(['word'])]
+
+        async def run(self, word):
+            # both invocations run at once, on their threads' loops
+            await asyncio.get_event_loop().run_in_executor(None, barrier.wait, 5)
+            click.echo(word)
+
+    monkeypatch.setattr('qwcore.cli.get_plugins', lambda group, **kwargs: {'Cmd1': Cmd1})
+    cmd = build_command('testname', 'description', '1.0', 'group')
+    results = list(batch.run_batch(cmd, [['Cmd1', 'a'], ['Cmd1', 'b']], workers=2))
+    assert [(r['exit_code'], r['stdout']) for r in results] == [(0, 'a\n'), (0, 'b\n')], results
+    aio.close_all()
@@ -0,0 +1,93 @@
+import json
+
+import click
+import pytest
+
+from qwcore import batch
+from qwcore.cli import build_command
+
+
+@pytest.fixture
+def command(monkeypatch):
+
+    class Echo:
+        """Echo doc"""
+        name = 'echo'
+        help = 'help'
+        params = [click.Argument(['words'], nargs=-1), click.Option(['--fail'], is_flag=True)]
+
+        def run(self, words, fail):
+            click.echo(' '.join(words))
+            if fail:
+                raise click.ClickException('failed')
+
+    monkeypatch.setattr('qwcore.cli.get_plugins', lambda group, **kwargs: {'echo': Echo})
+    return build_command('testname', 'description', '1.0', 'group', batch_mode=True)
+
+
+def test_parse_invocations():
+    lines = ['echo a "b c"\n', '\n', '# comment\n', '["echo", "d e"]\n']
+    assert list(batch.parse_invocations(lines)) == [['echo', 'a', 'b c'], ['echo', 'd e']]
+
+
+def test_parse_invocations_invalid():
+    lines = ["['echo']", '["echo", "a"', 'echo "a', 'echo b']
+    invocations = list(batch.parse_invocations(lines))
+    assert [i.line for i in invocations[:3]] == lines[:3]
+    assert all(isinstance(i, batch.InvalidInvocation) for i in invocations[:3])
+    assert invocations[3] == ['echo', 'b']
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_run_batch_invalid(command, processes):
+    invocations = batch.parse_invocations(['echo "a', 'echo b'])
+    results = list(batch.run_batch(command, invocations, prog_name='testname', workers=2, processes=processes))
+    assert [r['exit_code'] for r in results] == [2, 0]
+    assert results[0]['argv'] == 'echo "a'
+    assert results[0]['stderr'].startswith('Error: invalid invocation: ')
+    assert results[1]['stdout'] == 'b\n'
+
+
+@pytest.mark.parametrize('processes', [False, True])
+def test_run_batch(command, processes):
+    invocations = [['echo', str(i)] for i in range(20)] + [['echo', 'x', '--fail'], ['bogus']]
+    results = list(batch.run_batch(command, invocations, prog_name='testname', workers=4,
+                                   processes=processes))
+    assert [r['index'] for r in results] == list(range(22))
+    assert [r['stdout'] for r in results[:20]] == ['%d\n' % i for i in range(20)]
+    assert all(r['exit_code'] == 0 and r['stderr'] == '' for r in results[:20])
+    assert results[20] == {'index': 20, 'argv': ['echo', 'x', '--fail'], 'exit_code': 1,
+                           'stdout': 'x\n', 'stderr': 'Error: failed\n'}
+    assert results[21]['exit_code'] == 2
+
+
+def test_run_batch_no_fork(command, monkeypatch):
+    monkeypatch.setattr('qwcore.batch.sys.platform', 'darwin')
+    monkeypatch.setattr('qwcore.batch.multiprocessing.get_context', pytest.fail)
+    results = list(batch.run_batch(command, [['echo', 'a']], processes=True))
+    assert results[0]['stdout'] == 'a\n'
+
+
+def test_run_batch_unordered(command):
+    invocations = [['echo', str(i)] for i in range(10)]
+    results = list(batch.run_batch(command, invocations, workers=3, ordered=False))
+    assert sorted(r['stdout'] for r in results) == sorted('%d\n' % i for i in range(10))
+
+
+def test_batch_command(command, tmpdir, capsys):
+    source = tmpdir.join('batch.txt')
+    source.write('echo a\n["echo", "b"]\nbatch x\n')
+    with pytest.raises(SystemExit) as e:
+        command.main(['batch', str(source), '--workers', '2'], prog_name='testname')
+    assert e.value.code == 1
+    results = [json.loads(line) for line in capsys.readouterr().out.splitlines()]
+    assert [(r['stdout'], r['exit_code']) for r in results] == [('a\n', 0), ('b\n', 0), ('', 2)]
+
+
+def test_batch_command_no_workers(command, tmpdir, capsys):
+    source = tmpdir.join('batch.txt')
+    source.write('echo a\n')
+    with pytest.raises(SystemExit) as e:
+        command.main(['batch', str(source), '--workers', '0'], prog_name='testname')
+    assert e.value.code == 2
+    assert "Invalid value for '--workers'" in capsys.readouterr().err
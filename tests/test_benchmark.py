@@ -0,0 +1,28 @@
+import json
+import sys
+
+from tests import benchmark
+
+
+def test_run_benchmarks():
+    path = list(sys.path)
+    results = benchmark.run_benchmarks(dists=2, entry_points=2, config_sections=(2,), lookups=10, repeat=1)
+    assert 'discovery.cold.importlib' in results
+    assert 'cli.help.manifest' in results
+    assert 'config.snapshot.2.x10' in results
+    assert all(seconds >= 0 for seconds in results.values())
+    assert sys.path == path
+
+
+def test_compare():
+    baseline = {'fast': 1.0, 'slow': 1.0}
+    assert benchmark.compare({'fast': 1.1, 'slow': 2.0, 'new': 1.0}, baseline) == [('slow', 2.0, 1.0)]
+
+
+def test_main_baseline(tmpdir, monkeypatch):
+    monkeypatch.setattr('tests.benchmark.run_benchmarks', lambda **kwargs: {'bench': 2.0})
+    baseline = tmpdir.join('baseline.json')
+    baseline.write(json.dumps({'results': {'bench': 1.0}}))
+    output = tmpdir.join('output.json')
+    assert benchmark.main(['--output', str(output), '--baseline', str(baseline)]) == 1
+    assert json.loads(output.read())['results'] == {'bench': 2.0}
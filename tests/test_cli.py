@@ -2,6 +2,8 @@ import click
 from mock import Mock, call
 
 from qwcore.cli import build_command
+from qwcore.exception import PluginNameNotFoundError
+from qwcore.manifest import serialize_param
 
 
 def test_build_command(monkeypatch):
@@ -26,7 +28,7 @@ def test_build_command(monkeypatch):
 
     subcommands = {'Cmd1': Cmd1, 'Cmd2': Cmd2}
 
-    def get_plugins(group, name=None):
+    def get_plugins(group, name=None, **kwargs):
         return subcommands
 
     monkeypatch.setattr('qwcore.cli.get_plugins', get_plugins)
@@ -62,7 +64,7 @@ def test_build_command_set_project_app(monkeypatch):
 
     subcommands = {'Cmd1': Cmd1}
 
-    def get_plugins(group, name=None):
+    def get_plugins(group, name=None, **kwargs):
         return subcommands
 
     monkeypatch.setattr('qwcore.cli.get_plugins', get_plugins)
@@ -74,3 +76,71 @@ def test_build_command_set_project_app(monkeypatch):
         pass
     assert Cmd1.project_name == 'project_test'
     assert Cmd1.app_name == 'app_test'
+
+
+def test_build_command_lazy(monkeypatch):
+
+    class Cmd1:
+        """Cmd1 doc"""
+        name = 'Cmd1'
+        help = 'help'
+        params = []
+
+    Cmd1.run = Mock()
+
+    loaded = []
+
+    def get_plugin(group, name, **kwargs):
+        if name != 'Cmd1':
+            raise PluginNameNotFoundError()
+        loaded.append(name)
+        return Cmd1
+
+    monkeypatch.setattr('qwcore.cli.get_plugin', get_plugin)
+    monkeypatch.setattr('qwcore.cli.get_plugin_names', lambda group, **kwargs: ['Cmd1', 'Cmd2'])
+    monkeypatch.setattr('qwcore.cli.get_plugins', Mock(side_effect=AssertionError))
+
+    cmd = build_command('testname', 'description', '1.0', 'group', lazy=True)
+    ctx = click.Context(cmd)
+    assert cmd.list_commands(ctx) == ['Cmd1', 'Cmd2']
+    assert 'Cmd1' in cmd.get_help(ctx)
+    assert 'Cmd2' in cmd.get_help(ctx)
+    assert loaded == []
+    assert cmd.get_command(ctx, 'Bogus') is None
+    try:
+        cmd.main(['Cmd1'])
+    except SystemExit:
+        pass
+    assert loaded == ['Cmd1']
+    assert Cmd1.run.mock_calls == [call()]
+
+
+def test_build_command_manifest(monkeypatch):
+
+    class Cmd1:
+        """Cmd1 doc"""
+        name = 'Cmd1'
+        help = 'help'
+        params = [click.Option(['--yo'], is_flag=True, help='Yo')]
+
+    Cmd1.run = Mock()
+
+    entry = {'short_help': 'help', 'help': 'Cmd1 doc', 'params': [serialize_param(p) for p in Cmd1.params]}
+    monkeypatch.setattr('qwcore.cli.get_manifest', lambda group, **kwargs: {'commands': {'Cmd1': entry}})
+    get_plugin = Mock(return_value=Cmd1)
+    monkeypatch.setattr('qwcore.cli.get_plugin', get_plugin)
+
+    cmd = build_command('testname', 'description', '1.0', 'group', use_manifest=True)
+    ctx = click.Context(cmd)
+    assert 'Cmd1  help' in cmd.get_help(ctx)
+    assert 'Cmd1 doc' in cmd.get_command(ctx, 'Cmd1').get_help(ctx)
+    try:
+        cmd.main(['Cmd1', '--help'])
+    except SystemExit:
+        pass
+    assert get_plugin.mock_calls == []
+    try:
+        cmd.main(['Cmd1', '--yo'])
+    except SystemExit:
+        pass
+    assert Cmd1.run.mock_calls == [call(yo=True)]
@@ -0,0 +1,84 @@
+import io
+import sys
+
+import click
+import pytest
+
+from qwcore import complete
+from qwcore.cli import build_command
+
+
+@pytest.fixture
+def command(monkeypatch, tmpdir):
+
+    class Cmd1:
+        """Cmd1 doc"""
+        name = 'Cmd1'
+        help = 'help one'
+        params = [click.Option(['--yo'], is_flag=True, help='Yo'),
+                  click.Option(['--mode'], type=click.Choice(['fast', 'slow']), help='Mode'),
+                  click.Option(['--out'], type=click.Path(), help='Out'),
+                  click.Argument(['src'], type=click.Path(file_okay=False))]
+
+        def run(self, **kwargs):
+            pass
+
+    class Cmd2:
+        """Cmd2 doc"""
+        name = 'Cmd2'
+        help = 'help: two'
+        params = []
+
+        def run(self):
+            pass
+
+    monkeypatch.setattr('qwcore.cli.get_plugins', lambda group, **kwargs: {'Cmd1': Cmd1, 'Cmd2': Cmd2})
+    monkeypatch.setattr('qwcore.cache.cache_dir', lambda: str(tmpdir))
+    monkeypatch.setattr('qwcore.cache.dists_fingerprint', lambda: 'fp')
+    return build_command('testname', 'description', '1.0', 'group', fast_completion=True)
+
+
+def click_completion(command, monkeypatch, capsys, environ):
+    for key, value in environ.items():
+        monkeypatch.setenv(key, value)
+    with pytest.raises(SystemExit):
+        command.main([], prog_name='testname')
+    return capsys.readouterr().out
+
+
+@pytest.mark.parametrize('shell', complete.SHELLS)
+@pytest.mark.parametrize('words', [
+    'testname ', 'testname C', 'testname -', 'testname --v', 'testname Cmd1 -', 'testname Cmd1 --yo -',
+    'testname Cmd1 --mode ', 'testname Cmd1 --mode f', 'testname Cmd1 --mode=s', 'testname Cmd1 --out ',
+    'testname Cmd1 ', 'testname Cmd1 src ', 'testname Cmd2 ',
+])
+def test_complete_like_click(command, monkeypatch, capsys, shell, words):
+    if shell == 'fish':
+        cwords = words.split()
+        environ = {'COMP_WORDS': words, 'COMP_CWORD': cwords[-1] if not words.endswith(' ') else ''}
+    else:
+        environ = {'COMP_WORDS': words, 'COMP_CWORD': str(len(words.split()) - (0 if words.endswith(' ') else 1))}
+    environ['_TESTNAME_COMPLETE'] = '%s_complete' % shell
+    assert complete.complete('testname', environ=environ) is False
+    expected = click_completion(command, monkeypatch, capsys, environ)
+    stdout = io.StringIO()
+    assert complete.complete('testname', environ=environ, stdout=stdout) is True
+    assert stdout.getvalue() == expected
+
+
+def test_table_stale(command, monkeypatch):
+    ctx = click.Context(command, info_name='testname')
+    complete.save_table('testname', complete.build_table(command, ctx))
+    assert sorted(complete.load_table('testname')['commands']) == ['Cmd1', 'Cmd2']
+    monkeypatch.setattr('qwcore.cache.dists_fingerprint', lambda: 'changed')
+    assert complete.load_table('testname') is None
+
+
+def test_complete_no_request():
+    assert complete.complete('testname', environ={}) is False
+
+
+def test_table_name_per_environment(monkeypatch):
+    name = complete.table_name('testname')
+    monkeypatch.setattr(sys, 'prefix', '/other/venv')
+    assert complete.table_name('testname') != name
@@ -1,3 +1,5 @@
+import threading
+
 from pretend import stub
 import pytest
 
@@ -25,7 +27,7 @@ def test_get_config(tmpdir, monkeypatch):
 
 
 def test_get_key_config_not_found(monkeypatch):
-    def get_config(appname):
+    def get_config(appname, cached=False):
         raise exception.ConfigFileNotFoundError()
     monkeypatch.setattr('qwcore.config.get_config', get_config)
     with pytest.raises(exception.ConfigFileNotFoundError):
@@ -33,14 +35,14 @@ def test_get_key_config_not_found(monkeypatch):
 
 
 def test_get_key_config_not_found_default(monkeypatch):
-    def get_config(appname):
+    def get_config(appname, cached=False):
         raise exception.ConfigFileNotFoundError()
     monkeypatch.setattr('qwcore.config.get_config', get_config)
     config.get_value('app', 'key', default='default') == 'default'
 
 
 def test_get_key_section_not_found(monkeypatch):
-    def get_config(appname):
+    def get_config(appname, cached=False):
         return {}
     monkeypatch.setattr('qwcore.config.get_config', get_config)
     with pytest.raises(exception.ConfigFileSectionNotFoundError):
@@ -48,14 +50,14 @@ def test_get_key_section_not_found(monkeypatch):
 
 
 def test_get_key_section_not_found_default(monkeypatch):
-    def get_config(appname):
+    def get_config(appname, cached=False):
         return {}
     monkeypatch.setattr('qwcore.config.get_config', get_config)
     config.get_value('app', 'key', section='section', default='default') == 'default'
 
 
 def test_get_key_key_not_found(monkeypatch):
-    def get_config(appname):
+    def get_config(appname, cached=False):
         return {'section': {}}
     monkeypatch.setattr('qwcore.config.get_config', get_config)
     with pytest.raises(exception.ConfigFileKeyNotFoundError):
@@ -63,14 +65,291 @@ def test_get_key_key_not_found(monkeypatch):
 
 
 def test_get_key_key_not_found_default(monkeypatch):
-    def get_config(appname):
+    def get_config(appname, cached=False):
         return {'section': {}}
     monkeypatch.setattr('qwcore.config.get_config', get_config)
     config.get_value('app', 'key', section='section', default='default') == 'default'
 
 
 def test_get_key_success(monkeypatch):
-    def get_config(appname):
+    def get_config(appname, cached=False):
         return {'section': {'key': 'value'}}
     monkeypatch.setattr('qwcore.config.get_config', get_config)
     config.get_value('app', 'key', section='section', default='default') == 'value'
+
+
+def test_get_config_cached(tmpdir, monkeypatch):
+    app_config_dir = tmpdir.mkdir('config')
+    app_config_dir.join('config').write('key = value')
+    monkeypatch.setattr('qwcore.config.AppDirs', lambda name: stub(user_config_dir=str(app_config_dir)))
+    config.invalidate()
+    first = config.get_config('app', cached=True)
+    assert config.get_config('app', cached=True) is first
+    assert config.get_config('app') is not first
+    config.invalidate('app')
+    assert config.get_config('app', cached=True) is not first
+
+
+def test_get_config_cache_revalidated(tmpdir, monkeypatch):
+    app_config_dir = tmpdir.mkdir('config')
+    config_file = app_config_dir.join('config')
+    config_file.write('key = value')
+    monkeypatch.setattr('qwcore.config.AppDirs', lambda name: stub(user_config_dir=str(app_config_dir)))
+    config.invalidate()
+    assert config.get_value('app', 'key') == 'value'
+    config_file.write('key = changed value')
+    assert config.get_value('app', 'key') == 'changed value'
+
+
+def test_get_values(monkeypatch):
+    def get_config(appname, cached=False):
+        return {'section': {'key1': 'value1', 'key2': 'value2'}}
+    monkeypatch.setattr('qwcore.config.get_config', get_config)
+    values = config.get_values('app', ['key1', 'key2', 'key3'], section='section', default='default')
+    assert values == {'key1': 'value1', 'key2': 'value2', 'key3': 'default'}
+
+
+def test_get_values_key_not_found(monkeypatch):
+    def get_config(appname, cached=False):
+        return {'key1': 'value1'}
+    monkeypatch.setattr('qwcore.config.get_config', get_config)
+    with pytest.raises(exception.ConfigFileKeyNotFoundError):
+        config.get_values('app', ['key1', 'key2'])
+
+
+def test_config_watcher(tmpdir, monkeypatch):
+    app_config_dir = tmpdir.mkdir('config')
+    config_file = app_config_dir.join('config')
+    config_file.write('key = value')
+    monkeypatch.setattr('qwcore.config.AppDirs', lambda name: stub(user_config_dir=str(app_config_dir)))
+    watcher = config.ConfigWatcher('app')
+    changes = []
+    watcher.add_callback(changes.append)
+    assert watcher.get_value('key') == 'value'
+    assert not watcher.reload()
+    config_file.write('key = changed value')
+    assert watcher.reload()
+    assert watcher.get_value('key') == 'changed value'
+    assert changes == [watcher.config]
+
+
+def test_config_watcher_keeps_last_good(tmpdir, monkeypatch):
+    app_config_dir = tmpdir.mkdir('config')
+    config_file = app_config_dir.join('config')
+    config_file.write('key = value')
+    monkeypatch.setattr('qwcore.config.AppDirs', lambda name: stub(user_config_dir=str(app_config_dir)))
+    watcher = config.ConfigWatcher('app')
+    config_file.write('bad content')
+    assert not watcher.reload()
+    assert watcher.get_value('key') == 'value'
+
+
+def test_config_watcher_not_found(tmpdir, monkeypatch):
+    monkeypatch.setattr('qwcore.config.AppDirs', lambda name: stub(user_config_dir=str(tmpdir)))
+    watcher = config.ConfigWatcher('app')
+    assert watcher.get_value('key', default='default') == 'default'
+    with pytest.raises(exception.ConfigFileNotFoundError):
+        watcher.get_value('key')
+
+
+def test_config_watcher_thread(tmpdir, monkeypatch):
+    app_config_dir = tmpdir.mkdir('config')
+    config_file = app_config_dir.join('config')
+    config_file.write('key = value')
+    monkeypatch.setattr('qwcore.config.AppDirs', lambda name: stub(user_config_dir=str(app_config_dir)))
+    watcher = config.ConfigWatcher('app', interval=0.05)
+    changed = threading.Event()
+    watcher.add_callback(lambda config: changed.set())
+    watcher.start()
+    try:
+        config_file.write('key = changed value')
+        assert changed.wait(5)
+    finally:
+        watcher.stop()
+    assert watcher.get_value('key') == 'changed value'
+
+
+def test_compile_config():
+    parsed = {
+        'name': 'app',
+        'hosts': ['a', 'b'],
+        'db': {'port': '5432', 'debug': 'yes', 'replica': {'port': '5433'}},
+    }
+    schema = {'db.port': int, 'db.debug': bool, 'db.replica.port': int}
+    snapshot = config.compile_config(parsed, schema=schema)
+    assert snapshot['name'] == 'app'
+    assert snapshot['hosts'] == ('a', 'b')
+    assert snapshot['db.port'] == 5432
+    assert snapshot['db.debug'] is True
+    assert snapshot.get('db.replica.port') == 5433
+    assert snapshot.get('bogus', 'default') == 'default'
+    assert snapshot.section('db')['port'] == 5432
+    assert snapshot.section('db.replica').get('port') == 5433
+    with pytest.raises(exception.ConfigFileKeyNotFoundError):
+        snapshot['bogus']
+    with pytest.raises(exception.ConfigFileSectionNotFoundError):
+        snapshot.section('bogus')
+
+
+def test_compile_config_invalid_value():
+    with pytest.raises(exception.ConfigValueError):
+        config.compile_config({'db': {'port': 'bogus'}}, schema={'db.port': int})
+
+
+def test_get_snapshot(tmpdir, monkeypatch):
+    app_config_dir = tmpdir.mkdir('config')
+    config_file = app_config_dir.join('config')
+    config_file.write('[db]\nport = 5432')
+    monkeypatch.setattr('qwcore.config.AppDirs', lambda name: stub(user_config_dir=str(app_config_dir)))
+    config.invalidate()
+    schema = {'db.port': int}
+    snapshot = config.get_snapshot('app', schema=schema)
+    assert snapshot['db.port'] == 5432
+    assert config.get_snapshot('app', schema=schema) is snapshot
+    assert config.get_snapshot('app', schema={'db.port': int}) is snapshot
+    assert config.get_snapshot('app', schema={'db.port': str}) is not snapshot
+    config_file.write('[db]\nport = 15432')
+    assert config.get_snapshot('app', schema=schema)['db.port'] == 15432
+
+
+def patch_layers(tmpdir, monkeypatch):
+    system_dir = tmpdir.mkdir('system')
+    user_dir = tmpdir.mkdir('user')
+    monkeypatch.setattr('qwcore.config.AppDirs',
+                        lambda name: stub(site_config_dir=str(system_dir), user_config_dir=str(user_dir)))
+    return system_dir.join('config'), user_dir.join('config')
+
+
+def test_layered_config(tmpdir, monkeypatch):
+    system_file, user_file = patch_layers(tmpdir, monkeypatch)
+    system_file.write('name = system\n[db]\nhost = system\nport = 1\nuser = system')
+    user_file.write('[db]\nhost = user\nport = 2')
+    environ = {'APP_DB_PORT': '3', 'APP_EXTRA_KEY': 'env', 'OTHER': 'ignored'}
+    layered = config.LayeredConfig('app', overrides={'db.user': 'cli'}, environ=environ)
+    assert layered['name'] == 'system'
+    assert layered['db.host'] == 'user'
+    assert layered['db.port'] == '3'
+    assert layered['db.user'] == 'cli'
+    assert layered.get('extra.key') == 'env'
+    assert layered.get('bogus', 'default') == 'default'
+    assert layered.sources() == {'name': 'system', 'db.host': 'user', 'db.port': 'env',
+                                 'db.user': 'cli', 'extra.key': 'env'}
+    with pytest.raises(exception.ConfigFileKeyNotFoundError):
+        layered['bogus']
+
+
+def test_layered_config_refresh(tmpdir, monkeypatch):
+    system_file, user_file = patch_layers(tmpdir, monkeypatch)
+    system_file.write('key = system')
+    environ = {}
+    layered = config.LayeredConfig('app', environ=environ)
+    assert layered.refresh() == []
+    user_file.write('key = user')
+    assert layered.refresh() == ['user']
+    assert layered.source('key') == 'user'
+    environ['APP_KEY'] = 'env'
+    assert layered.refresh() == ['env']
+    assert layered['key'] == 'env'
+    assert layered.set_overrides({'key': 'cli'}) == ['cli']
+    assert layered['key'] == 'cli'
+
+
+def test_get_layered_config_overrides(tmpdir, monkeypatch):
+    system_file, user_file = patch_layers(tmpdir, monkeypatch)
+    system_file.write('key = system\nother = system')
+    config.invalidate()
+    first = config.get_layered_config('app', overrides={'key': 'first'})
+    second = config.get_layered_config('app', overrides={'key': 'second'})
+    # each invocation keeps its own cli layer over the shared file and env layers
+    assert (first['key'], second['key']) == ('first', 'second')
+    assert first.source('key') == 'cli'
+    assert first.get('other') == 'system'
+    assert first.sources() == {'key': 'cli', 'other': 'system'}
+    shared = config.get_layered_config('app')
+    assert first.layered is second.layered is shared
+    assert shared['key'] == 'system'
+
+
+LAZY_CONFIG = '''root = yes
+[one]
+key = 1
+  [[sub]]
+  key = sub
+[ "two" ]  # comment
+key = 2
+'''
+
+
+def test_lazy_config(tmpdir, monkeypatch):
+    config_file = tmpdir.join('config')
+    config_file.write(LAZY_CONFIG)
+    parsed = []
+    real_parse = config.LazyConfig._parse
+
+    def parse(self, start, end):
+        parsed.append(start)
+        return real_parse(self, start, end)
+    monkeypatch.setattr(config.LazyConfig, '_parse', parse)
+    lazy = config.LazyConfig(str(config_file))
+    assert lazy.sections == ['one', 'two']
+    assert lazy['two']['key'] == '2'
+    assert len(parsed) == 1
+    assert lazy['one']['sub']['key'] == 'sub'
+    assert lazy['one'] is lazy['one']
+    assert lazy['root'] == 'yes'
+    assert 'one' in lazy and 'root' in lazy and 'bogus' not in lazy
+    assert lazy.get('bogus') is None
+    assert len(parsed) == 3
+    assert tmpdir.join('config.index').check()
+
+
+def test_lazy_config_persisted_index(tmpdir, monkeypatch):
+    config_file = tmpdir.join('config')
+    config_file.write(LAZY_CONFIG)
+    config.LazyConfig(str(config_file))
+
+    def scan(config_file, size):
+        raise AssertionError("config file scanned")
+    monkeypatch.setattr(config, '_scan_sections', scan)
+    assert config.LazyConfig(str(config_file))['one']['key'] == '1'
+
+
+def test_lazy_config_multiline_values(tmpdir):
+    config_file = tmpdir.join('config.ini')
+    config_file.write('root = """\n[fake]\n"""\n'
+                      '[one]\n'
+                      "key = \'\'\'first\n"
+                      '  [other] """\n'
+                      "[one]\'\'\'\n"
+                      'single = """inline"""\n'
+                      '[two]\n'
+                      'key = 2\n')
+    lazy = config.LazyConfig(str(config_file))
+    assert lazy.sections == ['one', 'two']
+    assert lazy['root'] == '\n[fake]\n'
+    assert lazy['one']['key'] == 'first\n  [other] """\n[one]'
+    assert lazy['one']['single'] == 'inline'
+    assert lazy['two']['key'] == '2'
+
+
+def test_lazy_config_duplicate_section(tmpdir):
+    config_file = tmpdir.join('config')
+    config_file.write('[one]\n[one]\n')
+    with pytest.raises(exception.ConfigFileParserError):
+        config.LazyConfig(str(config_file))
+
+
+def test_get_value_lazy(tmpdir, monkeypatch):
+    app_config_dir = tmpdir.mkdir('config')
+    config_file = app_config_dir.join('config')
+    config_file.write(LAZY_CONFIG)
+    monkeypatch.setattr('qwcore.config.AppDirs', lambda name: stub(user_config_dir=str(app_config_dir)))
+    config.invalidate()
+    assert config.get_value('app', 'key', section='one', lazy=True) == '1'
+    assert config.get_lazy_config('app') is config.get_lazy_config('app')
+    assert config.get_values('app', ['root'], lazy=True) == {'root': 'yes'}
+    with pytest.raises(exception.ConfigFileSectionNotFoundError):
+        config.get_value('app', 'key', section='bogus', lazy=True)
+    config_file.write('[one]\nkey = changed value\n')
+    assert config.get_value('app', 'key', section='one', lazy=True) == 'changed value'
+    config.invalidate()
@@ -0,0 +1,166 @@
+import io
+import os
+import stat
+import threading
+
+import click
+import pytest
+
+from qwcore import daemon, metrics
+from qwcore.cli import build_command
+from qwcore.exception import DaemonAlreadyRunningError, DaemonSocketError
+
+
+@pytest.fixture
+def server(monkeypatch, tmpdir):
+
+    class Cmd1:
+        """Cmd1 doc"""
+        name = 'Cmd1'
+        help = 'help'
+        params = [click.Option(['--fail'], is_flag=True)]
+
+        def run(self, fail):
+            click.echo('%s %s' % (os.environ.get('QWCORE_TEST'), os.getcwd()))
+            click.echo('warning', err=True)
+            if fail:
+                raise click.ClickException('failed')
+
+    monkeypatch.setattr('qwcore.cli.get_plugins', lambda group, **kwargs: {'Cmd1': Cmd1})
+    command = build_command('testname', 'description', '1.0', 'group')
+    server = daemon.DaemonServer(command, str(tmpdir.join('test.sock')), prog_name='testname')
+    server.bind()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    yield server
+    server.stop()
+    thread.join()
+
+
+def test_run_client(server, tmpdir):
+    stdout, stderr = io.BytesIO(), io.BytesIO()
+    code = daemon.run_client(server.path, ['Cmd1'], environ={'QWCORE_TEST': 'yo'}, cwd=str(tmpdir),
+                             stdout=stdout, stderr=stderr)
+    assert code == 0, stderr.getvalue()
+    assert stdout.getvalue().decode('utf-8') == 'yo %s\n' % tmpdir
+    assert stderr.getvalue() == b'warning\n'
+    assert 'QWCORE_TEST' not in os.environ
+
+
+def test_run_client_env_vars(server, tmpdir):
+    stdout = io.BytesIO()
+    code = daemon.run_client(server.path, ['Cmd1'], environ={'QWCORE_TEST': 'yo'}, cwd=str(tmpdir),
+                             stdout=stdout, stderr=io.BytesIO(), env_vars=['HOME'])
+    assert code == 0
+    assert stdout.getvalue().decode('utf-8') == 'None %s\n' % tmpdir
+
+
+def test_forwarded_environ():
+    environ = {'PATH': '/bin', 'LC_ALL': 'C', 'QWCORE_X': '1', 'AWS_SECRET_ACCESS_KEY': 'secret'}
+    assert daemon.forwarded_environ(environ) == {'PATH': '/bin', 'LC_ALL': 'C', 'QWCORE_X': '1'}
+    assert daemon.forwarded_environ(environ, env_vars=['AWS_*']) == {'AWS_SECRET_ACCESS_KEY': 'secret'}
+
+
+def test_socket_private(server):
+    assert stat.S_IMODE(os.stat(server.path).st_mode) == 0o600
+
+
+def test_run_client_not_a_socket(tmpdir):
+    path = tmpdir.join('test.sock')
+    path.write('')
+    with pytest.raises(DaemonSocketError):
+        daemon.run_client(str(path), ['Cmd1'])
+
+
+def test_socket_path(monkeypatch, tmpdir):
+    monkeypatch.setenv('XDG_RUNTIME_DIR', str(tmpdir))
+    path = daemon.socket_path('app')
+    assert os.path.basename(path) == 'app.sock'
+    assert stat.S_IMODE(os.stat(os.path.dirname(path)).st_mode) == 0o700
+    os.chmod(os.path.dirname(path), 0o755)
+    with pytest.raises(DaemonSocketError):
+        daemon.socket_path('app')
+
+
+def test_run_client_exit_code(server, tmpdir):
+    stdout, stderr = io.BytesIO(), io.BytesIO()
+    code = daemon.run_client(server.path, ['Cmd1', '--fail'], environ={}, cwd=str(tmpdir),
+                             stdout=stdout, stderr=stderr)
+    assert code == 1
+    assert stderr.getvalue() == b'warning\nError: failed\n'
+    code = daemon.run_client(server.path, ['nope'], environ={}, cwd=str(tmpdir), stdout=stdout, stderr=stderr)
+    assert code == 2
+
+
+def test_already_running(server):
+    with pytest.raises(DaemonAlreadyRunningError):
+        daemon.DaemonServer(server.command, server.path).bind()
+
+
+def test_client_main_fallback(tmpdir):
+    assert daemon.client_main(str(tmpdir.join('missing.sock')), fallback=lambda: 'fallback') == 'fallback'
+
+
+def test_fork_server(monkeypatch, tmpdir):
+    calls = []
+
+    class Cmd1:
+        """Cmd1 doc"""
+        name = 'Cmd1'
+        help = 'help'
+        params = []
+
+        def run(self):
+            calls.append(os.getpid())
+            click.echo(len(calls))
+
+    monkeypatch.setattr('qwcore.cli.get_plugins', lambda group, **kwargs: {'Cmd1': Cmd1})
+    command = build_command('testname', 'description', '1.0', 'group')
+    server = daemon.ForkServer(command, str(tmpdir.join('test.sock')), max_children=1)
+    server.bind()
+    thread = threading.Thread(target=server.serve_forever)
+    thread.start()
+    try:
+        for _ in range(2):
+            stdout = io.BytesIO()
+            code = daemon.run_client(server.path, ['Cmd1'], environ={}, cwd=str(tmpdir), stdout=stdout,
+                                     stderr=io.BytesIO())
+            assert code == 0
+            # the state of each run stays in its child
+            assert stdout.getvalue() == b'1\n'
+    finally:
+        server.stop()
+        thread.join()
+    assert calls == []
+    assert server.children == set()
+
+
+def test_fork_server_flushes_metrics(monkeypatch, tmpdir):
+
+    class Cmd1:
+        """Cmd1 doc"""
+        name = 'Cmd1'
+        help = 'help'
+        params = []
+
+        def run(self):
+            pass
+
+    monkeypatch.setattr('qwcore.cli.get_plugins', lambda group, **kwargs: {'Cmd1': Cmd1})
+    command = build_command('testname', 'description', '1.0', 'group')
+    server = daemon.ForkServer(command, str(tmpdir.join('test.sock')), max_children=1)
+    server.bind()
+    thread = threading.Thread(target=server.serve_forever)
+    prom = tmpdir.join('metrics.prom')
+    metrics.enable(metrics.PrometheusTextExporter(str(prom)))
+    thread.start()
+    try:
+        code = daemon.run_client(server.path, ['Cmd1'], environ={}, cwd=str(tmpdir), stdout=io.BytesIO(),
+                                 stderr=io.BytesIO())
+        assert code == 0
+    finally:
+        server.stop()
+        thread.join()
+        metrics.disable()
+    # written by the child before it exited
+    assert 'qwcore_daemon_request_total 1' in prom.read().splitlines()
@@ -0,0 +1,60 @@
+from six import StringIO
+
+from qwcore import echo
+
+
+class Stream(StringIO):
+
+    def __init__(self, tty=False):
+        StringIO.__init__(self)
+        self.tty = tty
+        self.writes = 0
+
+    def isatty(self):
+        return self.tty
+
+    def write(self, s):
+        self.writes += 1
+        StringIO.write(self, s)
+
+
+def test_buffered():
+    stream = Stream()
+    with echo.buffered(stream=stream):
+        echo.info('info')
+        echo.success('success')
+        echo.error(1)
+        assert stream.getvalue() == ''
+    assert stream.getvalue() == 'info\nsuccess\n1\n'
+    assert stream.writes == 1
+
+
+def test_buffered_tty_colors():
+    stream = Stream(tty=True)
+    with echo.buffered(stream=stream):
+        echo.warning('warning')
+    assert stream.getvalue() == '\x1b[33mwarning\x1b[0m\n'
+
+
+def test_buffered_chunks():
+    stream = Stream()
+    with echo.buffered(stream=stream, chunk_size=10):
+        for i in range(4):
+            echo.info('12345')
+        assert stream.writes == 2
+    assert stream.getvalue() == '12345\n' * 4
+
+
+def test_buffered_nested():
+    stream = Stream()
+    with echo.buffered(stream=stream) as outer:
+        with echo.buffered() as inner:
+            echo.info('info')
+        assert inner is outer
+        assert stream.getvalue() == ''
+    assert stream.getvalue() == 'info\n'
+
+
+def test_unbuffered(capsys):
+    echo.success('success')
+    assert capsys.readouterr().out == 'success\n'
@@ -0,0 +1,103 @@
+import sys
+
+import click
+import pytest
+from mock import Mock
+
+from qwcore import complete, launcher
+from qwcore.cli import build_command
+
+
+class Cmd1:
+    """Cmd1 doc"""
+    name = 'Cmd1'
+    help = 'help'
+    params = [click.Option(['--yo'], is_flag=True)]
+
+
+@pytest.fixture
+def command(monkeypatch, tmpdir):
+    Cmd1.run = Mock()
+    monkeypatch.setattr('qwcore.cli.get_plugins', lambda group, **kwargs: {'Cmd1': Cmd1})
+    monkeypatch.setattr(launcher, 'table_path', lambda prog_name: str(tmpdir.join('launch-%s.json' % prog_name)))
+    monkeypatch.setenv('COLUMNS', '80')
+    return build_command('testname', 'description', '1.0', 'group')
+
+
+def run(capsys, *args, **kwargs):
+    with pytest.raises(SystemExit) as e:
+        launcher.launch(*args, **kwargs)
+    out, err = capsys.readouterr()
+    return out, err, e.value.code
+
+
+def no_target():
+    raise AssertionError("the click group was imported")
+
+
+def test_launch_fast_paths(command, monkeypatch, capsys):
+    slow_version = run(capsys, 'testname', command, argv=['--version'])
+    slow_listing = run(capsys, 'testname', command, argv=[])
+    slow_help = run(capsys, 'testname', command, argv=['--help'])
+    assert launcher.load_table('testname')['commands'] == ['Cmd1']
+    monkeypatch.setattr(launcher, '_load_target', no_target)
+    assert run(capsys, 'testname', 'bogus:cli', argv=['--version']) == slow_version
+    assert run(capsys, 'testname', 'bogus:cli', argv=[]) == slow_listing
+    assert run(capsys, 'testname', 'bogus:cli', argv=['--help']) == slow_help
+
+
+def test_launch_dispatch(command, monkeypatch, capsys):
+    run(capsys, 'testname', command, argv=['--version'])
+    monkeypatch.setattr(launcher, '_load_target', no_target)
+    monkeypatch.setattr('qwcore.cli.get_plugins', no_target)
+    monkeypatch.setattr('qwcore.cli.get_plugin', lambda group, name, **kwargs: Cmd1)
+    assert run(capsys, 'testname', 'bogus:cli', argv=['Cmd1', '--yo'])[2] == 0
+    Cmd1.run.assert_called_once_with(yo=True)
+
+
+def test_launch_added_command(command, monkeypatch, capsys):
+    calls = []
+    command.add_command(click.Command('added', callback=lambda: calls.append('added')))
+    run(capsys, 'testname', command, argv=['--version'])
+    table = launcher.load_table('testname')
+    assert table['commands'] == ['Cmd1', 'added']
+    assert table['plugin_commands'] == ['Cmd1']
+    # not known to a group rebuilt from the build args, so it takes the slow path
+    monkeypatch.setattr('qwcore.cli.get_plugin', no_target)
+    assert run(capsys, 'testname', command, argv=['added'])[2] == 0
+    assert calls == ['added']
+
+
+def test_launch_stale_table(command, monkeypatch, capsys):
+    run(capsys, 'testname', command, argv=['--version'])
+    monkeypatch.setattr(launcher, 'paths_signature', lambda paths=None: [['changed', 1]])
+    assert launcher.load_table('testname') is None
+    assert run(capsys, 'testname', command, argv=['--version'])[0] == '1.0\n'
+    assert launcher.load_table('testname') is not None
+
+
+def test_launch_slow_path(command, capsys):
+    run(capsys, 'testname', command, argv=['--version'])
+    assert run(capsys, 'testname', command, argv=['--debug', 'Cmd1'])[2] == 0
+    Cmd1.run.assert_called_once_with(yo=False)
+
+
+def test_launch_completion_fallback(command, monkeypatch, capsys, tmpdir):
+    monkeypatch.setattr('qwcore.cache.cache_dir', lambda: str(tmpdir))
+    command = build_command('testname', 'description', '1.0', 'group', fast_completion=True)
+    run(capsys, 'testname', command, argv=['--version'])
+    monkeypatch.setattr(launcher, '_fast_path', no_target)
+    monkeypatch.setenv('_TESTNAME_COMPLETE', 'bash_complete')
+    monkeypatch.setenv('COMP_WORDS', 'testname ')
+    monkeypatch.setenv('COMP_CWORD', '1')
+    # no completion table yet, so the real group answers and builds it
+    out, err, code = run(capsys, 'testname', command, argv=[])
+    assert code == 0
+    assert 'Cmd1' in out
+    assert complete.load_table('testname') is not None
+
+
+def test_table_path_per_environment(monkeypatch):
+    name = launcher.table_path('testname')
+    monkeypatch.setattr(sys, 'prefix', '/other/venv')
+    assert launcher.table_path('testname') != name
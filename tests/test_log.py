@@ -0,0 +1,129 @@
+import json
+import logging
+import os
+
+from six.moves import queue
+import pytest
+
+from qwcore import log
+from qwcore.log import BatchStreamListener, BoundedQueueHandler, JsonFormatter, configure_logging
+
+
+def make_record(msg, *args):
+    return logging.LogRecord('test', logging.INFO, __file__, 1, msg, args, None)
+
+
+def test_bounded_queue_handler_drop():
+    record_queue = queue.Queue(1)
+    handler = BoundedQueueHandler(record_queue, overflow='drop')
+    handler.handle(make_record('first'))
+    handler.handle(make_record('second'))
+    assert handler.dropped == 1
+    assert record_queue.get_nowait().msg == 'first'
+
+
+def test_bounded_queue_handler_drop_oldest():
+    record_queue = queue.Queue(1)
+    handler = BoundedQueueHandler(record_queue, overflow='drop_oldest')
+    handler.handle(make_record('first'))
+    handler.handle(make_record('second %s', 'arg'))
+    assert handler.dropped == 1
+    assert record_queue.get_nowait().msg == 'second arg'
+
+
+def test_bounded_queue_handler_unknown_overflow():
+    with pytest.raises(ValueError):
+        BoundedQueueHandler(queue.Queue(1), overflow='bogus')
+
+
+def test_batch_stream_listener(tmpdir):
+    record_queue = queue.Queue()
+    stream = tmpdir.join('log').open('w')
+    listener = BatchStreamListener(record_queue, logging.Formatter('%(levelname)s %(message)s'), stream=stream,
+                                   batch_size=2)
+    for i in range(5):
+        record_queue.put(make_record('msg %s', i))
+    listener.start()
+    listener.stop()
+    stream.close()
+    assert tmpdir.join('log').read().splitlines() == ['INFO msg %s' % i for i in range(5)]
+
+
+def test_batch_stream_listener_sentinel_dropped(tmpdir):
+    record_queue = queue.Queue(2)
+    handler = BoundedQueueHandler(record_queue, overflow='drop_oldest')
+    stream = tmpdir.join('log').open('w')
+    listener = BatchStreamListener(record_queue, logging.Formatter('%(message)s'), stream=stream)
+    # stopping, with the sentinel pushed out by records logged during the stop
+    listener._stopping.set()
+    record_queue.put(None)
+    handler.handle(make_record('first'))
+    handler.handle(make_record('second'))
+    handler.handle(make_record('third'))
+    listener._monitor()
+    stream.close()
+    assert tmpdir.join('log').read().splitlines() == ['second', 'third']
+
+
+def test_configure_logging_queue(capsys):
+    handler = configure_logging('qwcore.test_queue', use_queue=True)
+    try:
+        logging.getLogger('qwcore.test_queue').info('hello %s', 'world')
+        handler.listener.stop()
+        assert capsys.readouterr().out == 'hello world\n'
+    finally:
+        logging.getLogger('qwcore.test_queue').removeHandler(handler)
+
+
+def test_after_fork(capsys):
+    logger = logging.getLogger('qwcore.test_after_fork')
+    handler = configure_logging('qwcore.test_after_fork', use_queue=True)
+    try:
+        parent_queue = handler.queue
+        log.after_fork()
+        assert handler.queue is not parent_queue
+        assert handler.listener.queue is handler.queue
+        logger.info('from the child')
+        log.stop_listeners()
+        assert capsys.readouterr().out == 'from the child\n'
+    finally:
+        logger.removeHandler(handler)
+
+
+def test_configure_logging_idempotent():
+    logger = logging.getLogger('qwcore.test_idempotent')
+    handler = configure_logging('qwcore.test_idempotent')
+    try:
+        assert configure_logging('qwcore.test_idempotent') is handler
+        assert logger.handlers == [handler]
+        other = configure_logging('qwcore.test_idempotent', log_format='%(levelname)s %(message)s')
+        assert logger.handlers == [other]
+    finally:
+        logger.handlers = []
+
+
+def test_json_formatter():
+    formatter = JsonFormatter({'app': 'app', 'version': '1.0'})
+    data = json.loads(formatter.format(make_record('hello %s', 'world')))
+    assert data['app'] == 'app'
+    assert data['version'] == '1.0'
+    assert data['level'] == 'INFO'
+    assert data['logger'] == 'test'
+    assert data['message'] == 'hello world'
+    assert data['pid'] == os.getpid()
+    assert 'exception' not in data
+    assert json.loads(JsonFormatter().format(make_record('hello')))['message'] == 'hello'
+
+
+def test_configure_logging_structured(capsys):
+    logger = logging.getLogger('qwcore.test_structured')
+    try:
+        configure_logging('qwcore.test_structured', structured=True, static_fields={'version': '1.0'})
+        logger.info('hello')
+        data = json.loads(capsys.readouterr().out)
+        assert data['app'] == 'qwcore.test_structured'
+        assert data['version'] == '1.0'
+        assert data['pid'] == os.getpid()
+        assert data['message'] == 'hello'
+    finally:
+        logger.handlers = []
@@ -0,0 +1,69 @@
+import sys
+
+import click
+
+from qwcore import manifest
+
+
+class Cmd1:
+    """Cmd1 doc"""
+    name = 'Cmd1'
+    help = 'help'
+    params = [
+        click.Option(['--yo'], is_flag=True, help='Yo'),
+        click.Option(['--shout/--no-shout'], default=False),
+        click.Option(['--count'], type=int, default=3, help='Count'),
+        click.Option(['--color'], type=click.Choice(['red', 'blue'])),
+        click.Option(['--path'], type=click.Path()),
+        click.Option(['-v', '--verbose'], count=True),
+        click.Argument(['names'], nargs=-1),
+    ]
+
+
+def patch_plugins(monkeypatch, tmpdir, version='1.0'):
+    monkeypatch.setattr('qwcore.cache.cache_dir', lambda: str(tmpdir))
+    monkeypatch.setattr('qwcore.manifest.get_plugins', lambda group, **kwargs: {'Cmd1': Cmd1})
+    monkeypatch.setattr('qwcore.manifest.get_plugin_projects', lambda group, **kwargs: {'Cmd1': 'proj'})
+    monkeypatch.setattr('qwcore.manifest.get_project_version', lambda project: version)
+
+
+def test_param_roundtrip():
+    ctx = click.Context(click.Command('Cmd1', params=Cmd1.params))
+    for param in Cmd1.params:
+        rebuilt = manifest.deserialize_param(manifest.serialize_param(param))
+        assert rebuilt.name == param.name
+        assert rebuilt.opts == param.opts
+        assert rebuilt.secondary_opts == param.secondary_opts
+        assert rebuilt.get_help_record(ctx) == param.get_help_record(ctx)
+
+
+def test_build_manifest_command_help(monkeypatch, tmpdir):
+    patch_plugins(monkeypatch, tmpdir)
+    entry = manifest.get_manifest('group')['commands']['Cmd1']
+    cmd = manifest.build_manifest_command('Cmd1', entry)
+    real = click.Command('Cmd1', short_help=Cmd1.help, help=Cmd1.__doc__, params=Cmd1.params)
+    assert cmd.get_help(click.Context(cmd)) == real.get_help(click.Context(real))
+
+
+def test_get_manifest_cached(monkeypatch, tmpdir):
+    patch_plugins(monkeypatch, tmpdir)
+    manifest.get_manifest('group')
+    assert tmpdir.join(manifest.manifest_name('group')).check()
+
+    def get_plugins(group, **kwargs):
+        raise AssertionError("plugins loaded")
+    monkeypatch.setattr('qwcore.manifest.get_plugins', get_plugins)
+    assert 'Cmd1' in manifest.get_manifest('group')['commands']
+
+
+def test_get_manifest_version_changed(monkeypatch, tmpdir):
+    patch_plugins(monkeypatch, tmpdir)
+    manifest.get_manifest('group')
+    patch_plugins(monkeypatch, tmpdir, version='2.0')
+    assert manifest.get_manifest('group')['versions'] == {'proj': '2.0'}
+
+
+def test_manifest_name_per_environment(monkeypatch):
+    name = manifest.manifest_name('group')
+    monkeypatch.setattr(sys, 'prefix', '/other/venv')
+    assert manifest.manifest_name('group') != name
@@ -0,0 +1,79 @@
+import socket
+
+from qwcore import metrics
+
+
+def test_disabled():
+    metrics.disable()
+    metrics.incr('counter')
+    with metrics.timer('timer'):
+        pass
+    assert metrics.snapshot() == {'counters': {}, 'timers': {}}
+
+
+def test_enabled():
+    events = []
+
+    class Exporter(object):
+
+        def counter(self, name, value):
+            events.append(('counter', name, value))
+
+        def timing(self, name, seconds):
+            events.append(('timing', name))
+
+        def flush(self, data):
+            events.append(('flush', data))
+
+    metrics.enable(Exporter())
+    try:
+        metrics.incr('counter')
+        metrics.incr('counter', 2)
+        with metrics.timer('timer'):
+            pass
+        data = metrics.snapshot()
+        metrics.flush()
+    finally:
+        metrics.disable()
+    assert data['counters'] == {'counter': 3}
+    assert data['timers']['timer']['count'] == 1
+    assert events == [('counter', 'counter', 1), ('counter', 'counter', 2), ('timing', 'timer'), ('flush', data)]
+
+
+def test_after_fork():
+    metrics.enable()
+    try:
+        metrics.incr('counter')
+        metrics.after_fork()
+        metrics.incr('other')
+        assert metrics.snapshot()['counters'] == {'other': 1}
+    finally:
+        metrics.disable()
+
+
+def test_prometheus_text_exporter(tmpdir):
+    path = tmpdir.join('metrics.prom')
+    exporter = metrics.PrometheusTextExporter(str(path))
+    exporter.flush({'counters': {'config.cache_hit': 3},
+                    'timers': {'plugin.load': {'count': 2, 'sum': 0.5, 'max': 0.3}}})
+    assert path.read().splitlines() == [
+        '# TYPE qwcore_config_cache_hit_total counter',
+        'qwcore_config_cache_hit_total 3',
+        '# TYPE qwcore_plugin_load_seconds summary',
+        'qwcore_plugin_load_seconds_count 2',
+        'qwcore_plugin_load_seconds_sum 0.5',
+    ]
+
+
+def test_statsd_exporter():
+    server = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+    server.bind(('127.0.0.1', 0))
+    server.settimeout(5)
+    try:
+        exporter = metrics.StatsdExporter(port=server.getsockname()[1])
+        exporter.counter('config.cache_hit', 1)
+        exporter.timing('plugin.load', 0.25)
+        assert server.recv(1024) == b'qwcore.config.cache_hit:1|c'
+        assert server.recv(1024) == b'qwcore.plugin.load:250.000|ms'
+    finally:
+        server.close()
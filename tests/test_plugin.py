@@ -1,11 +1,17 @@
 
+import sys
+import time
+
 import pkg_resources
 import pytest
+from mock import Mock
+from pretend import stub
 
+from qwcore import plugin
 from qwcore.plugin import _get_plugins, get_plugins, get_plugin
 from qwcore.exception import (PluginNameNotFoundError, NoPluginsFoundError,
                               DuplicatePluginError, PluginNameMismatchError,
-                              PluginNoNameAttributeError)
+                              PluginNoNameAttributeError, UnknownPluginBackendError)
 
 
 class PluginClass(object):
@@ -23,15 +29,17 @@ class PluginClassNoName(object):
 def patch_working_set(monkeypatch, plugin_class, no_ep=False, dupe=False):
     dist = pkg_resources.get_distribution('qwcore')
     if no_ep:
-        monkeypatch.setattr(dist, 'get_entry_map', lambda group: {})
+        monkeypatch.setattr(dist, 'get_entry_map', lambda group=None: {})
     else:
         ep = pkg_resources.EntryPoint.parse("testname = tests.test_plugin:%s" % plugin_class, dist=dist)
-        monkeypatch.setattr(dist, 'get_entry_map', lambda group: {'testname': ep})
+        monkeypatch.setattr(dist, 'get_entry_map', lambda group=None: {'foo': {'testname': ep}})
     if dupe:
         dists = [dist, dist]
     else:
         dists = [dist]
-    monkeypatch.setattr('qwcore.plugin.pkg_resources.WorkingSet.__iter__', lambda self: iter(dists))
+    monkeypatch.setattr('pkg_resources.WorkingSet.__iter__', lambda self: iter(dists))
+    monkeypatch.setattr('qwcore.plugin.DEFAULT_BACKEND', 'pkg_resources')
+    monkeypatch.setattr(plugin, '_REGISTRIES', {})
 
 
 def test_get_plugin(monkeypatch):
@@ -90,3 +98,184 @@ def test__get_plugins_no_plugins(monkeypatch):
     patch_working_set(monkeypatch, 'PluginClass', no_ep=True)
     with pytest.raises(NoPluginsFoundError):
         _get_plugins('foo')
+
+
+def patch_index(monkeypatch, tmpdir, plugin_class, fingerprint='fp'):
+    monkeypatch.setattr('qwcore.cache.cache_dir', lambda: str(tmpdir))
+    monkeypatch.setattr('qwcore.cache.dists_fingerprint', lambda: fingerprint)
+    index = {'foo': [['qwcore', 'testname', 'tests.test_plugin:%s' % plugin_class]]}
+    monkeypatch.setattr('qwcore.plugin._scan_entry_points', lambda backend=None: index)
+    monkeypatch.setattr(plugin, '_REGISTRIES', {})
+
+
+def test_get_plugin_index(monkeypatch, tmpdir):
+    patch_index(monkeypatch, tmpdir, 'PluginClass')
+    assert get_plugin('foo', 'testname', use_index=True) is PluginClass
+    assert tmpdir.join(plugin.index_cache_name()).check()
+
+
+def test_get_plugins_index_cached(monkeypatch, tmpdir):
+    patch_index(monkeypatch, tmpdir, 'PluginClass')
+    get_plugins('foo', use_index=True)
+    plugin.invalidate()
+
+    def scan(backend=None):
+        raise AssertionError("working set scanned")
+    monkeypatch.setattr('qwcore.plugin._scan_entry_points', scan)
+    assert get_plugins('foo', use_index=True) == {'testname': PluginClass}
+
+
+def test_get_plugins_index_invalidated(monkeypatch, tmpdir):
+    patch_index(monkeypatch, tmpdir, 'PluginClass')
+    get_plugins('foo', use_index=True)
+    patch_index(monkeypatch, tmpdir, 'PluginClassMismatch', fingerprint='changed')
+    with pytest.raises(PluginNameMismatchError):
+        get_plugins('foo', use_index=True)
+
+
+def test_get_plugins_index_non_matching_project(monkeypatch, tmpdir):
+    patch_index(monkeypatch, tmpdir, 'PluginClass')
+    with pytest.raises(NoPluginsFoundError):
+        get_plugins('foo', project='foo', use_index=True)
+
+
+def test_scan_entry_points(monkeypatch):
+    dist = pkg_resources.get_distribution('qwcore')
+    ep = pkg_resources.EntryPoint.parse("testname = tests.test_plugin:PluginClass", dist=dist)
+    monkeypatch.setattr(dist, 'get_entry_map', lambda: {'foo': {'testname': ep}})
+    monkeypatch.setattr('pkg_resources.WorkingSet.__iter__', lambda self: iter([dist]))
+    index = plugin._scan_entry_points('pkg_resources')
+    assert index == {'foo': [['qwcore', 'testname', 'tests.test_plugin:PluginClass']]}
+
+
+def patch_importlib(monkeypatch, plugin_class, no_ep=False, dupe=False):
+    eps = []
+    if not no_ep:
+        eps = [plugin.importlib_metadata.EntryPoint('testname', 'tests.test_plugin:%s' % plugin_class, 'foo')]
+    if dupe:
+        eps = eps * 2
+    dist = stub(metadata={'Name': 'qwcore'}, entry_points=eps)
+    monkeypatch.setattr(plugin.importlib_metadata, 'distributions', lambda: [dist])
+    monkeypatch.setattr('qwcore.plugin.DEFAULT_BACKEND', 'importlib')
+    monkeypatch.setattr(plugin, '_REGISTRIES', {})
+
+
+def test_get_plugins_importlib(monkeypatch):
+    patch_importlib(monkeypatch, 'PluginClass')
+    assert get_plugins('foo') == {'testname': PluginClass}
+    assert get_plugin('foo', 'testname') is PluginClass
+
+
+def test_get_plugins_importlib_extras(monkeypatch):
+    patch_importlib(monkeypatch, 'PluginClass [extra1, extra2]')
+    assert get_plugins('foo') == {'testname': PluginClass}
+    assert plugin._scan_entry_points('importlib')['foo'] == [['qwcore', 'testname', 'tests.test_plugin:PluginClass']]
+
+
+def test_get_plugins_importlib_project(monkeypatch):
+    patch_importlib(monkeypatch, 'PluginClass')
+    assert get_plugins('foo', project='qwcore') == {'testname': PluginClass}
+    with pytest.raises(NoPluginsFoundError):
+        get_plugins('foo', project='foo')
+
+
+def test__get_plugins_importlib_errors(monkeypatch):
+    patch_importlib(monkeypatch, 'PluginClassMismatch')
+    with pytest.raises(PluginNameMismatchError):
+        _get_plugins('foo', name='testname')
+    patch_importlib(monkeypatch, 'PluginClass', dupe=True)
+    with pytest.raises(DuplicatePluginError):
+        _get_plugins('foo', name='testname')
+    patch_importlib(monkeypatch, 'PluginClass', no_ep=True)
+    with pytest.raises(PluginNameNotFoundError):
+        _get_plugins('foo', name='testname')
+
+
+def test__get_plugins_unknown_backend():
+    with pytest.raises(UnknownPluginBackendError):
+        _get_plugins('foo', backend='bogus')
+
+
+def patch_entry_points(monkeypatch, loads):
+    eps = []
+    for i, load in enumerate(loads):
+        eps.append(stub(name='testname%d' % i, load=load))
+    monkeypatch.setattr(plugin, '_iter_entry_points', lambda group, **kwargs: iter(eps))
+
+
+def delayed(seconds, result=None, error=None):
+    def load():
+        time.sleep(seconds)
+        if error:
+            raise error
+        return result
+    return load
+
+
+def test_get_plugins_workers(monkeypatch):
+    plugins = [stub(name='testname%d' % i) for i in range(4)]
+    patch_entry_points(monkeypatch, [delayed(0.02 * (4 - i), result=p) for i, p in enumerate(plugins)])
+    assert get_plugins('foo', workers=4) == dict((p.name, p) for p in plugins)
+
+
+def test_get_plugins_workers_errors_in_order(monkeypatch):
+    patch_entry_points(monkeypatch, [delayed(0.05, error=ImportError('first')),
+                                     delayed(0, error=ImportError('second'))])
+    with pytest.raises(ImportError) as e:
+        get_plugins('foo', workers=2)
+    assert str(e.value) == 'first'
+    patch_entry_points(monkeypatch, [delayed(0.05, result=PluginClassMismatch),
+                                     delayed(0, error=ImportError('second'))])
+    with pytest.raises(PluginNameMismatchError):
+        get_plugins('foo', workers=2)
+
+
+def test_registry(monkeypatch, tmpdir):
+    scans = []
+    index = {'foo': [['qwcore', 'testname', 'tests.test_plugin:PluginClass']],
+             'bar': [['other', 'mismatch', 'tests.test_plugin:PluginClassMismatch']]}
+
+    def scan(backend=None):
+        scans.append(backend)
+        return index
+    monkeypatch.setattr('qwcore.plugin._scan_entry_points', scan)
+    monkeypatch.setattr('qwcore.cache.dists_fingerprint', Mock(side_effect=AssertionError))
+    site_dir = tmpdir.mkdir('site-packages')
+    site_dir.setmtime(1000)
+    monkeypatch.setattr(sys, 'path', sys.path + [str(site_dir)])
+    registry = plugin.PluginRegistry(backend='pkg_resources')
+    assert registry.get_plugins('foo') == {'testname': PluginClass}
+    assert registry.get_plugin('bar', 'mismatch') is PluginClassMismatch
+    assert registry.get_plugin_projects('bar') == {'mismatch': 'other'}
+    assert registry.groups() == ['bar', 'foo']
+    assert sorted(registry.projects()) == ['other', 'qwcore']
+    assert scans == ['pkg_resources']
+    ep = list(registry.iter_entry_points('foo'))[0][1]
+
+    index['foo'].append(['qwcore', 'testname2', 'tests.test_plugin:PluginClassNoName'])
+    assert not registry.refresh()
+    # a distribution installed in a sys.path directory
+    site_dir.setmtime(2000)
+    assert [e.name for _, e in registry.iter_entry_points('foo')] == ['testname', 'testname2']
+    assert len(scans) == 2
+    monkeypatch.setattr(sys, 'path', sys.path + ['/new/site-packages'])
+    assert registry.refresh()
+    assert len(scans) == 3
+    assert registry.refresh(force=True)
+    assert len(scans) == 4
+    # unchanged entry points keep their loaded plugin
+    assert list(registry.iter_entry_points('foo'))[0][1] is ep
+    assert ep._plugin is PluginClass
+
+
+def test_get_registry():
+    assert plugin.get_registry('importlib') is plugin.get_registry('importlib')
+    assert plugin.get_registry('importlib') is not plugin.get_registry('importlib', use_index=True)
+    with pytest.raises(UnknownPluginBackendError):
+        plugin.get_registry('bogus')
+
+
+def test_index_cache_name_per_environment(monkeypatch):
+    name = plugin.index_cache_name()
+    monkeypatch.setattr(sys, 'prefix', '/other/venv')
+    assert plugin.index_cache_name() != name
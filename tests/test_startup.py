@@ -0,0 +1,50 @@
+import sys
+
+from qwcore import startup
+
+
+def test_phase_inactive():
+    assert startup.active() is None
+    with startup.phase('nothing'):
+        pass
+
+
+def test_profile_phases_and_imports(tmpdir, monkeypatch):
+    tmpdir.join('qwcore_startup_test_mod.py').write('import json\nVALUE = 1\n')
+    monkeypatch.syspath_prepend(str(tmpdir))
+    monkeypatch.setattr('qwcore.startup.atexit.register', lambda *args: None)
+    profile = startup.start()
+    try:
+        with startup.phase('outer'):
+            with startup.phase('inner'):
+                __import__('qwcore_startup_test_mod')
+    finally:
+        assert startup.stop() is profile
+    data = profile.as_dict()
+    assert [(p['name'], p['depth']) for p in data['phases']] == [('outer', 0), ('inner', 1)]
+    assert [i['name'] for i in data['imports']] == ['qwcore_startup_test_mod']
+    assert 'qwcore_startup_test_mod' in '\n'.join(startup.format_report(data, min_ms=0))
+    assert profile._import_timer not in sys.meta_path
+    module_loader = sys.modules['qwcore_startup_test_mod'].__loader__
+    assert not isinstance(module_loader, startup._TimedLoader)
+    assert 'exec_module' not in vars(module_loader)
+    sys.modules.pop('qwcore_startup_test_mod', None)
+
+
+def test_start_from_environ(monkeypatch):
+    monkeypatch.setattr('qwcore.startup.start', lambda output=None: output or 'stderr')
+    assert startup.start_from_environ(argv=['cmd'], environ={}) is None
+    assert startup.start_from_environ(argv=['--profile-startup'], environ={}) == 'stderr'
+    assert startup.start_from_environ(argv=[], environ={startup.ENV_VAR: 'out.json'}) == 'out.json'
+
+
+def test_parse_importtime():
+    output = '\n'.join([
+        'import time: self [us] | cumulative | imported package',
+        'import time:       120 |        120 |   encodings.aliases',
+        'import time:       300 |        420 | encodings',
+    ])
+    assert startup.parse_importtime(output) == [
+        {'name': 'encodings.aliases', 'depth': 1, 'self_seconds': 0.00012, 'seconds': 0.00012},
+        {'name': 'encodings', 'depth': 0, 'self_seconds': 0.0003, 'seconds': 0.00042},
+    ]
@@ -0,0 +1,84 @@
+import importlib
+import sys
+
+import click
+import pytest
+
+pytest.importorskip('invoke')
+
+
+@click.group()
+def group():
+    """Test group"""
+
+
+@group.command()
+@click.option('--name', help='Name to greet.')
+def hello(name):
+    """Say hello"""
+
+
+@pytest.fixture
+def tasks(monkeypatch, tmpdir):
+    # tasks imports the project named after the cwd
+    monkeypatch.chdir(tmpdir.mkdir('qwcore'))
+    monkeypatch.delitem(sys.modules, 'qwcore.tasks', raising=False)
+    monkeypatch.setattr('qwcore.cache.cache_dir', lambda: str(tmpdir.join('cache')))
+    module = importlib.import_module('qwcore.tasks')
+    yield module
+    sys.modules.pop('qwcore.tasks', None)
+
+
+def test_load_click_command(tasks):
+    assert tasks._load_click_command('tests.test_tasks:group') is group
+    assert tasks._load_click_command('tests.test_tasks:group [extra]') is group
+    assert tasks._load_click_command('tests.test_tasks:tasks') is None
+    assert tasks._load_click_command('tests.test_tasks:missing') is None
+    assert tasks._load_click_command('tests.missing:group') is None
+
+
+def test_help_in_process(tasks):
+    helps = tasks._help_in_process(group, 'prog', ['hello'])
+    assert len(helps) == 2
+    assert helps[0].startswith('Usage: prog [OPTIONS] COMMAND [ARGS]...')
+    assert 'hello  Say hello' in helps[0]
+    assert helps[1].startswith('Usage: prog hello [OPTIONS]')
+    assert '--name TEXT  Name to greet.' in helps[1]
+    assert tasks._help_in_process(group, 'prog', ['hello', 'missing']) is None
+
+
+def test_write_if_changed(tasks, tmpdir):
+    path = str(tmpdir.join('index.rst'))
+    assert tasks.write_if_changed(path, 'one')
+    assert not tasks.write_if_changed(path, 'one')
+    assert tasks.write_if_changed(path, 'two')
+    assert tmpdir.join('index.rst').read() == 'two'
+
+
+def test_sync_dir(tasks, tmpdir):
+    src = tmpdir.mkdir('src')
+    src.join('same.rst').write('same')
+    src.join('changed.rst').write('new')
+    src.join('added.rst').write('added')
+    dest = tmpdir.mkdir('dest')
+    dest.join('same.rst').write('same')
+    dest.join('changed.rst').write('old')
+    dest.join('removed.rst').write('removed')
+    dest.join('same.rst').setmtime(1000)
+    dest.mkdir('subdir')
+    tasks.sync_dir(str(src), str(dest))
+    assert sorted(p.basename for p in dest.listdir()) == ['added.rst', 'changed.rst', 'same.rst', 'subdir']
+    assert dest.join('changed.rst').read() == 'new'
+    assert dest.join('added.rst').read() == 'added'
+    assert dest.join('same.rst').mtime() == 1000
+    tasks.sync_dir(str(src), str(tmpdir.join('new')))
+    assert sorted(p.basename for p in tmpdir.join('new').listdir()) == ['added.rst', 'changed.rst', 'same.rst']
+
+
+def test_inputs_unchanged(tasks):
+    assert not tasks.inputs_unchanged('rst_api', 'abc')
+    tasks.record_inputs('rst_api', 'abc')
+    tasks.record_inputs('install_editable', 'def')
+    assert tasks.inputs_unchanged('rst_api', 'abc')
+    assert not tasks.inputs_unchanged('rst_api', 'def')
+    assert tasks.inputs_unchanged('install_editable', 'def')
@@ -0,0 +1,34 @@
+import pytest
+
+from qwcore.watch import DirectoryWatcher
+
+
+def test_directory_watcher(tmpdir):
+    watcher = DirectoryWatcher(str(tmpdir))
+    try:
+        if not watcher.uses_inotify:
+            pytest.skip("inotify is not available")
+        assert not watcher.wait(0.01)
+        tmpdir.join('config').write('key = value')
+        assert watcher.wait(1)
+    finally:
+        watcher.close()
+
+
+def test_directory_watcher_recreated(tmpdir):
+    path = tmpdir.mkdir('config')
+    watcher = DirectoryWatcher(str(path))
+    try:
+        if not watcher.uses_inotify:
+            pytest.skip("inotify is not available")
+        path.remove()
+        assert watcher.wait(1)
+        # polled while it's missing
+        assert watcher.wait(0.01)
+        path.mkdir()
+        assert watcher.wait(0.01)
+        assert not watcher.wait(0.01)
+        path.join('config').write('key = value')
+        assert watcher.wait(1)
+    finally:
+        watcher.close()